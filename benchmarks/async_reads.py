@@ -0,0 +1,90 @@
+"""How many concurrent read requests one instance sustains, sync vs async.
+
+Serves fetch_records_list and detail_record twice. The sync main.py runs
+under functions-framework, with a thread per request and the psycopg2 pool.
+The async main_async.py runs under uvicorn, on one event loop with the
+asyncpg pool. Both use the stub Firebase verifier from load_entry.py, and
+both pools get the same --pool-size. Each endpoint is loaded at every
+--levels concurrency in turn. A level counts as sustained when it runs
+without errors and its p99 stays within --slo-ms. Needs the synthetic users
+from synthetic_data.py. The load is generated by the same keep-alive
+clients as load_test.py.
+
+    python benchmarks/async_reads.py [--levels 1,8,32,128,256] [--duration 10] [--slo-ms 250] [--output async.json]
+"""
+import argparse
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from sqlalchemy import create_engine, text  # noqa: E402
+
+import load_test  # noqa: E402
+import synthetic_data  # noqa: E402
+
+MODES = {'sync': None, 'async': 'main_async'}
+
+
+def sustained(levels):
+    """Highest concurrency that ran without errors within the p99 SLO, or 0."""
+    passing = [level for level, summary in levels.items() if summary['ok']]
+    return max(passing) if len(passing) > 0 else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--endpoints', default='fetch,detail')
+    parser.add_argument('--levels', default='1,8,32,128,256')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per concurrency level')
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--slo-ms', type=float, default=250)
+    parser.add_argument('--pool-size', type=int, default=10)
+    parser.add_argument('--prefix', default=synthetic_data.DEFAULT_PREFIX)
+    parser.add_argument('--port', type=int, default=8190)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args(argv)
+
+    engine = create_engine(synthetic_data.db_url)
+    with engine.connect() as connection:
+        targets = [tuple(row) for row in connection.execute(text(load_test.TARGETS_SQL), {'prefix': args.prefix, 'limit': 5000})]
+    if len(targets) == 0:
+        print(f"no {args.prefix}* records in the database, run synthetic_data.py first")
+        return 1
+
+    levels = [int(level) for level in args.levels.split(',')]
+    pool_env = {'DB_POOL_MAX_SIZE': str(args.pool_size), 'ASYNC_DB_POOL_MAX_SIZE': str(args.pool_size)}
+    results = {'config': vars(args), 'endpoints': {}}
+    port = args.port
+    for endpoint in args.endpoints.split(','):
+        results['endpoints'][endpoint] = {}
+        for mode, asgi_module in MODES.items():
+            server = load_test.FunctionServer(endpoint, port, asgi_module=asgi_module, env=pool_env)
+            port += 1
+            by_level = {}
+            try:
+                server.wait_ready()
+                for level in levels:
+                    summary = load_test.drive(endpoint, server.port, targets, args.duration, level, args.warmup)
+                    summary['ok'] = summary['errors'] == 0 and summary['p99_ms'] is not None and summary['p99_ms'] <= args.slo_ms
+                    by_level[level] = summary
+                    print(f"{endpoint:<8}{mode:<7}{level:>5} clients {summary['throughput_rps']:>9} req/s "
+                          f"p50 {summary['p50_ms']} p99 {summary['p99_ms']} errors {summary['errors']}")
+            finally:
+                server.stop()
+            results['endpoints'][endpoint][mode] = {'levels': by_level, 'sustained_concurrency': sustained(by_level)}
+
+    print(f"\nhighest concurrency with no errors and p99 <= {args.slo_ms:g} ms:")
+    for endpoint, modes in results['endpoints'].items():
+        print(f"  {endpoint:<8} sync {modes['sync']['sustained_concurrency']:>5}   async {modes['async']['sustained_concurrency']:>5}")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"saved {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,105 @@
+"""Measure cold-start cost of each function: import time and time-to-first-response.
+
+Every run starts a fresh interpreter in the function's directory, imports
+main.py and sends one POST to its handler, timing both from just before the
+import. Nothing is stubbed, so the first response includes Firebase and
+database setup. Without --user-token the token is rejected, and the run
+measures everything up to and including authentication. With a real token and
+the DB_* environment variables set, it measures a full read: the insert probe
+sends no groups and is rejected before any write, so no data changes.
+
+With --baseline REV the same probes are also run against a temporary git
+worktree of REV, which gives a before/after comparison.
+
+    python benchmarks/cold_start.py [--runs 5] [--user-token TOKEN] [--baseline REV]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROBE_DATE = "Sat, 15 Jun 2024 00:00:00 GMT"
+# function directory -> (handler, request body)
+FUNCTIONS = {
+    'insert_medical_record': ('insert_medical_record', {"id": None, "opd_type": 1, "opd_date": PROBE_DATE, "updated_at": PROBE_DATE, "groups": []}),
+    'fetch_function': ('fetch_records_list', {"page": {"page_id": 0, "page_limit": 20}}),
+    'detail_record': ('detail_record', {"id": 0}),
+    'export_function': ('export_medical_records', {"opd_date": PROBE_DATE}),
+    'stats_function': ('stats_summary', {"start_date": PROBE_DATE, "end_date": PROBE_DATE}),
+}
+RESULT_MARKER = 'COLD_START_RESULT '
+
+PROBE = r'''
+import json, sys, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+import flask
+app = flask.Flask("cold-start-probe")
+with app.test_request_context(method="POST", json=json.loads(sys.argv[2]), headers={"user-token": sys.argv[3]}):
+    getattr(main, sys.argv[1])(flask.request)
+responded = time.perf_counter()
+print("''' + RESULT_MARKER + r'''" + json.dumps({"import": imported - started, "first_response": responded - started}))
+'''
+
+
+def probe(tree, directory, user_token):
+    handler, body = FUNCTIONS[directory]
+    function_dir = os.path.join(tree, directory)
+    completed = subprocess.run(
+        [sys.executable, '-c', PROBE, handler, json.dumps(body), user_token],
+        cwd=function_dir, env=dict(os.environ, PYTHONPATH=function_dir),
+        capture_output=True, text=True,
+    )
+    for line in completed.stdout.splitlines():
+        if line.startswith(RESULT_MARKER):
+            return json.loads(line[len(RESULT_MARKER):])
+    raise RuntimeError(f"{directory} probe failed:\n{completed.stderr[-2000:]}")
+
+
+def measure(tree, runs, user_token):
+    """Return {directory: (median import seconds, median first-response seconds)}."""
+    results = {}
+    for directory in FUNCTIONS:
+        samples = [probe(tree, directory, user_token) for _ in range(runs)]
+        results[directory] = (
+            statistics.median(sample['import'] for sample in samples),
+            statistics.median(sample['first_response'] for sample in samples),
+        )
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--user-token', default='cold-start-probe-token')
+    parser.add_argument('--baseline', default=None, help='git revision to compare against')
+    args = parser.parse_args(argv)
+
+    trees = [('current', ROOT)]
+    worktree = None
+    if args.baseline:
+        worktree = tempfile.mkdtemp(prefix='cold-start-')
+        subprocess.run(['git', '-C', ROOT, 'worktree', 'add', '--detach', worktree, args.baseline], check=True, capture_output=True)
+        trees.insert(0, (args.baseline, worktree))
+
+    try:
+        print(f"median of {args.runs} fresh interpreters, milliseconds")
+        print(f"{'function':<24}{'tree':<14}{'import':>10}{'first response':>16}")
+        measured = [(label, measure(tree, args.runs, args.user_token)) for label, tree in trees]
+        for directory in FUNCTIONS:
+            for label, results in measured:
+                import_seconds, first_response_seconds = results[directory]
+                print(f"{directory:<24}{label[:12]:<14}{import_seconds * 1000:>10.1f}{first_response_seconds * 1000:>16.1f}")
+    finally:
+        if worktree is not None:
+            subprocess.run(['git', '-C', ROOT, 'worktree', 'remove', '--force', worktree], capture_output=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
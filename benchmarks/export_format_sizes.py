@@ -0,0 +1,98 @@
+"""Generation time and size of an export as xlsx, CSV and Parquet.
+
+Builds synthetic pivoted day rows, in the same shape as the rows
+fetch_export_rows returns, for sheets of --days lengths. Each sheet is then
+written in every format the way export_medical_records writes a month:
+xlsx through xlsxwriter cell by cell, CSV and Parquet through
+export_formats. The script prints the best time of --repeat runs and the
+output size. No database is needed. Parquet is skipped when pyarrow is
+not installed.
+
+    python benchmarks/export_format_sizes.py [--days 31,365,3650] [--repeat 20]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+from io import BytesIO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'export_function'))
+
+import export_formats  # noqa: E402
+import main as export_main  # noqa: E402
+
+
+def make_rows(days, rng):
+    day_rows = []
+    day = date(2024, 1, 1)
+    for _ in range(days):
+        day_row = {'opd_date': day}
+        for column in export_main.AGE_GROUP_COLUMNS:
+            day_row[column] = rng.randint(0, 40)
+        day_rows.append(day_row)
+        day += timedelta(days=1)
+    columns = export_main.sheet_columns_of(day_rows)
+    return export_main.dated_sheet_rows(day_rows, columns), ["Total"] + columns.sum(axis=0).tolist()
+
+
+def build_xlsx(sheet_rows, column_totals):
+    import xlsxwriter
+
+    output = BytesIO()
+    workbook = xlsxwriter.Workbook(output, {'in_memory': True})
+    worksheet = workbook.add_worksheet()
+    cell_format = workbook.add_format({'align': 'center'})
+    header_rows = len(export_main.EXPORT_HEADER_ROWS)
+    export_main.write_sheet_header(worksheet, cell_format)
+    export_main.write_rows(worksheet, header_rows, sheet_rows + [column_totals], cell_format)
+    export_main.write_sheet_summary(worksheet, header_rows + len(sheet_rows) + 3, column_totals, cell_format)
+    workbook.close()
+    return output.getvalue()
+
+
+FORMATS = {
+    'xlsx': build_xlsx,
+    'csv': export_formats.csv_sheet_bytes,
+    'parquet': export_formats.parquet_bytes,
+}
+
+
+def best_of(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(body)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days', default='31,365,3650')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    formats = dict(FORMATS)
+    if not export_formats.parquet_available():
+        print("(pyarrow not installed, parquet skipped)")
+        del formats['parquet']
+
+    rng = random.Random(0)
+    for days in [int(days) for days in args.days.split(',')]:
+        sheet_rows, column_totals = make_rows(days, rng)
+        print(f"\n{days} days, best of {args.repeat}")
+        print(f"  {'format':<10}{'ms':>10}{'speedup':>10}{'bytes':>12}")
+        xlsx_seconds = None
+        for name, build in formats.items():
+            seconds, size = best_of(lambda: build(sheet_rows, column_totals), args.repeat)
+            xlsx_seconds = xlsx_seconds or seconds
+            print(f"  {name:<10}{seconds * 1000:>10.2f}{xlsx_seconds / seconds:>9.1f}x{size:>12}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""Compare the old ORM + Python pivot export path with the single-query SQL pivot.
+
+Seeds one synthetic year of daily records for a benchmark user into the
+database configured by the DB_* environment variables, checks that both
+paths produce identical sheet rows for every month, and prints timings.
+
+    python benchmarks/export_pivot.py [--repeat 20]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'insert_medical_record'))
+sys.path.insert(0, os.path.join(ROOT, 'export_function'))
+
+from sqlalchemy import text  # noqa: E402
+
+import main as export_main  # noqa: E402
+from medical_core.models import Record, RecordGroup  # noqa: E402
+from rollups import rebuild_rollups  # noqa: E402
+
+BENCH_USER = 'bench-export-user'
+GROUP_NAMES = ['0-15 years', '15-60 years', '60+ years']
+
+
+def seed_year(session, year):
+    session.execute(text("DELETE FROM record_groups WHERE record_id IN (SELECT id FROM mo_records WHERE firebase_user_id = :u)"), {'u': BENCH_USER})
+    session.execute(text("DELETE FROM mo_records WHERE firebase_user_id = :u"), {'u': BENCH_USER})
+    rng = random.Random(year)
+    day = date(year, 1, 1)
+    while day.year == year:
+        # Leave roughly one day in seven empty so zero-filling is exercised
+        if rng.random() > 1 / 7:
+            record_id = session.execute(
+                text("INSERT INTO mo_records (opd_type, opd_date, updated_at, firebase_user_id) VALUES (1, :d, now(), :u) RETURNING id"),
+                {'d': day, 'u': BENCH_USER}
+            ).scalar()
+            for name in GROUP_NAMES:
+                session.execute(
+                    text("INSERT INTO record_groups (name, new_male, new_female, old_male, old_female, record_id) VALUES (:n, :a, :b, :c, :e, :r)"),
+                    {'n': name, 'a': rng.randint(0, 40), 'b': rng.randint(0, 40), 'c': rng.randint(0, 40), 'e': rng.randint(0, 40), 'r': record_id}
+                )
+        day += timedelta(days=1)
+    rebuild_rollups(session.connection(), BENCH_USER)
+    session.commit()
+
+
+def legacy_rows(session, month_start_date, month_end_date):
+    # The previous implementation: Record query, RecordGroup IN query, Python pivot
+    next_month_start_date = month_end_date + timedelta(days=1)
+    records = session.query(Record).filter(Record.firebase_user_id == BENCH_USER, Record.opd_date >= month_start_date, Record.opd_date < next_month_start_date).all()
+    export_date_map = {record.opd_date: record for record in records}
+    map_of_records = {}
+    if len(records) > 0:
+        groups = session.query(RecordGroup).filter(RecordGroup.record_id.in_([record.id for record in records])).all()
+        for group in groups:
+            map_of_records.setdefault(group.record_id, []).append(group)
+
+    rows = []
+    for i in range((month_end_date - month_start_date).days + 1):
+        date_row = month_start_date + timedelta(days=i)
+        excel_row = [date_row.strftime("%d-%m-%Y")]
+        record = export_date_map.get(date_row)
+        if record:
+            counts = {}
+            for group in map_of_records.get(record.id):
+                prefix = export_main.AGE_GROUPS[group.name]
+                for field in export_main.COUNT_FIELDS:
+                    counts[f"{prefix}_{field}"] = getattr(group, field)
+            excel_row.extend(export_main.sheet_columns_of([counts])[0].tolist())
+        else:
+            excel_row.extend([0] * 24)
+        rows.append(excel_row)
+    column_totals = [sum(col) for col in zip(*[row[1:] for row in rows])]
+    return rows, ["Total"] + column_totals
+
+
+def pivot_rows(session, month_start_date, month_end_date):
+    day_rows, month_rollup = export_main.fetch_export_rows(session, BENCH_USER, month_start_date, month_end_date)
+    rows = export_main.dated_sheet_rows(day_rows, export_main.sheet_columns_of(day_rows))
+    column_totals = export_main.sheet_columns_of([month_rollup])[0].tolist() if month_rollup else [0] * 24
+    return rows, ["Total"] + column_totals
+
+
+def months(year):
+    for month in range(1, 13):
+        start = date(year, month, 1)
+        end = (start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+        yield start, end
+
+
+def timed(fn, session, year, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for start, end in months(year):
+            fn(session, start, end)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--year', type=int, default=2023)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    session = export_main.Session()
+    try:
+        seed_year(session, args.year)
+        for start, end in months(args.year):
+            if legacy_rows(session, start, end) != pivot_rows(session, start, end):
+                print(f"MISMATCH in {start:%b %Y}")
+                return 1
+        legacy = timed(legacy_rows, session, args.year, args.repeat)
+        pivot = timed(pivot_rows, session, args.year, args.repeat)
+        print(f"12 monthly exports, best of {args.repeat}:")
+        print(f"  orm + python pivot : {legacy * 1000:8.1f} ms")
+        print(f"  single sql pivot   : {pivot * 1000:8.1f} ms ({legacy / pivot:.1f}x)")
+        return 0
+    finally:
+        session.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
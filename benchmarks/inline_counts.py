@@ -0,0 +1,174 @@
+"""Compare reads of the inline counts with the record_groups joins they replace.
+
+Copies the groups of the synthetic users from synthetic_data.py into a
+temporary table with the shape and covering index of record_groups, so the
+joins read only those users' groups. Three reads are compared: a record's
+detail, a 20-record detail batch, and a month of export rows. Each runs as
+the old join over the copy and as the current handler query on mo_records.
+For every --samples random record, both versions of a read must return the
+same rows before any of them is timed. Both run on one connection,
+alternating, and the median and p95 latency of each are printed together
+with the storage the groups took per record. Needs all migrations applied.
+
+    python benchmarks/inline_counts.py [--samples 500] [--prefix load-user-]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+sys.path.insert(0, os.path.join(ROOT, 'migrations'))
+
+from sqlalchemy import create_engine, text  # noqa: E402
+
+import synthetic_data  # noqa: E402
+from explain_check import load_function  # noqa: E402
+from load_test import TARGETS_SQL  # noqa: E402
+from medical_core.record_counts import AGE_GROUPS, COUNT_FIELDS  # noqa: E402
+
+COPY_GROUPS_SQL = """
+CREATE TEMPORARY TABLE legacy_groups AS
+SELECT g.id, g.name, g.new_male, g.new_female, g.old_male, g.old_female, g.record_id
+FROM record_groups g JOIN mo_records r ON r.id = g.record_id
+WHERE r.firebase_user_id LIKE :prefix || '%';
+CREATE INDEX ON legacy_groups (record_id) INCLUDE (name, new_male, new_female, old_male, old_female);
+ANALYZE legacy_groups;
+"""
+
+# The detail queries as they were before the counts moved onto mo_records
+JOIN_DETAIL_SQL = """
+SELECT r.id, r.opd_type, r.updated_at, r.opd_date, r.firebase_user_id, json_agg(g.*) AS groups
+FROM mo_records r
+LEFT JOIN legacy_groups g ON r.id = g.record_id
+WHERE r.id = %(id)s AND r.firebase_user_id = %(user_id)s
+GROUP BY r.id
+"""
+
+JOIN_DETAIL_BATCH_SQL = """
+SELECT r.id, r.opd_type, r.updated_at, r.opd_date, r.firebase_user_id, json_agg(g.*) AS groups
+FROM mo_records r
+LEFT JOIN legacy_groups g ON r.id = g.record_id
+WHERE r.id = ANY(%(ids)s) AND r.firebase_user_id = %(user_id)s
+GROUP BY r.id
+"""
+
+_pivot_columns = ",\n    ".join(
+    f"COALESCE(SUM(g.{field}) FILTER (WHERE g.name = '{name}'), 0) AS {prefix}_{field}"
+    for name, prefix in AGE_GROUPS.items() for field in COUNT_FIELDS
+)
+
+JOIN_EXPORT_SQL = f"""
+SELECT d.day::date AS opd_date,
+    {_pivot_columns}
+FROM generate_series(CAST(:start_date AS date), CAST(:end_date AS date), interval '1 day') AS d(day)
+LEFT JOIN mo_records r ON r.firebase_user_id = :user_id AND r.opd_date = d.day::date
+LEFT JOIN legacy_groups g ON g.record_id = r.id
+GROUP BY d.day
+ORDER BY d.day
+"""
+
+BATCH_IDS_SQL = """
+SELECT id FROM mo_records
+WHERE firebase_user_id = :user_id AND opd_date <= :opd_date
+ORDER BY opd_date DESC LIMIT 20
+"""
+
+STORAGE_SQL = """
+SELECT pg_total_relation_size('legacy_groups')::float / NULLIF(count(DISTINCT record_id), 0) FROM legacy_groups
+"""
+
+
+def month_of(day):
+    start = day.replace(day=1)
+    return start, (start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+
+
+def comparable(rows):
+    # Group rows in a stable order without their ids, which only the record_groups
+    # rows have, and counts as plain ints
+    result = []
+    for row in rows:
+        row = dict(row)
+        if 'groups' in row:
+            groups = row['groups'] if not isinstance(row['groups'], str) else json.loads(row['groups'])
+            groups = [{key: value for key, value in group.items() if key != 'id'} for group in groups]
+            row['groups'] = sorted(groups, key=lambda group: group['name'])
+        result.append({key: int(value) if isinstance(value, int) else value for key, value in row.items()})
+    return sorted(result, key=lambda row: str(row.get('id', row.get('opd_date'))))
+
+
+def reads(connection, samples, detail_main, export_main):
+    """Yield (read, join query, inline query) with each as a () -> rows callable."""
+    def driver(query, params):
+        return lambda: connection.exec_driver_sql(query, params).mappings().all()
+
+    def sqlalchemy(query, params):
+        return lambda: connection.execute(text(query), params).mappings().all()
+
+    for user_id, record_id, opd_date in samples:
+        yield ('detail', driver(JOIN_DETAIL_SQL, {'id': record_id, 'user_id': user_id}),
+               driver(detail_main.DETAIL_RECORD_QUERY.string, {'id': record_id, 'user_id': user_id}))
+        ids = [row[0] for row in connection.execute(text(BATCH_IDS_SQL), {'user_id': user_id, 'opd_date': opd_date})]
+        yield ('detail batch', driver(JOIN_DETAIL_BATCH_SQL, {'ids': ids, 'user_id': user_id}),
+               driver(detail_main.DETAIL_RECORDS_BATCH_QUERY.string, {'ids': ids, 'user_id': user_id}))
+        start_date, end_date = month_of(opd_date)
+        month = {'user_id': user_id, 'start_date': start_date, 'end_date': end_date}
+        yield ('export month', sqlalchemy(JOIN_EXPORT_SQL, month), sqlalchemy(export_main.EXPORT_RANGE_SQL, month))
+
+
+def timed(fn):
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--samples', type=int, default=500)
+    parser.add_argument('--prefix', default=synthetic_data.DEFAULT_PREFIX)
+    args = parser.parse_args(argv)
+
+    detail_main = load_function('detail_record')
+    export_main = load_function('export_function')
+    engine = create_engine(synthetic_data.db_url)
+    with engine.connect() as connection:
+        samples = [tuple(row) for row in connection.execute(text(TARGETS_SQL), {'prefix': args.prefix, 'limit': args.samples})]
+        if len(samples) == 0:
+            print(f"no {args.prefix}* records in the database, run synthetic_data.py first")
+            return 1
+        connection.execute(text(COPY_GROUPS_SQL), {'prefix': args.prefix})
+        join_bytes = connection.execute(text(STORAGE_SQL)).scalar()
+
+        pairs = list(reads(connection, samples, detail_main, export_main))
+        for read, join_query, inline_query in pairs:
+            if comparable(join_query()) != comparable(inline_query()):
+                print(f"MISMATCH in {read}: the join and the inline counts return different rows")
+                return 1
+        print(f"{len(samples)} samples return the same rows either way")
+
+        timings = {}
+        for read, join_query, inline_query in pairs:
+            timing = timings.setdefault(read, {'join': [], 'inline': []})
+            timing['join'].append(timed(join_query))
+            timing['inline'].append(timed(inline_query))
+        connection.rollback()
+
+    print(f"{'read':<14}{'join p50':>10}{'p95':>8}{'inline p50':>12}{'p95':>8}  ms")
+    for read, timing in timings.items():
+        join, inline = sorted(timing['join']), sorted(timing['inline'])
+        p95 = int(len(join) * 0.95)
+        print(f"{read:<14}{statistics.median(join) * 1000:>10.2f}{join[p95] * 1000:>8.2f}"
+              f"{statistics.median(inline) * 1000:>12.2f}{inline[p95] * 1000:>8.2f}"
+              f"  ({statistics.median(join) / statistics.median(inline):.1f}x)")
+    print(f"groups storage per record: {join_bytes or 0:.0f} bytes in record_groups rows and index, "
+          f"{4 * 12} bytes inline")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
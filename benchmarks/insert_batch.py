@@ -0,0 +1,95 @@
+"""Compare saving a month of OPD days one request at a time with one batch request.
+
+Runs insert_medical_record and insert_medical_records_batch in-process
+against the database configured by the DB_* environment variables, with
+Firebase auth replaced by a fixed benchmark user, and prints records/second
+for both paths.
+
+    python benchmarks/insert_batch.py [--days 30] [--repeat 5]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'insert_medical_record'))
+
+import flask  # noqa: E402
+from sqlalchemy import text  # noqa: E402
+
+import main as insert_main  # noqa: E402
+
+BENCH_USER = 'bench-insert-user'
+app = flask.Flask(__name__)
+
+
+def clear(session):
+    session.execute(text("DELETE FROM record_groups WHERE record_id IN (SELECT id FROM mo_records WHERE firebase_user_id = :u)"), {'u': BENCH_USER})
+    session.execute(text("DELETE FROM mo_records WHERE firebase_user_id = :u"), {'u': BENCH_USER})
+    session.execute(text("DELETE FROM opd_daily_rollups WHERE firebase_user_id = :u"), {'u': BENCH_USER})
+    session.execute(text("DELETE FROM opd_monthly_rollups WHERE firebase_user_id = :u"), {'u': BENCH_USER})
+    session.commit()
+
+
+def make_records(days, rng):
+    start = date(2023, 1, 1)
+    records = []
+    for i in range(days):
+        opd_date = (start + timedelta(days=i)).strftime("%a, %d %b %Y 00:00:00 GMT")
+        records.append({
+            "id": None,
+            "opd_type": 1,
+            "opd_date": opd_date,
+            "updated_at": opd_date,
+            "groups": [
+                {field: rng.randint(0, 40) for field in ("new_male", "new_female", "old_male", "old_female")}
+                for _ in range(3)
+            ],
+        })
+    return records
+
+
+def call(handler, body):
+    with app.test_request_context(method='POST', json=body):
+        handler(flask.request)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    insert_main.auth_user_by_token = lambda request: BENCH_USER
+    records = make_records(args.days, random.Random(0))
+    session = insert_main.Session()
+    single_best = batch_best = None
+    try:
+        for _ in range(args.repeat):
+            clear(session)
+            started = time.perf_counter()
+            for record in records:
+                call(insert_main.insert_medical_record, record)
+            elapsed = time.perf_counter() - started
+            single_best = elapsed if single_best is None else min(single_best, elapsed)
+
+            clear(session)
+            started = time.perf_counter()
+            call(insert_main.insert_medical_records_batch, {"records": records})
+            elapsed = time.perf_counter() - started
+            batch_best = elapsed if batch_best is None else min(batch_best, elapsed)
+        clear(session)
+    finally:
+        session.close()
+
+    print(f"{args.days} days, best of {args.repeat}:")
+    print(f"  single-record requests : {single_best * 1000:8.1f} ms  {args.days / single_best:8.1f} records/s")
+    print(f"  one batch request      : {batch_best * 1000:8.1f} ms  {args.days / batch_best:8.1f} records/s ({single_best / batch_best:.1f}x)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
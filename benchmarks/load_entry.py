@@ -0,0 +1,47 @@
+"""functions-framework / uvicorn source used by load_test.py.
+
+Loads the main.py of the function named by LOAD_TEST_FUNCTION (or the
+module named by LOAD_TEST_MODULE, e.g. main_async) and swaps Firebase for
+a stub verifier. The stub accepts any token of the form
+"load-test:<uid>" and rejects everything else. Everything after token
+verification still runs for real: the token cache, the pools, the queries
+and the response building.
+
+    LOAD_TEST_FUNCTION=fetch_function functions-framework --source benchmarks/load_entry.py --target fetch_records_list
+    LOAD_TEST_FUNCTION=fetch_function LOAD_TEST_MODULE=main_async uvicorn --app-dir benchmarks load_entry:app
+"""
+import importlib
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, os.environ['LOAD_TEST_FUNCTION']))
+
+import medical_core.auth as core_auth  # noqa: E402
+
+TOKEN_PREFIX = 'load-test:'
+
+
+class StubUser:
+    def __init__(self, uid):
+        self.uid = uid
+
+
+class StubFirebaseAuth:
+    """Stands in for firebase_admin.auth: verify_id_token and get_user only."""
+
+    def verify_id_token(self, id_token):
+        if not id_token.startswith(TOKEN_PREFIX):
+            raise ValueError('not a load-test token')
+        return {'uid': id_token[len(TOKEN_PREFIX):], 'exp': time.time() + 3600}
+
+    def get_user(self, uid):
+        return StubUser(uid)
+
+
+_stub_auth = StubFirebaseAuth()
+core_auth.firebase_auth = lambda: _stub_auth
+
+_module = importlib.import_module(os.environ.get('LOAD_TEST_MODULE', 'main'))
+globals().update({name: value for name, value in vars(_module).items() if not name.startswith('_')})
@@ -0,0 +1,335 @@
+"""End-to-end load test of the five functions against a local Postgres.
+
+Each function runs in its own functions-framework server, so it is served
+the same way as in production. The source is benchmarks/load_entry.py, which
+replaces Firebase with a stub verifier. Requests are spread over the
+synthetic users from synthetic_data.py, using records that really exist:
+inserts edit an existing day, fetch reads one of the first pages, detail
+opens a record, export builds that record's month and stats sums the three
+years up to it at a random granularity. Each endpoint is then driven for
+--duration seconds by --concurrency keep-alive clients in turn. The script
+reports throughput and p50/p95/p99 per endpoint and saves them as JSON, so
+two runs can be compared. With --consolidated the endpoints are served by
+one server/main.py process instead, under the same stub and the same load,
+so a per-function run and a consolidated run compare endpoint by endpoint.
+
+    python migrations/migrate.py
+    python benchmarks/load_test.py run --seed [--users 100] [--years 3]
+    python benchmarks/load_test.py run [--duration 30] [--concurrency 16] [--endpoints fetch,detail]
+    python benchmarks/load_test.py run --consolidated --output consolidated.json
+    python benchmarks/load_test.py compare before.json after.json
+"""
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from sqlalchemy import create_engine, text  # noqa: E402
+
+import synthetic_data  # noqa: E402
+
+ENTRY_SOURCE = os.path.join(ROOT, 'benchmarks', 'load_entry.py')
+SERVER_CONFIG = os.path.join(ROOT, 'server', 'gunicorn.conf.py')
+# Accepted by the stub verifier in load_entry.py as the token of user <uid>
+TOKEN_PREFIX = 'load-test:'
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+# endpoint -> (function directory, target)
+ENDPOINTS = {
+    'insert': ('insert_medical_record', 'insert_medical_record'),
+    'fetch': ('fetch_function', 'fetch_records_list'),
+    'detail': ('detail_record', 'detail_record'),
+    'export': ('export_function', 'export_medical_records'),
+    'stats': ('stats_function', 'stats_summary'),
+}
+
+TARGETS_SQL = """
+SELECT firebase_user_id, id, opd_date FROM mo_records
+WHERE firebase_user_id LIKE :prefix || '%'
+ORDER BY random() LIMIT :limit
+"""
+
+
+def http_date(day):
+    return day.strftime("%a, %d %b %Y 00:00:00 GMT")
+
+
+def request_body(endpoint, target, rng):
+    """Return the JSON body of one request to endpoint about target (user_id, record_id, opd_date)."""
+    _, record_id, opd_date = target
+    if endpoint == 'insert':
+        return {
+            "id": record_id,
+            "opd_type": 1,
+            "opd_date": http_date(opd_date),
+            "updated_at": http_date(date.today()),
+            "groups": [
+                {field: rng.randint(0, 40) for field in ("new_male", "new_female", "old_male", "old_female")}
+                for _ in range(3)
+            ],
+        }
+    if endpoint == 'fetch':
+        return {"page": {"page_id": rng.randrange(5), "page_limit": 20}}
+    if endpoint == 'detail':
+        return {"id": record_id}
+    if endpoint == 'stats':
+        return {"start_date": http_date(opd_date - timedelta(days=3 * 365)), "end_date": http_date(opd_date),
+                "granularity": rng.choice(["day", "week", "month", "year"])}
+    return {"opd_date": http_date(opd_date)}
+
+
+def succeeded(endpoint, response, payload):
+    if response.status != 200:
+        return False
+    if endpoint == 'export':
+        return response.getheader('Content-Type', '').startswith(XLSX_CONTENT_TYPE)
+    try:
+        return json.loads(payload)['response']['error'] == 0
+    except (ValueError, KeyError, TypeError):
+        return False
+
+
+class FunctionServer:
+    """One functions-framework process serving a single function on localhost.
+
+    With consolidated set, one gunicorn process of server/main.py (configured by
+    server/gunicorn.conf.py) serves every endpoint instead, each at /<target>.
+    """
+
+    def __init__(self, endpoint, port, asgi_module=None, env=None, consolidated=False):
+        self.endpoint = endpoint
+        self.port = port
+        self.log = tempfile.NamedTemporaryFile(prefix=f'load-{endpoint}-', suffix='.log', delete=False)
+        directory, target = ('server', None) if consolidated else ENDPOINTS[endpoint]
+        env = dict(os.environ, LOAD_TEST_FUNCTION=directory, **(env or {}))
+        if consolidated:
+            # The same stub entry, with main.py's WSGI app (or an async module's ASGI app)
+            # under the configured gunicorn worker model
+            if asgi_module is not None:
+                env['LOAD_TEST_MODULE'] = asgi_module
+                env.setdefault('SERVER_WORKER_CLASS', 'uvicorn.workers.UvicornWorker')
+            command = [sys.executable, '-m', 'gunicorn', '-c', SERVER_CONFIG, '--chdir', os.path.dirname(ENTRY_SOURCE),
+                       '--bind', f'127.0.0.1:{port}', 'load_entry:app']
+        elif asgi_module is None:
+            command = [sys.executable, '-m', 'functions_framework', '--source', ENTRY_SOURCE, '--target', target,
+                       '--host', '127.0.0.1', '--port', str(port)]
+        else:
+            # An async module's ASGI app, on uvicorn's single event loop
+            env['LOAD_TEST_MODULE'] = asgi_module
+            command = [sys.executable, '-m', 'uvicorn', '--app-dir', os.path.dirname(ENTRY_SOURCE),
+                       '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning', 'load_entry:app']
+        self.process = subprocess.Popen(command, env=env, stdout=self.log, stderr=subprocess.STDOUT)
+
+    def wait_ready(self, timeout=60):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                break
+            try:
+                connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=1)
+                connection.request('OPTIONS', '/')
+                if connection.getresponse().status == 200:
+                    return
+            except OSError:
+                time.sleep(0.2)
+        raise RuntimeError(f"{self.endpoint} server did not start, see {self.log.name}")
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.log.close()
+
+
+def client(endpoint, port, targets, seed, deadline, latencies, errors, path='/'):
+    rng = random.Random(seed)
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+    while deadline is None or time.monotonic() < deadline:
+        target = rng.choice(targets)
+        body = json.dumps(request_body(endpoint, target, rng))
+        headers = {'Content-Type': 'application/json', 'user-token': TOKEN_PREFIX + target[0]}
+        started = time.perf_counter()
+        try:
+            connection.request('POST', path, body=body, headers=headers)
+            response = connection.getresponse()
+            payload = response.read()
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+            errors.append(time.perf_counter() - started)
+            continue
+        elapsed = time.perf_counter() - started
+        if succeeded(endpoint, response, payload):
+            latencies.append(elapsed)
+        else:
+            errors.append(elapsed)
+        if deadline is None:
+            break
+    connection.close()
+
+
+def percentile(sorted_values, fraction):
+    # Nearest-rank percentile
+    if len(sorted_values) == 0:
+        return None
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def milliseconds(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+
+def drive(endpoint, port, targets, duration, concurrency, warmup, path='/'):
+    """Warm up, then load one endpoint and return its summary."""
+    for n in range(warmup):
+        client(endpoint, port, targets, -n - 1, None, [], [], path)
+
+    latencies, errors = [], []
+    deadline = time.monotonic() + duration
+    started = time.monotonic()
+    threads = [
+        threading.Thread(target=client, args=(endpoint, port, targets, n, deadline, latencies, errors, path))
+        for n in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    latencies.sort()
+    return {
+        'requests': len(latencies) + len(errors),
+        'errors': len(errors),
+        'throughput_rps': round(len(latencies) / elapsed, 2),
+        'mean_ms': milliseconds(sum(latencies) / len(latencies)) if len(latencies) > 0 else None,
+        'p50_ms': milliseconds(percentile(latencies, 0.50)),
+        'p95_ms': milliseconds(percentile(latencies, 0.95)),
+        'p99_ms': milliseconds(percentile(latencies, 0.99)),
+        'max_ms': milliseconds(latencies[-1]) if len(latencies) > 0 else None,
+    }
+
+
+def git_commit():
+    completed = subprocess.run(['git', '-C', ROOT, 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True)
+    return completed.stdout.strip() or None
+
+
+def print_results(results):
+    print(f"{'endpoint':<10}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for endpoint, summary in results['endpoints'].items():
+        print(f"{endpoint:<10}{summary['requests']:>10}{summary['errors']:>8}{summary['throughput_rps']:>10}"
+              f"{summary['p50_ms'] or '-':>10}{summary['p95_ms'] or '-':>10}{summary['p99_ms'] or '-':>10}")
+
+
+def run(args):
+    engine = create_engine(synthetic_data.db_url)
+    if args.seed:
+        records = synthetic_data.seed(engine, args.users, args.years, args.prefix)
+        print(f"seeded {args.users} users, {records} records")
+    with engine.connect() as connection:
+        targets = [tuple(row) for row in connection.execute(text(TARGETS_SQL), {'prefix': args.prefix, 'limit': args.targets})]
+    if len(targets) == 0:
+        print(f"no {args.prefix}* records in the database, run with --seed first")
+        return 1
+
+    endpoints = args.endpoints.split(',')
+    if args.consolidated:
+        server = FunctionServer('server', args.port, consolidated=True)
+        servers = {endpoint: server for endpoint in endpoints}
+    else:
+        servers = {endpoint: FunctionServer(endpoint, args.port + n) for n, endpoint in enumerate(endpoints)}
+    results = {
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'config': {
+            'duration_s': args.duration, 'concurrency': args.concurrency, 'warmup': args.warmup,
+            'prefix': args.prefix, 'targets': len(targets),
+            'deployment': 'consolidated' if args.consolidated else 'per-function',
+        },
+        'endpoints': {},
+    }
+    try:
+        for server in set(servers.values()):
+            server.wait_ready()
+        for endpoint, server in servers.items():
+            print(f"loading {endpoint} for {args.duration}s with {args.concurrency} clients")
+            path = f"/{ENDPOINTS[endpoint][1]}" if args.consolidated else '/'
+            results['endpoints'][endpoint] = drive(endpoint, server.port, targets, args.duration, args.concurrency, args.warmup, path)
+    finally:
+        for server in set(servers.values()):
+            server.stop()
+
+    print_results(results)
+    output = args.output or f"load_test_{datetime.now():%Y%m%d_%H%M%S}.json"
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"saved {output}")
+    return 1 if any(summary['errors'] > 0 for summary in results['endpoints'].values()) else 0
+
+
+def compare(args):
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    print(f"before {before.get('commit')} ({before['started_at']})  after {after.get('commit')} ({after['started_at']})")
+    print(f"{'endpoint':<10}{'metric':<16}{'before':>10}{'after':>10}{'change':>10}")
+    for endpoint, summary in after['endpoints'].items():
+        previous = before['endpoints'].get(endpoint)
+        if previous is None:
+            continue
+        for metric in ('throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms'):
+            old, new = previous[metric], summary[metric]
+            change = f"{(new - old) / old * 100:+.1f}%" if old and new is not None else '-'
+            print(f"{endpoint:<10}{metric:<16}{old if old is not None else '-':>10}{new if new is not None else '-':>10}{change:>10}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='load the functions and save the results')
+    run_parser.add_argument('--seed', action='store_true', help='generate synthetic data first')
+    run_parser.add_argument('--users', type=int, default=100)
+    run_parser.add_argument('--years', type=int, default=3)
+    run_parser.add_argument('--prefix', default=synthetic_data.DEFAULT_PREFIX)
+    run_parser.add_argument('--targets', type=int, default=5000, help='records sampled as request targets')
+    run_parser.add_argument('--endpoints', default=','.join(ENDPOINTS))
+    run_parser.add_argument('--duration', type=float, default=30, help='seconds per endpoint')
+    run_parser.add_argument('--concurrency', type=int, default=16)
+    run_parser.add_argument('--warmup', type=int, default=20, help='unmeasured requests per endpoint')
+    run_parser.add_argument('--port', type=int, default=8090, help='first of one port per endpoint')
+    run_parser.add_argument('--consolidated', action='store_true',
+                            help='serve every endpoint from one server/main.py process instead of one function each')
+    run_parser.add_argument('--output', default=None)
+    run_parser.set_defaults(handler=run)
+
+    compare_parser = commands.add_parser('compare', help='compare two saved runs')
+    compare_parser.add_argument('before')
+    compare_parser.add_argument('after')
+    compare_parser.set_defaults(handler=compare)
+
+    args = parser.parse_args(argv)
+    unknown = set(getattr(args, 'endpoints', '').split(',')) - set(ENDPOINTS) - {''}
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(sorted(unknown))}")
+    return args.handler(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,117 @@
+"""Compare the list and detail queries sent as plain SQL with their prepared statements.
+
+Runs the four statements of fetch_records_list and detail_record for
+--samples random records of the synthetic users from synthetic_data.py: a
+list page, a keyset page, one record's detail and a 20-record detail batch.
+Each runs as plain SQL and as its prepared Statement, on one pooled
+connection, alternating. The first check is that both ways return the same
+rows. The script then prints the median and p95 latency of each way,
+followed by prepared_statement_stats(). The hit rate there shows how often
+the statement was already prepared on the connection.
+
+    python benchmarks/prepared_statements.py [--samples 1000]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+sys.path.insert(0, os.path.join(ROOT, 'migrations'))
+
+from psycopg2.extras import RealDictCursor  # noqa: E402
+from sqlalchemy import create_engine, text  # noqa: E402
+
+import synthetic_data  # noqa: E402
+from explain_check import load_function  # noqa: E402
+from inline_counts import BATCH_IDS_SQL  # noqa: E402
+from load_test import TARGETS_SQL  # noqa: E402
+from medical_core.db import db_params  # noqa: E402
+from medical_core.db_pool import ConnectionPool  # noqa: E402
+from medical_core.prepared import prepared_statement_stats, reset_prepared_statement_stats  # noqa: E402
+
+
+def statement_runs(samples, batch_ids, fetch_main, detail_main):
+    """Yield (statement, params) for every sample, one of each of the four statements."""
+    for (user_id, record_id, opd_date), ids in zip(samples, batch_ids):
+        yield fetch_main.LIST_RECORDS_STATEMENT, {'user_id': user_id, 'limit': 20, 'offset': 20}
+        yield fetch_main.LIST_RECORDS_AFTER_CURSOR_STATEMENT, {
+            'user_id': user_id, 'limit': 20, 'cursor_date': opd_date, 'cursor_id': record_id}
+        yield detail_main.DETAIL_RECORD_STATEMENT, {'id': record_id, 'user_id': user_id}
+        yield detail_main.DETAIL_RECORDS_BATCH_STATEMENT, {'ids': ids, 'user_id': user_id}
+
+
+def run_plain(connection, statement, params):
+    with connection.cursor(cursor_factory=RealDictCursor) as cursor:
+        cursor.execute(statement.query, params)
+        rows = cursor.fetchall()
+    connection.rollback()
+    return rows
+
+
+def run_prepared(connection, statement, params):
+    with connection.cursor(cursor_factory=RealDictCursor) as cursor:
+        statement.execute(cursor, params)
+        rows = cursor.fetchall()
+    connection.rollback()
+    return rows
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - started
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--samples', type=int, default=1000)
+    parser.add_argument('--prefix', default=synthetic_data.DEFAULT_PREFIX)
+    args = parser.parse_args(argv)
+
+    fetch_main = load_function('fetch_function')
+    detail_main = load_function('detail_record')
+    engine = create_engine(synthetic_data.db_url)
+    with engine.connect() as connection:
+        samples = [tuple(row) for row in connection.execute(text(TARGETS_SQL), {'prefix': args.prefix, 'limit': args.samples})]
+        batch_ids = [
+            [row[0] for row in connection.execute(text(BATCH_IDS_SQL), {'user_id': user_id, 'opd_date': opd_date})]
+            for user_id, _, opd_date in samples
+        ]
+    if len(samples) == 0:
+        print(f"no {args.prefix}* records in the database, run synthetic_data.py first")
+        return 1
+
+    runs = list(statement_runs(samples, batch_ids, fetch_main, detail_main))
+    pool = ConnectionPool(db_params, min_size=1, max_size=1)
+    with pool.connection() as connection:
+        for statement, params in runs:
+            if run_plain(connection, statement, params) != run_prepared(connection, statement, params):
+                print(f"MISMATCH in {statement.name}: plain and prepared return different rows")
+                return 1
+        print(f"{len(samples)} samples return the same rows either way")
+
+        reset_prepared_statement_stats()
+        timings = {}
+        for statement, params in runs:
+            timing = timings.setdefault(statement.name, {'plain': [], 'prepared': []})
+            timing['plain'].append(timed(run_plain, connection, statement, params))
+            timing['prepared'].append(timed(run_prepared, connection, statement, params))
+
+    print(f"{'statement':<28}{'plain p50':>10}{'p95':>8}{'prepared p50':>14}{'p95':>8}  ms")
+    for name, timing in timings.items():
+        plain, prepared = sorted(timing['plain']), sorted(timing['prepared'])
+        p95 = int(len(plain) * 0.95)
+        print(f"{name:<28}{statistics.median(plain) * 1000:>10.3f}{plain[p95] * 1000:>8.3f}"
+              f"{statistics.median(prepared) * 1000:>14.3f}{prepared[p95] * 1000:>8.3f}"
+              f"  ({statistics.median(plain) / statistics.median(prepared):.2f}x)")
+    print(f"{'statement':<28}{'executions':>12}{'hits':>8}{'prepares':>10}{'hit rate':>10}")
+    for name, stats in prepared_statement_stats().items():
+        print(f"{name:<28}{stats['executions']:>12}{stats['hits']:>8}{stats['prepares']:>10}{stats['hit_rate']:>10.2%}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
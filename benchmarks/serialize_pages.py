@@ -0,0 +1,110 @@
+"""Microbenchmark of fetch_records_list response encoding.
+
+Builds synthetic fetch pages, one RealDictRow per day with the columns the
+list query returns. Each page is encoded with flask.jsonify, the previous
+path, and with every available APIResponse serializer. The script checks
+that each serializer decodes to the same JSON as jsonify, then prints
+encode time and bytes on the wire for identity, gzip and brotli encoding.
+No database is needed.
+
+    python benchmarks/serialize_pages.py [--page-sizes 20,100,1000] [--repeat 200]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import flask  # noqa: E402
+from psycopg2.extras import RealDictRow  # noqa: E402
+
+from medical_core import serialization  # noqa: E402
+
+ACCEPT_ENCODINGS = {'identity': None, 'gzip': 'gzip', 'br': 'br'}
+
+
+def make_page(size, rng):
+    rows = []
+    day = date(2024, 6, 30)
+    for n in range(size):
+        row = RealDictRow()
+        row.update({
+            'id': 100000 + n,
+            'opd_type': 1,
+            'updated_at': datetime.combine(day, datetime.min.time()) + timedelta(hours=rng.randint(8, 20)),
+            'opd_date': day,
+            'firebase_user_id': 'bench-serialize-user-0123456789abcdef',
+            'new_total': rng.randint(0, 480),
+            'old_total': rng.randint(0, 480),
+        })
+        rows.append(row)
+        day -= timedelta(days=1)
+    return {'content': {'results': rows}, 'response': {'error': 0, 'message': 'Success'}}
+
+
+def best_of(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def available_serializers():
+    names = []
+    for name in ('stdlib', 'orjson'):
+        try:
+            serialization.set_serializer(name)
+        except ImportError:
+            print(f"({name} not installed, skipped)")
+            continue
+        names.append(name)
+    return names
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--page-sizes', default='20,100,1000')
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args(argv)
+
+    app = flask.Flask(__name__)
+    rng = random.Random(0)
+    serializers = available_serializers()
+    for size in [int(size) for size in args.page_sizes.split(',')]:
+        page = make_page(size, rng)
+        with app.app_context():
+            reference = flask.jsonify(page).get_data()
+            jsonify_seconds = best_of(lambda: flask.jsonify(page).get_data(), args.repeat)
+        print(f"\npage of {size} rows")
+        print(f"  {'encoder':<10}{'encode us':>12}{'speedup':>10}")
+        print(f"  {'jsonify':<10}{jsonify_seconds * 1e6:>12.1f}{'1.0x':>10}")
+        for name in serializers:
+            serialization.set_serializer(name)
+            body = serialization.encode_json(page)
+            if json.loads(body) != json.loads(reference):
+                print(f"  {name}: MISMATCH with jsonify")
+                return 1
+            seconds = best_of(lambda: serialization.encode_json(page), args.repeat)
+            print(f"  {name:<10}{seconds * 1e6:>12.1f}{jsonify_seconds / seconds:>9.1f}x")
+
+        print(f"  {'encoding':<10}{'bytes':>12}{'ratio':>10}{'compress us':>14}")
+        for label, accept in ACCEPT_ENCODINGS.items():
+            compressed, used = serialization.compress(reference, accept)
+            if accept is not None and used != accept:
+                print(f"  {label:<10}{'(not available or below threshold)':>36}")
+                continue
+            seconds = best_of(lambda: serialization.compress(reference, accept), args.repeat) if used else 0.0
+            print(f"  {label:<10}{len(compressed):>12}{len(reference) / len(compressed):>9.1f}x{seconds * 1e6:>14.1f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
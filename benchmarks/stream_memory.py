@@ -0,0 +1,110 @@
+"""Peak server memory of fetch_records_list pages, buffered vs streamed.
+
+Seeds one synthetic user with enough daily records for the largest
+--page-sizes, using synthetic_data.py. For each page size and mode the
+script starts a fresh functions-framework server, as load_test.py does,
+and sends one small warm-up request. It then requests the page with
+page.stream set to false (fetchall and one serialize, the old path) or
+true (server-side cursor, chunked response). The figure reported is how
+far the request raised the peak resident set (VmHWM) of the server
+processes. Streamed pages should stay flat as the page grows. Linux only,
+since it reads /proc.
+
+    python benchmarks/stream_memory.py [--page-sizes 20,1000,10000,50000] [--output stream.json]
+"""
+import argparse
+import http.client
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from sqlalchemy import create_engine  # noqa: E402
+
+import load_test  # noqa: E402
+import synthetic_data  # noqa: E402
+
+PREFIX = 'stream-user-'
+MODES = {'buffered': False, 'streamed': True}
+
+
+def process_tree(pid):
+    pids = [pid]
+    for task in os.listdir(f'/proc/{pid}/task'):
+        with open(f'/proc/{pid}/task/{task}/children') as f:
+            for child in f.read().split():
+                pids.extend(process_tree(int(child)))
+    return pids
+
+
+def peak_rss_kb(pid):
+    """Sum of VmHWM over pid and its children (gunicorn workers)."""
+    total = 0
+    for member in process_tree(pid):
+        with open(f'/proc/{member}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    total += int(line.split()[1])
+    return total
+
+
+def request_page(port, user_id, page_limit, stream):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=300)
+    body = json.dumps({"page": {"page_id": 0, "page_limit": page_limit, "stream": stream}})
+    headers = {'Content-Type': 'application/json', 'user-token': load_test.TOKEN_PREFIX + user_id}
+    started = time.perf_counter()
+    connection.request('POST', '/', body=body, headers=headers)
+    response = connection.getresponse()
+    payload = response.read()
+    elapsed = time.perf_counter() - started
+    connection.close()
+    rows = len(json.loads(payload)['content']['results'])
+    return rows, len(payload), elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--page-sizes', default='20,1000,10000,50000')
+    parser.add_argument('--skip-seed', action='store_true', help='reuse the records of an earlier run')
+    parser.add_argument('--port', type=int, default=8290)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args(argv)
+
+    page_sizes = [int(size) for size in args.page_sizes.split(',')]
+    if not args.skip_seed:
+        # About six records a week are generated, so this covers the largest page
+        years = max(page_sizes) * 7 // (6 * 365) + 1
+        synthetic_data.seed(create_engine(synthetic_data.db_url), 1, years, prefix=PREFIX)
+    user_id = synthetic_data.user_ids(PREFIX, 1)[0]
+
+    results = {'config': vars(args), 'pages': []}
+    port = args.port
+    print(f"{'rows':>8}{'mode':>10}{'peak rss +KiB':>15}{'bytes':>12}{'seconds':>9}")
+    for page_limit in page_sizes:
+        for mode, stream in MODES.items():
+            server = load_test.FunctionServer('fetch', port)
+            port += 1
+            try:
+                server.wait_ready()
+                request_page(server.port, user_id, 20, stream)
+                before = peak_rss_kb(server.process.pid)
+                rows, size, elapsed = request_page(server.port, user_id, page_limit, stream)
+                growth = peak_rss_kb(server.process.pid) - before
+            finally:
+                server.stop()
+            results['pages'].append({'page_limit': page_limit, 'mode': mode, 'rows': rows, 'bytes': size,
+                                     'seconds': round(elapsed, 4), 'peak_rss_growth_kb': growth})
+            print(f"{rows:>8}{mode:>10}{growth:>15}{size:>12}{elapsed:>9.3f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"saved {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,98 @@
+"""Fill the database with synthetic users for load and latency testing.
+
+Creates --users users named <prefix>N, each with --years x 365 days of daily
+records that end yesterday. Roughly one day in seven is left empty, the same
+as an OPD that is closed on Sundays. Every record gets the three age groups
+with random counts. The rollups of the generated users are then rebuilt and
+the tables analysed. Existing data for the prefix is replaced; other users
+are left alone.
+
+    python benchmarks/synthetic_data.py [--users 100] [--years 3] [--prefix load-user-]
+    python benchmarks/synthetic_data.py --clear
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'insert_medical_record'))
+
+from sqlalchemy import create_engine, text  # noqa: E402
+
+from medical_core.db import db_url  # noqa: E402
+from medical_core.record_counts import COUNT_COLUMNS  # noqa: E402
+from rollups import rebuild_rollups  # noqa: E402
+
+DEFAULT_PREFIX = 'load-user-'
+
+CLEAR_SQL = """
+DELETE FROM record_groups WHERE record_id IN (SELECT id FROM mo_records WHERE firebase_user_id LIKE :prefix || '%');
+DELETE FROM mo_records WHERE firebase_user_id LIKE :prefix || '%';
+DELETE FROM opd_daily_rollups WHERE firebase_user_id LIKE :prefix || '%';
+DELETE FROM opd_monthly_rollups WHERE firebase_user_id LIKE :prefix || '%';
+"""
+
+_random_counts = ", ".join(["(random() * 40)::int"] * len(COUNT_COLUMNS))
+
+SEED_SQL = f"""
+INSERT INTO mo_records (opd_type, opd_date, updated_at, firebase_user_id, {", ".join(COUNT_COLUMNS)})
+SELECT 1, d::date, d, :prefix || u, {_random_counts}
+FROM generate_series(1, :users) AS u,
+     generate_series(CAST(:start AS date), CAST(:end AS date), interval '1 day') AS d
+WHERE random() > 1.0 / 7
+ON CONFLICT DO NOTHING;
+"""
+
+
+def user_ids(prefix, users):
+    return [f"{prefix}{n}" for n in range(1, users + 1)]
+
+
+def clear(engine, prefix=DEFAULT_PREFIX):
+    with engine.begin() as connection:
+        connection.execute(text(CLEAR_SQL), {'prefix': prefix})
+
+
+def seed(engine, users, years, prefix=DEFAULT_PREFIX, seed_value=0.5):
+    """Replace the synthetic users' data and return the number of records created."""
+    end = date.today() - timedelta(days=1)
+    start = end - timedelta(days=365 * years - 1)
+    with engine.begin() as connection:
+        connection.execute(text(CLEAR_SQL), {'prefix': prefix})
+        # Same seed, same dataset, so runs on different days stay comparable in size
+        connection.execute(text("SELECT setseed(:seed)"), {'seed': seed_value})
+        connection.execute(text(SEED_SQL), {'prefix': prefix, 'users': users, 'start': start, 'end': end})
+        for user_id in user_ids(prefix, users):
+            rebuild_rollups(connection, user_id)
+        records = connection.execute(
+            text("SELECT count(*) FROM mo_records WHERE firebase_user_id LIKE :prefix || '%'"), {'prefix': prefix}
+        ).scalar()
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.exec_driver_sql("VACUUM ANALYZE mo_records, opd_daily_rollups, opd_monthly_rollups")
+    return records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--prefix', default=DEFAULT_PREFIX)
+    parser.add_argument('--clear', action='store_true', help='only delete the synthetic users')
+    args = parser.parse_args(argv)
+
+    engine = create_engine(db_url)
+    if args.clear:
+        clear(engine, args.prefix)
+        print(f"removed {args.prefix}* users")
+        return 0
+    started = time.perf_counter()
+    records = seed(engine, args.users, args.years, args.prefix)
+    print(f"{args.users} users, {records} records, {records * 3} groups in {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,63 +1,50 @@
 from flask import Flask, request, jsonify
 import flask
 import logging
-import psycopg2
 from psycopg2 import sql
 import os
 from psycopg2.extras import RealDictCursor
-from api_response import APIResponse
-import firebase_admin
-from firebase_admin import credentials, auth
-import json
+from medical_core.api_response import APIResponse
+from medical_core.auth import auth_user_by_token
+from medical_core.db import get_pool
+from medical_core.prepared import Statement
+from medical_core.record_counts import groups_json_sql
+from medical_core.timing import phase, timed_request
 
-db_params = {
-    'host': os.environ.get('DB_HOST'),
-    'port': os.environ.get('DB_PORT'),
-    'user': os.environ.get('DB_USER'),
-    'password': os.environ.get('DB_PASSWORD'),
-    'database': os.environ.get('DB_NAME'),
-}
-
-# Check if the service account key JSON is available as an environment variable
-if 'FIREBASE_SERVICE_ACCOUNT' in os.environ:
-    # Load the service account key from the environment variable
-    service_account_info = json.loads(os.environ['FIREBASE_SERVICE_ACCOUNT'])
-    cred = credentials.Certificate(service_account_info)
-else:
-    # If the environment variable is not set, initialize Firebase Admin SDK without credentials
-    cred = None
+# The groups are built from the record's inline counts, in the shape json_agg over
+# record_groups rows used to return but without the groups' own ids
+DETAIL_RECORD_QUERY = sql.SQL(f"""
+                SELECT r.id, r.opd_type, r.updated_at, r.opd_date, r.firebase_user_id, {groups_json_sql()} AS groups
+                FROM mo_records r
+                where r.id = %(id)s and r.firebase_user_id = %(user_id)s""")
 
-firebase_admin.initialize_app(cred)
+# Many records of one user: ids that are not theirs simply match no row
+DETAIL_RECORDS_BATCH_QUERY = sql.SQL(f"""
+                SELECT r.id, r.opd_type, r.updated_at, r.opd_date, r.firebase_user_id, {groups_json_sql()} AS groups
+                FROM mo_records r
+                where r.id = ANY(%(ids)s) and r.firebase_user_id = %(user_id)s""")
 
+# Prepared once per pooled connection, then run by name (see medical_core/prepared.py)
+DETAIL_RECORD_STATEMENT = Statement('detail_record', DETAIL_RECORD_QUERY)
+DETAIL_RECORDS_BATCH_STATEMENT = Statement('detail_records_batch', DETAIL_RECORDS_BATCH_QUERY)
 
-def auth_user_by_token(request: flask.Request):
-    user_token = request.headers.get("user-token")
-    try:
-        # Verify the Firebase ID token
-        decoded_token = auth.verify_id_token(user_token)
-        # Extract user ID from decoded token
-        uid = decoded_token['uid']
-        # Retrieve user information
-        user = auth.get_user(uid)
-        # print(user.uid)
-        # print(user.display_name)
-        # print(user.email)
-        # print(user.disabled)
-        return user.uid
-    except ValueError as e:
-        # Handle invalid tokens or other errors
-        print('Authentication failed:', e)
-        return None
+# Largest number of ids accepted by detail_records_batch in one request
+DETAIL_BATCH_MAX_IDS = int(os.environ.get('DETAIL_BATCH_MAX_IDS', 100))
 
-def execute_query(connection, query, params=None):
-    with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-        if params:
+def execute_query(connection, query, params=None, fetch_all=False):
+    with phase('query'), connection.cursor(cursor_factory=RealDictCursor) as cursor:
+        if isinstance(query, Statement):
+            query.execute(cursor, params)
+        elif params:
             cursor.execute(query, params)
         else:
             cursor.execute(query)
+        if fetch_all:
+            return cursor.fetchall()
         result = cursor.fetchone()
         return result
 
+@timed_request
 def detail_record(request: flask.Request)-> flask.typing.ResponseReturnValue:
     if request.method == 'OPTIONS':
     # Allows GET requests from any origin with the Content-Type
@@ -82,20 +69,57 @@ def detail_record(request: flask.Request)-> flask.typing.ResponseReturnValue:
         return "error, id cannot be none", 500
     
     try: 
-        connection = psycopg2.connect(**db_params)
-        select_query = sql.SQL("""
-                SELECT r.*, json_agg(g.*) AS groups
-                FROM mo_records r
-                LEFT JOIN record_groups g ON r.id = g.record_id
-                where r.id = %(id)s and r.firebase_user_id = %(user_id)s
-                GROUP BY r.id""")
+        select_query = DETAIL_RECORD_STATEMENT
         query_params = {
             "id": id, "user_id": user_id
         }
-        result = execute_query(connection, select_query, query_params)
+        with get_pool().connection() as connection:
+            result = execute_query(connection, select_query, query_params)
         return APIResponse.ok_with_data(result)
         # return jsonify({'results': result})
     except Exception as e:
             print(f"Error: {str(e)}")
     return APIResponse.error_with_message("Something went wrong")
 
+
+
+@timed_request
+def detail_records_batch(request: flask.Request) -> flask.typing.ResponseReturnValue:
+    # Opens many records ({"ids": [...]}) with one auth check and one query.
+    # Results come back in the order asked for; ids that do not exist and ids that
+    # belong to someone else are both just listed in "missing".
+    if request.method == 'OPTIONS':
+        headers = {
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Methods":"*",
+            "Access-Control-Allow-Headers":"*",
+            "Access-Control-Allow-Credentials":"true",
+            "Access-Control-Max-Age":"3600"
+        }
+
+        return ('', 200, headers)
+
+    user_id = auth_user_by_token(request=request)
+    if user_id is None:
+        return APIResponse.error_with_code_message(message="Unauthorized")
+
+    ids = request.get_json().get('ids')
+    if not isinstance(ids, list) or len(ids) == 0:
+        return APIResponse.error_with_code_message(message="ids are not present")
+    if any(not isinstance(id, int) or isinstance(id, bool) for id in ids):
+        return APIResponse.error_with_code_message(message="ids must be integers")
+    ids = list(dict.fromkeys(ids))
+    if len(ids) > DETAIL_BATCH_MAX_IDS:
+        return APIResponse.error_with_code_message(message=f"at most {DETAIL_BATCH_MAX_IDS} records can be opened at once")
+
+    try:
+        query_params = {"ids": ids, "user_id": user_id}
+        with get_pool().connection() as connection:
+            rows = execute_query(connection, DETAIL_RECORDS_BATCH_STATEMENT, query_params, fetch_all=True)
+        by_id = {row["id"]: row for row in rows}
+        results = [by_id[id] for id in ids if id in by_id]
+        missing = [id for id in ids if id not in by_id]
+        return APIResponse.ok_with_data({"results": results, "missing": missing})
+    except Exception as e:
+        print(f"Error: {str(e)}")
+    return APIResponse.error_with_message("Something went wrong")
@@ -0,0 +1,35 @@
+"""Async (asyncpg) version of detail_record, served as an ASGI app.
+
+Same request and response as main.detail_record, running on one event loop
+with an asyncpg pool instead of a thread per request:
+
+    uvicorn main_async:app --port 8080
+"""
+from main import DETAIL_RECORD_QUERY
+from medical_core.asgi import api_error, api_ok, asgi_app
+from medical_core.async_db import fetch_for_user, positional
+from medical_core.auth import start_auth_user_by_token
+
+DETAIL_RECORD_SQL, DETAIL_RECORD_PARAMS = positional(DETAIL_RECORD_QUERY.string)
+
+
+async def detail_record(data, headers):
+    # Firebase verification runs while the query is being prepared
+    auth_task = start_auth_user_by_token(headers.get("user-token"))
+    id = data.get('id', None)
+    if id is None:
+        if await auth_task is None:
+            return api_error(message="Unauthorized")
+        return 500, "error, id cannot be none"
+
+    try:
+        user_id, row = await fetch_for_user(auth_task, DETAIL_RECORD_SQL, DETAIL_RECORD_PARAMS, {"id": id}, one=True)
+        if user_id is None:
+            return api_error(message="Unauthorized")
+        return api_ok(dict(row) if row is not None else None)
+    except Exception as e:
+        print(f"Error: {str(e)}")
+    return api_error(message="Something went wrong")
+
+
+app = asgi_app(detail_record)
@@ -0,0 +1,92 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+# Total bytes of finished workbooks kept per instance before the least recently used are evicted
+EXPORT_CACHE_MAX_BYTES = int(os.environ.get('EXPORT_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+# When set, workbooks are kept as files in this directory instead of in memory
+EXPORT_CACHE_DIR = os.environ.get('EXPORT_CACHE_DIR')
+
+
+def export_etag(*key_parts):
+    """Strong ETag for a workbook built from the given (user, month, data fingerprint) key."""
+    return hashlib.sha256("|".join(str(part) for part in key_parts).encode()).hexdigest()
+
+
+class ExportCache:
+    """Bounded LRU store of finished workbooks keyed on their ETag."""
+
+    def __init__(self, max_bytes=EXPORT_CACHE_MAX_BYTES, directory=EXPORT_CACHE_DIR):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+        # etag -> workbook bytes (or file path when stored on disk), most recently used last
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _path(self, etag, export_format):
+        return os.path.join(self.directory, f"{etag}.{export_format}")
+
+    def get(self, etag):
+        with self._lock:
+            entry = self._entries.get(etag)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(etag)
+            self.hits += 1
+        if not self.directory:
+            return entry
+        try:
+            with open(entry, 'rb') as f:
+                return f.read()
+        except OSError:
+            with self._lock:
+                self._remove(etag)
+            return None
+
+    def put(self, etag, data, export_format='xlsx'):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(etag)
+            entry = data
+            if self.directory:
+                entry = self._path(etag, export_format)
+                with open(entry, 'wb') as f:
+                    f.write(data)
+            self._entries[etag] = entry
+            self._sizes[etag] = len(data)
+            self._total_bytes += len(data)
+            while self._total_bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, etag):
+        entry = self._entries.pop(etag, None)
+        if entry is None:
+            return
+        self._total_bytes -= self._sizes.pop(etag)
+        if self.directory:
+            try:
+                os.remove(entry)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+            }
@@ -0,0 +1,102 @@
+"""CSV and Parquet exports, built from the same rows as the xlsx sheets.
+
+A sheet is its day rows ("dd-mm-YYYY" then the 24 sheet columns), the
+"Total" row and the "Movana" block. CSV lays these out as the workbook does,
+writing each merged header once and padding with empty cells. Parquet holds
+only the day rows, as typed columns. Its totals and Movana row go in the
+file's key-value metadata as JSON.
+"""
+import csv
+import importlib.util
+import io
+import json
+
+EXPORT_MIMETYPES = {
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'csv': 'text/csv; charset=utf-8',
+    'parquet': 'application/vnd.apache.parquet',
+}
+# Streamed CSV goes out in pieces of about this many bytes
+CSV_CHUNK_BYTES = 64 * 1024
+
+SHEET_AGE_HEADERS = ["0-15 Years", "16-60 Years", "60 Above", "Total"]
+SUMMARY_AGE_HEADERS = ["0-15 years", "15-60 years", ">60 years"]
+
+# Parquet column names of the 24 counts, in sheet column order
+EXPORT_COLUMN_NAMES = [
+    f"{case}_{group}_{sex}"
+    for case in ("new", "old", "total")
+    for group in ("0_15", "16_60", "60_above", "total")
+    for sex in ("male", "female")
+]
+
+
+def parquet_available():
+    # Checked without importing pyarrow, which is slow to load
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def movana_row(column_totals):
+    # New, old and grand totals with their "Movana" medicine days, from a "Total" row
+    from export_matrix import movana_values
+    return ["Movana"] + movana_values(column_totals[1:]).tolist()
+
+
+def sheet_header_rows(label="Date"):
+    return [
+        ["", "New Case"] + [""] * 7 + ["Old Case"] + [""] * 7 + ["Total Case"] + [""] * 7,
+        [label] + [cell for _ in range(3) for name in SHEET_AGE_HEADERS for cell in (name, "")],
+        [""] + ["M", "F"] * 12,
+    ]
+
+
+def sheet_footer_rows(column_totals):
+    # The "Total" row, then the summary block one empty row below it
+    return [
+        column_totals,
+        [],
+        ["", "New"] + [""] * 11 + ["Old"] + [""] * 11 + ["Grand Total"],
+        [""] + [cell for _ in range(2) for name in SUMMARY_AGE_HEADERS for cell in (name, "", "", "")],
+        [""] + ["Male", "Female", "total", "Medicine Days"] * 7,
+        movana_row(column_totals),
+    ]
+
+
+def csv_chunks(rows):
+    """Encode rows as CSV, yielding UTF-8 bytes about CSV_CHUNK_BYTES at a time."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= CSV_CHUNK_BYTES:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell() > 0:
+        yield buffer.getvalue().encode()
+
+
+def csv_sheet_bytes(day_rows, column_totals, label="Date"):
+    return b"".join(csv_chunks(sheet_header_rows(label) + day_rows + sheet_footer_rows(column_totals)))
+
+
+def parquet_bytes(day_rows, column_totals, metadata=None):
+    """A Parquet file of the day rows, carrying the totals and Movana row as metadata."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    # Transposed once, then every column is converted in a single call
+    columns = list(zip(*day_rows)) if len(day_rows) > 0 else [()] * (len(EXPORT_COLUMN_NAMES) + 1)
+    dates = pc.strptime(pa.array(columns[0], pa.string()), format="%d-%m-%Y", unit="s").cast(pa.date32())
+    arrays = [dates] + [pa.array(column, pa.int32()) for column in columns[1:]]
+
+    file_metadata = {
+        "export.totals": json.dumps(column_totals),
+        "export.movana": json.dumps(movana_row(column_totals)),
+    }
+    file_metadata.update(metadata or {})
+    table = pa.Table.from_arrays(arrays, names=["date"] + EXPORT_COLUMN_NAMES).replace_schema_metadata(file_metadata)
+    output = io.BytesIO()
+    pq.write_table(table, output, compression="zstd")
+    return output.getvalue()
@@ -0,0 +1,57 @@
+"""Export counts as a NumPy matrix, and the sheet columns and totals derived from it.
+
+counts_matrix() packs the 12 rollup counts of each day into an integer array
+with the axes (day, age group, case, sex). Age groups follow record_counts.AGE_GROUPS,
+case is new then old, and sex is male then female. The 24 sheet columns,
+their totals and the Movana row are all computed from that array with
+whole-array sums, with no per-cell arithmetic.
+
+main.py imports this module inside the functions that build an export, so
+cold starts, 304s and cache hits never load NumPy.
+"""
+from operator import itemgetter
+
+import numpy as np
+
+from medical_core.record_counts import MEDICINE_DAYS_PER_PATIENT
+
+AGE_GROUP_COUNT = 3
+
+# Positions of the sheet columns, indexed [case (new, old, total)][age group (+ all ages)][sex]
+_SHEET_POSITIONS = np.arange(24).reshape(3, AGE_GROUP_COUNT + 1, 2)
+# The Movana row's (male, female) pairs: new and old per age group, then the grand total
+_MOVANA_COLUMNS = np.concatenate([
+    _SHEET_POSITIONS[0, :AGE_GROUP_COUNT].ravel(),
+    _SHEET_POSITIONS[1, :AGE_GROUP_COUNT].ravel(),
+    _SHEET_POSITIONS[2, AGE_GROUP_COUNT].ravel(),
+])
+
+
+def counts_matrix(rows, columns):
+    """(days, age group, case, sex) counts from mappings holding the 12 count columns."""
+    get_counts = itemgetter(*columns)
+    values = np.array([get_counts(row) for row in rows], dtype=np.int64)
+    return values.reshape(len(values), AGE_GROUP_COUNT, 2, 2)
+
+
+def sheet_columns(counts):
+    """The 24 sheet columns of each day as a (days, 24) array.
+
+    New, old and total case in turn, each as 0-15, 16-60, 60+ and all ages,
+    each as male then female.
+    """
+    # Append the total case (new + old), then all ages, along their axes
+    counts = np.concatenate([counts, counts.sum(axis=2, keepdims=True)], axis=2)
+    counts = np.concatenate([counts, counts.sum(axis=1, keepdims=True)], axis=1)
+    return counts.transpose(0, 2, 1, 3).reshape(len(counts), 24)
+
+
+def movana_values(totals):
+    """The 28 numbers of the Movana row from the 24 column totals.
+
+    For each new and old age group and for the grand total: male, female,
+    both, and medicine days.
+    """
+    pairs = np.asarray(totals, dtype=np.int64)[_MOVANA_COLUMNS].reshape(-1, 2)
+    patients = pairs.sum(axis=1, keepdims=True)
+    return np.concatenate([pairs, patients, patients * MEDICINE_DAYS_PER_PATIENT], axis=1).ravel()
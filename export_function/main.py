@@ -1,60 +1,26 @@
 from io import BytesIO
 from flask import Flask, request, jsonify, send_file
 import flask
-from sqlalchemy import Column, DateTime, Integer, String, create_engine, Date
-from sqlalchemy.orm import sessionmaker, declarative_base
-import os
+from sqlalchemy import text
 from datetime import datetime, timedelta
-from api_response import APIResponse
-import firebase_admin
-from firebase_admin import credentials, auth
+from medical_core.api_response import APIResponse
+from medical_core.auth import auth_user_by_token
+from medical_core.db import Session
+from medical_core.record_counts import COUNT_COLUMNS
+from medical_core.timing import phase, timed_request
+from export_cache import ExportCache, export_etag
+from export_formats import (EXPORT_MIMETYPES, csv_chunks, csv_sheet_bytes, movana_row, parquet_available, parquet_bytes,
+                            sheet_footer_rows, sheet_header_rows)
 import json
-import xlsxwriter
+import tempfile
+from itertools import groupby
 
 
-db_params = {
-    'host': os.environ.get('DB_HOST'),
-    'port': os.environ.get('DB_PORT'),
-    'user': os.environ.get('DB_USER'),
-    'password': os.environ.get('DB_PASSWORD'),
-    'database': os.environ.get('DB_NAME'),
-}
-
-# Check if the service account key JSON is available as an environment variable
-if 'FIREBASE_SERVICE_ACCOUNT' in os.environ:
-    # Load the service account key from the environment variable
-    service_account_info = json.loads(os.environ['FIREBASE_SERVICE_ACCOUNT'])
-    cred = credentials.Certificate(service_account_info)
-else:
-    # If the environment variable is not set, initialize Firebase Admin SDK without credentials
-    cred = None
-
-firebase_admin.initialize_app(cred)
-
-
-# Construct the database URL
-db_url = f"postgresql://{db_params['user']}:{db_params['password']}@{db_params['host']}:{db_params['port']}/{db_params['database']}"
-
-# Create the database engine
-engine = create_engine(db_url, echo=True)
-
-# Create a session factory
-Session = sessionmaker(bind=engine)
-
-Base = declarative_base()
-
-def format_datetime(dt, fmt="%Y-%m-%d %H:%M:%S"):
-    return dt.strftime(fmt)
-
-def replace_none(value, replacement=0):
-    return value if value is not None else replacement
-
-def sum_nullable(*args):
-    return sum(arg if arg is not None else 0 for arg in args)
-
-def non_null_non_empty_list(collection) -> bool:
-    return collection is not None and bool(collection)
-
+# Finished monthly workbooks, reused while the month's data is unchanged
+export_cache = ExportCache()
+# Part of every ETag; bumped when the same data starts producing a different file, so
+# workbooks cached (here or by clients) before the change are not reused
+EXPORT_VERSION = 2
 
 def non_null_non_empty(data, key) -> bool:
     value = data.get(key)
@@ -66,39 +32,298 @@ def non_null_non_empty(data, key) -> bool:
     else:
         return True
     
-class Record(Base):
-    __tablename__ = 'mo_records'
-    id = Column(Integer, primary_key=True)
-    opd_type = Column(Integer, name="opd_type")
-    updated_at = Column(DateTime, default=datetime.utcnow, name="updated_at")
-    opd_date = Column(Date, name="opd_date")
-    firebase_user_id = Column(String, name="firebase_user_id")
-
-class RecordGroup(Base):
-    __tablename__ = 'record_groups'
-    id = Column(Integer, primary_key=True)
-    name = Column(String, name="name")
-    new_male = Column(Integer, name="new_male")
-    new_female = Column(Integer, name="new_female")
-    old_male = Column(Integer, name="old_male")
-    old_female = Column(Integer, name="old_female")
-    record_id = Column(Integer, name="record_id")
-
-def auth_user_by_token(request: flask.Request):
-    user_token = request.headers.get("user-token")
+AGE_GROUP_COLUMNS = COUNT_COLUMNS
+
+_day_columns = ",\n    ".join(f"COALESCE(r.{column}, 0) AS {column}" for column in AGE_GROUP_COLUMNS)
+
+# One row per day between :start_date and :end_date, with the record's inline counts (zero where there is no record)
+DAY_PIVOT_SQL = f"""
+SELECT d.day::date AS opd_date,
+    {_day_columns}
+FROM generate_series(CAST(:start_date AS date), CAST(:end_date AS date), interval '1 day') AS d(day)
+LEFT JOIN mo_records r ON r.firebase_user_id = :user_id AND r.opd_date = d.day::date
+"""
+
+# The month's days followed by its opd_monthly_rollups row (opd_date NULL) as the totals
+EXPORT_MONTH_SQL = DAY_PIVOT_SQL + f"""
+UNION ALL
+SELECT NULL, {", ".join(AGE_GROUP_COLUMNS)}
+FROM opd_monthly_rollups
+WHERE firebase_user_id = :user_id AND opd_month = :start_date
+ORDER BY opd_date NULLS LAST
+"""
+
+EXPORT_RANGE_SQL = DAY_PIVOT_SQL + """
+ORDER BY d.day
+"""
+
+_rollup_columns = ", ".join(AGE_GROUP_COLUMNS)
+
+# Changes whenever anything exported for the month changes: the month's daily rollup rows
+# in day order (so moving patients from one day to another changes it even when the month
+# totals do not), the monthly rollup, and the number and newest write of the records
+EXPORT_FINGERPRINT_SQL = f"""
+SELECT
+    (SELECT count(*) FROM mo_records
+        WHERE firebase_user_id = :user_id AND opd_date BETWEEN :start_date AND :end_date) AS record_count,
+    (SELECT max(change_txid) FROM mo_records
+        WHERE firebase_user_id = :user_id AND opd_date BETWEEN :start_date AND :end_date) AS max_change_txid,
+    (SELECT md5(string_agg(concat_ws(',', opd_date, {_rollup_columns}), ';' ORDER BY opd_date)) FROM opd_daily_rollups
+        WHERE firebase_user_id = :user_id AND opd_date BETWEEN :start_date AND :end_date) AS daily_hash,
+    (SELECT md5(concat_ws(',', {_rollup_columns})) FROM opd_monthly_rollups
+        WHERE firebase_user_id = :user_id AND opd_month = :start_date) AS rollup_hash
+"""
+
+def fetch_export_fingerprint(session, user_id, month_start_date, month_end_date):
+    with phase('query'):
+        return tuple(session.execute(
+            text(EXPORT_FINGERPRINT_SQL),
+            {"user_id": user_id, "start_date": month_start_date, "end_date": month_end_date}
+        ).one())
+
+def fetch_export_rows(session, user_id, month_start_date, month_end_date):
+    # Single round trip: returns (day rows, month totals row or None) as plain mappings
+    with phase('query'):
+        rows = session.execute(
+            text(EXPORT_MONTH_SQL),
+            {"user_id": user_id, "start_date": month_start_date, "end_date": month_end_date}
+        ).mappings().all()
+    if len(rows) > 0 and rows[-1]["opd_date"] is None:
+        return rows[:-1], rows[-1]
+    return rows, None
+
+def sheet_columns_of(rows):
+    # The 24 new/old/total x age group x sex columns of each of rows, as a (rows, 24) array,
+    # from mappings with the 12 AGE_GROUP_COLUMNS counts.
+    # Imported here so cold starts, 304s and cache hits never pay for NumPy
+    from export_matrix import counts_matrix, sheet_columns
+    return sheet_columns(counts_matrix(rows, AGE_GROUP_COLUMNS))
+
+def dated_sheet_rows(day_rows, columns):
+    # One sheet row per day: its "dd-mm-YYYY" date followed by its 24 columns
+    return [[day_row["opd_date"].strftime("%d-%m-%Y")] + day_columns for day_row, day_columns in zip(day_rows, columns.tolist())]
+
+EXPORT_HEADER_ROWS = [
+    ["", "New Case", "Old Case", "Total Case"],
+    # ["Date", "0-15 Years", "16-60 years" ,"60 above", "total", "0-15 Years", "16-60 years", "60 above", "total", "0-15 Years", "16-60 years", "60 above", "total"],
+    ["Date"],
+    ["",      "M","F",        "M", "F",    "M", "F",  "M", "F", "M","F",        "M", "F",    "M", "F",  "M", "F",  "M","F",      "M", "F",     "M", "F", "M", "F"],
+    # ["abc", 5, 10, 15, 20, 25, 30, 40,50, 5, 10, 15, 20, 25, 30, 40,50, 5, 10, 15, 20, 25, 30, 40,50],
+    # ["Doe Joe", 35, "UK"]
+]
+
+def write_sheet_header(worksheet, cell_format, label="Date"):
+    # Row by row (merges, then the header cells over them) so it also works in constant_memory mode
+    worksheet.merge_range('B1:I1', 'New Case')
+    worksheet.merge_range('J1:Q1', 'Old Case')
+    worksheet.merge_range('R1:Z1', 'Total Case')
+    write_rows(worksheet, 0, EXPORT_HEADER_ROWS[0:1], cell_format)
+
+    worksheet.merge_range('B2:C2', '0-15 Years')
+    worksheet.merge_range('D2:E2', '16-60 Years')
+    worksheet.merge_range('F2:G2', '60 Above')
+    worksheet.merge_range('H2:I2', 'Total')
+
+    worksheet.merge_range('J2:K2', '0-15 Years')
+    worksheet.merge_range('L2:M2', '16-60 Years')
+    worksheet.merge_range('N2:O2', '60 Above')
+    worksheet.merge_range('P2:Q2', 'Total')
+
+    worksheet.merge_range('R2:S2', '0-15 Years')
+    worksheet.merge_range('T2:U2', '16-60 Years')
+    worksheet.merge_range('V2:W2', '60 Above')
+    worksheet.merge_range('X2:Y2', 'Total')
+    write_rows(worksheet, 1, [[label]] + EXPORT_HEADER_ROWS[2:], cell_format)
+
+def write_rows(worksheet, start_row, rows, cell_format):
+    # Write data to the worksheet with the cell format
+    for row_num, row_data in enumerate(rows, start=start_row):
+        for col_num, cell_data in enumerate(row_data):
+            worksheet.write(row_num, col_num, cell_data, cell_format)
+
+def write_sheet_summary(worksheet, last_row, column_totals, cell_format):
+    # New/old/grand total block with "Movana" medicine days, starting two rows below the data
+    worksheet.merge_range(f'B{last_row}:N{last_row}', 'New', cell_format)
+    worksheet.merge_range(f'O{last_row}:Z{last_row}', 'Old', cell_format)
+    
+    last_row += 1
+    worksheet.merge_range(f'B{last_row}:E{last_row}', '0-15 years', cell_format)
+    worksheet.merge_range(f'F{last_row}:I{last_row}', '15-60 years', cell_format)
+    worksheet.merge_range(f'J{last_row}:M{last_row}', '>60 years', cell_format)
+    worksheet.merge_range(f'N{last_row}:Q{last_row}', '0-15 years', cell_format)
+    worksheet.merge_range(f'R{last_row}:U{last_row}', '15-60 years', cell_format)
+    worksheet.merge_range(f'V{last_row}:Y{last_row}', '>60 years', cell_format)
+    worksheet.merge_range(f'Z{last_row}:AD{last_row}', 'Grand Total', cell_format)
+    last_row += 1
+    
+    # new
+    worksheet.write(f'B{last_row}:C{last_row}', 'Male', cell_format)
+    worksheet.write(f'C{last_row}:D{last_row}', 'Female', cell_format)
+    worksheet.write(f'D{last_row}:E{last_row}', 'total', cell_format)
+    worksheet.write(f'E{last_row}:F{last_row}', 'Medicine Days', cell_format)
+    worksheet.write(f'F{last_row}:G{last_row}', 'Male', cell_format)
+    worksheet.write(f'G{last_row}:H{last_row}', 'Female', cell_format)
+    worksheet.write(f'H{last_row}:I{last_row}', 'total', cell_format)
+    worksheet.write(f'I{last_row}:J{last_row}', 'Medicine Days', cell_format)
+    worksheet.write(f'J{last_row}:K{last_row}', 'Male', cell_format)
+    worksheet.write(f'K{last_row}:L{last_row}', 'Female', cell_format)
+    worksheet.write(f'L{last_row}:M{last_row}', 'total', cell_format)
+    worksheet.write(f'M{last_row}:N{last_row}', 'Medicine Days', cell_format)
+    #old
+    worksheet.write(f'N{last_row}:O{last_row}', 'Male', cell_format)
+    worksheet.write(f'O{last_row}:P{last_row}', 'Female', cell_format)
+    worksheet.write(f'P{last_row}:Q{last_row}', 'total', cell_format)
+    worksheet.write(f'Q{last_row}:R{last_row}', 'Medicine Days', cell_format)
+    worksheet.write(f'R{last_row}:S{last_row}', 'Male', cell_format)
+    worksheet.write(f'S{last_row}:T{last_row}', 'Female', cell_format)
+    worksheet.write(f'T{last_row}:U{last_row}', 'total', cell_format)
+    worksheet.write(f'U{last_row}:V{last_row}', 'Medicine Days', cell_format)
+    worksheet.write(f'V{last_row}:W{last_row}', 'Male', cell_format)
+    worksheet.write(f'W{last_row}:X{last_row}', 'Female', cell_format)
+    worksheet.write(f'X{last_row}:Y{last_row}', 'total', cell_format)
+    worksheet.write(f'Y{last_row}:Z{last_row}', 'Medicine Days', cell_format)
+    #grand total
+    worksheet.write(f'Z{last_row}:AA{last_row}', 'Male', cell_format)
+    worksheet.write(f'AA{last_row}:AB{last_row}', 'Female', cell_format)
+    worksheet.write(f'AB{last_row}:AC{last_row}', 'total', cell_format)
+    worksheet.write(f'AC{last_row}:AD{last_row}', 'Medicine Days', cell_format)
+    
+    # worksheet.write(f'A{last_row+1}:B{last_row+1}', "Movana", cell_format)
+    row = movana_row(column_totals)
+
+    additional_data = [row]
+    
+    for row_num, row_data in enumerate(additional_data, start=last_row):
+        worksheet.write_row(row_num, 0, row_data)
+
+def add_export_headers(resp, etag=None):
+    resp.headers.add('Access-Control-Allow-Origin', '*')
+    resp.headers.add('Access-Control-Allow-Methods', '*')
+    resp.headers.add('Access-Control-Allow-Headers', 'Origin, X-Requested-With, Content-Type, Accept')
+    resp.headers.add('Access-Control-Expose-Headers', 'ETag')
+    resp.headers.add('Access-Control-Max-Age', '3600')
+    resp.headers.add('X-Content-Type-Options', 'nosniff')
+    if etag:
+        resp.set_etag(etag)
+        resp.headers['Cache-Control'] = 'private, no-cache'
+    return resp
+
+def send_export(output, file_name, export_format='xlsx', etag=None):
+    resp = send_file(output, mimetype=EXPORT_MIMETYPES[export_format], as_attachment=True, download_name=file_name)
+    return add_export_headers(resp, etag)
+
+def range_file_name(start_date, end_date, export_format):
+    current_timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    return f"{start_date.strftime('%d%b%Y')}_{end_date.strftime('%d%b%Y')}_{current_timestamp}.{export_format}"
+
+def stream_range_rows(session, user_id, start_date, end_date):
+    # The days come off a server-side cursor, so they are never all in memory at once
+    with phase('query'):
+        return session.execute(
+            text(EXPORT_RANGE_SQL),
+            {"user_id": user_id, "start_date": start_date, "end_date": end_date},
+            execution_options={"stream_results": True, "yield_per": 500}
+        ).mappings()
+
+def month_sections(day_rows):
+    # Splits streamed day rows into months: yields (month_start_date, sheet rows, month totals),
+    # holding one month (at most 31 rows) at a time. Totals are summed from the days rather
+    # than taken from the monthly rollup, since the first and last month may be partial
+    for month_start_date, month_rows in groupby(day_rows, key=lambda day_row: day_row["opd_date"].replace(day=1)):
+        month_rows = list(month_rows)
+        columns = sheet_columns_of(month_rows)
+        yield month_start_date, dated_sheet_rows(month_rows, columns), columns.sum(axis=0).tolist()
+
+def add_totals(totals, more_totals):
+    return [a + b for a, b in zip(totals, more_totals)]
+
+def export_medical_records_range(session, user_id, start_date, end_date):
+    # One sheet per month plus a Summary sheet, streamed row by row: the days come off a
+    # server-side cursor and xlsxwriter's constant_memory mode flushes each row to disk,
+    # so peak memory does not grow with the length of the range.
+    output = tempfile.TemporaryFile()
+    # Imported here so cold starts, 304s and cache hits never pay for xlsxwriter
+    import xlsxwriter
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+    cell_format = workbook.add_format({'align': 'center'})
+
+    summary = workbook.add_worksheet("Summary")
+    write_sheet_header(summary, cell_format, label="Month")
+    summary_row = len(EXPORT_HEADER_ROWS)
+    range_totals = [0] * 24
+
+    for month_start_date, sheet_rows, month_totals in month_sections(stream_range_rows(session, user_id, start_date, end_date)):
+        worksheet = workbook.add_worksheet(month_start_date.strftime("%b %Y"))
+        write_sheet_header(worksheet, cell_format)
+        row_num = len(EXPORT_HEADER_ROWS)
+        write_rows(worksheet, row_num, sheet_rows, cell_format)
+        row_num += len(sheet_rows)
+
+        column_totals = ["Total"] + month_totals
+        write_rows(worksheet, row_num, [column_totals], cell_format)
+        write_sheet_summary(worksheet, row_num + 3, column_totals, cell_format)
+
+        write_rows(summary, summary_row, [[month_start_date.strftime("%b %Y")] + month_totals], cell_format)
+        summary_row += 1
+        range_totals = add_totals(range_totals, month_totals)
+
+    column_totals = ["Total"] + range_totals
+    write_rows(summary, summary_row, [column_totals], cell_format)
+    write_sheet_summary(summary, summary_row + 3, column_totals, cell_format)
+
+    workbook.close()
+    output.seek(0)
+    return send_export(output, range_file_name(start_date, end_date, 'xlsx'))
+
+def range_csv_rows(session, user_id, start_date, end_date):
+    # Each month's sheet in turn, under a row with the month's name, then the Summary sheet
+    # last, since its rows are only known once every month has gone out
+    summary_rows = []
+    range_totals = [0] * 24
+    for month_start_date, sheet_rows, month_totals in month_sections(stream_range_rows(session, user_id, start_date, end_date)):
+        yield [month_start_date.strftime("%b %Y")]
+        yield from sheet_header_rows()
+        yield from sheet_rows
+        yield from sheet_footer_rows(["Total"] + month_totals)
+        yield []
+
+        summary_rows.append([month_start_date.strftime("%b %Y")] + month_totals)
+        range_totals = add_totals(range_totals, month_totals)
+
+    yield ["Summary"]
+    yield from sheet_header_rows(label="Month")
+    yield from summary_rows
+    yield from sheet_footer_rows(["Total"] + range_totals)
+
+def stream_range_csv(user_id, start_date, end_date):
+    # Runs while the response is being sent, after the request's session is closed,
+    # so it reads through a session of its own
+    session = Session()
     try:
-        # Verify the Firebase ID token
-        decoded_token = auth.verify_id_token(user_token)
-        # Extract user ID from decoded token
-        uid = decoded_token['uid']
-        # Retrieve user information
-        user = auth.get_user(uid)
-        return user.uid
-    except Exception as e:
-        # Handle invalid tokens or other errors
-        print('Authentication failed:', e)
-        return None
+        yield from csv_chunks(range_csv_rows(session, user_id, start_date, end_date))
+    finally:
+        session.close()
 
+def export_medical_records_range_csv(user_id, start_date, end_date):
+    resp = flask.Response(stream_range_csv(user_id, start_date, end_date), mimetype=EXPORT_MIMETYPES['csv'])
+    resp.headers['Content-Disposition'] = f'attachment; filename={range_file_name(start_date, end_date, "csv")}'
+    return add_export_headers(resp)
+
+def export_medical_records_range_parquet(session, user_id, start_date, end_date):
+    # One table of every day in the range; the monthly rows of the Summary sheet
+    # go in the metadata along with the range totals
+    day_rows = []
+    summary_rows = []
+    range_totals = [0] * 24
+    for month_start_date, sheet_rows, month_totals in month_sections(stream_range_rows(session, user_id, start_date, end_date)):
+        day_rows.extend(sheet_rows)
+        summary_rows.append([month_start_date.strftime("%b %Y")] + month_totals)
+        range_totals = add_totals(range_totals, month_totals)
+
+    body = parquet_bytes(day_rows, ["Total"] + range_totals, {"export.months": json.dumps(summary_rows)})
+    return send_export(BytesIO(body), range_file_name(start_date, end_date, 'parquet'), 'parquet')
+
+@timed_request
 def export_medical_records(request: flask.Request) -> flask.typing.ResponseReturnValue:
     if request.method == 'OPTIONS':
     # Allows GET requests from any origin with the Content-Type
@@ -121,6 +346,26 @@ def export_medical_records(request: flask.Request) -> flask.typing.ResponseRetur
     session = Session()
     try:    
         json_data = request.get_json()
+        # xlsx (default), csv or parquet; the same rows, totals and Movana block in each
+        export_format = json_data.get("format") or "xlsx"
+        if export_format not in EXPORT_MIMETYPES:
+            return APIResponse.error_with_code_message(message="format must be one of " + ", ".join(EXPORT_MIMETYPES))
+        if export_format == "parquet" and not parquet_available():
+            return APIResponse.error_with_code_message(message="parquet export is not available")
+        if non_null_non_empty(json_data, "start_date"):
+            start_date = datetime.strptime(json_data["start_date"], "%a, %d %b %Y %H:%M:%S %Z").date()
+            end_date = datetime.strptime(json_data["end_date"], "%a, %d %b %Y %H:%M:%S %Z").date()
+            if end_date < start_date:
+                return APIResponse.error_with_code_message(message="end_date cannot be before start_date")
+            if export_format == "csv":
+                # Streamed as the response is sent, after this function has returned
+                return export_medical_records_range_csv(user_id, start_date, end_date)
+            # Rows are streamed while the file is written, so the format's phase includes fetching them
+            with phase(export_format):
+                if export_format == "parquet":
+                    return export_medical_records_range_parquet(session, user_id, start_date, end_date)
+                return export_medical_records_range(session, user_id, start_date, end_date)
+
         parsed_opd_date = datetime.strptime(json_data["opd_date"], "%a, %d %b %Y %H:%M:%S %Z").date()
         month_name = parsed_opd_date.strftime("%b")
 
@@ -128,243 +373,67 @@ def export_medical_records(request: flask.Request) -> flask.typing.ResponseRetur
         next_month_start_date = (month_start_date + timedelta(days=32)).replace(day=1)
         month_end_date = next_month_start_date - timedelta(days=1)
 
-        export_date_map = {month_start_date + timedelta(days=i): None for i in range((month_end_date - month_start_date).days + 1)}
-        map_of_records = {}
-
-        records = session.query(Record).filter(Record.firebase_user_id == user_id, Record.opd_date >= month_start_date, Record.opd_date < month_end_date).all()
-
-        export_data = [
-            ["", "New Case", "Old Case", "Total Case"],
-            # ["Date", "0-15 Years", "16-60 years" ,"60 above", "total", "0-15 Years", "16-60 years", "60 above", "total", "0-15 Years", "16-60 years", "60 above", "total"],
-            ["Date"],
-            ["",      "M","F",        "M", "F",    "M", "F",  "M", "F", "M","F",        "M", "F",    "M", "F",  "M", "F",  "M","F",      "M", "F",     "M", "F", "M", "F"],
-            # ["abc", 5, 10, 15, 20, 25, 30, 40,50, 5, 10, 15, 20, 25, 30, 40,50, 5, 10, 15, 20, 25, 30, 40,50],
-            # ["Doe Joe", 35, "UK"]
-        ]
-
-        if non_null_non_empty_list(records):
-            record_ids = []
-            for record in records:
-                record_ids.append(record.id)
-                export_date_map[record.opd_date] = record
-            
-            groups = session.query(RecordGroup).filter(RecordGroup.record_id.in_(record_ids)).all()
-            if non_null_non_empty_list(groups):
-                for group in groups:
-                    map_of_records.setdefault(group.record_id, []).append(group)
-        
-        for i in range((month_end_date - month_start_date).days + 1):
-            date_row = month_start_date + timedelta(days=i)
-            record = export_date_map.get(date_row)
-            excel_row = []
-            excel_row.append(date_row.strftime("%d-%m-%Y"))
-            if record:
-                groups = map_of_records.get(record.id)
-                up_to_15 = None
-                up_to_60 = None
-                after_60 = None
-                for group in groups:
-                    if group.name == '0-15 years':
-                        up_to_15 = group
-                    elif group.name == "15-60 years":
-                        up_to_60 = group
-                    elif group.name == "60+ years":
-                        after_60 = group
-                    else:
-                        print("ERROR_GROUP_NAME ::: group mismatch with id " + group.id)
-                
-                # NEW CASE
-                excel_row.append(replace_none(up_to_15.new_male))
-                excel_row.append(replace_none(up_to_15.new_female))
-                
-                excel_row.append(replace_none(up_to_60.new_male))
-                excel_row.append(replace_none(up_to_60.new_female))
-
-                excel_row.append(replace_none(after_60.new_male))
-                excel_row.append(replace_none(after_60.new_female))
-
-                excel_row.append(sum_nullable(up_to_15.new_male, up_to_60.new_male, after_60.new_male))
-                excel_row.append(sum_nullable(up_to_15.new_female, up_to_60.new_female, after_60.new_female))
-
-                # OLD CASE
-                excel_row.append(replace_none(up_to_15.old_male))
-                excel_row.append(replace_none(up_to_15.old_female))
-                
-                excel_row.append(replace_none(up_to_60.old_male))
-                excel_row.append(replace_none(up_to_60.old_female))
-
-                excel_row.append(replace_none(after_60.old_male))
-                excel_row.append(replace_none(after_60.old_female))
-
-                excel_row.append(sum_nullable(up_to_15.old_male, up_to_60.old_male, after_60.old_male))
-                excel_row.append(sum_nullable(up_to_15.old_female, up_to_60.old_female, after_60.old_female))
-
-                # TOTAL CASE
-                excel_row.append(sum_nullable(up_to_15.new_male, up_to_15.old_male))
-                excel_row.append(sum_nullable(up_to_15.new_female, up_to_15.old_female))
-                
-                excel_row.append(sum_nullable(up_to_60.new_male, up_to_60.old_male))
-                excel_row.append(sum_nullable(up_to_60.new_female, up_to_60.old_female))
-
-                excel_row.append(sum_nullable(after_60.new_male, after_60.new_male))
-                excel_row.append(sum_nullable(after_60.new_female, after_60.old_female))
-
-                excel_row.append(sum_nullable(up_to_15.new_male, up_to_60.new_male, after_60.new_male, up_to_15.old_male, up_to_60.old_male, after_60.old_male))
-                excel_row.append(sum_nullable(up_to_15.new_female, up_to_60.new_female, after_60.new_female, up_to_15.old_female, up_to_60.old_female, after_60.old_female))
-
-                # print(excel_row)
-            else:
-                for i in range(0,24):
-                    excel_row.append(0)
-            export_data.append(excel_row)
-        
-        ignored_data = [row[1:] for row in export_data[3:]]
-        column_totals = [sum(col) for col in zip(*ignored_data)]        
-        
-        column_totals.insert(0, "Total")
-        #print(ignored_data)    
-        #print(column_totals)
-
-        export_data.append(column_totals)
-
-        output = BytesIO()
-        workbook = xlsxwriter.Workbook(output, {'in_memory': True})
-        worksheet = workbook.add_worksheet()
-        worksheet.merge_range('B1:I1', 'New Case')
-        worksheet.merge_range('J1:Q1', 'Old Case')
-        worksheet.merge_range('R1:Z1', 'Total Case')
-
-        worksheet.merge_range('B2:C2', '0-15 Years')
-        worksheet.merge_range('D2:E2', '16-60 Years')
-        worksheet.merge_range('F2:G2', '60 Above')
-        worksheet.merge_range('H2:I2', 'Total')
-
-        worksheet.merge_range('J2:K2', '0-15 Years')
-        worksheet.merge_range('L2:M2', '16-60 Years')
-        worksheet.merge_range('N2:O2', '60 Above')
-        worksheet.merge_range('P2:Q2', 'Total')
-
-        worksheet.merge_range('R2:S2', '0-15 Years')
-        worksheet.merge_range('T2:U2', '16-60 Years')
-        worksheet.merge_range('V2:W2', '60 Above')
-        worksheet.merge_range('X2:Y2', 'Total')
-
-        cell_format = workbook.add_format({'align': 'center'})
-
-        # Write data to the worksheet with the cell format
-        for row_num, row_data in enumerate(export_data):
-            for col_num, cell_data in enumerate(row_data):
-                worksheet.write(row_num, col_num, cell_data, cell_format)
-
-        last_row = len(export_data)+2
-        worksheet.merge_range(f'B{last_row}:N{last_row}', 'New', cell_format)
-        worksheet.merge_range(f'O{last_row}:Z{last_row}', 'Old', cell_format)
-        
-        last_row += 1
-        worksheet.merge_range(f'B{last_row}:E{last_row}', '0-15 years', cell_format)
-        worksheet.merge_range(f'F{last_row}:I{last_row}', '15-60 years', cell_format)
-        worksheet.merge_range(f'J{last_row}:M{last_row}', '>60 years', cell_format)
-        worksheet.merge_range(f'N{last_row}:Q{last_row}', '0-15 years', cell_format)
-        worksheet.merge_range(f'R{last_row}:U{last_row}', '15-60 years', cell_format)
-        worksheet.merge_range(f'V{last_row}:Y{last_row}', '>60 years', cell_format)
-        worksheet.merge_range(f'Z{last_row}:AD{last_row}', 'Grand Total', cell_format)
-        last_row += 1
-        
-        # new
-        worksheet.write(f'B{last_row}:C{last_row}', 'Male', cell_format)
-        worksheet.write(f'C{last_row}:D{last_row}', 'Female', cell_format)
-        worksheet.write(f'D{last_row}:E{last_row}', 'total', cell_format)
-        worksheet.write(f'E{last_row}:F{last_row}', 'Medicine Days', cell_format)
-        worksheet.write(f'F{last_row}:G{last_row}', 'Male', cell_format)
-        worksheet.write(f'G{last_row}:H{last_row}', 'Female', cell_format)
-        worksheet.write(f'H{last_row}:I{last_row}', 'total', cell_format)
-        worksheet.write(f'I{last_row}:J{last_row}', 'Medicine Days', cell_format)
-        worksheet.write(f'J{last_row}:K{last_row}', 'Male', cell_format)
-        worksheet.write(f'K{last_row}:L{last_row}', 'Female', cell_format)
-        worksheet.write(f'L{last_row}:M{last_row}', 'total', cell_format)
-        worksheet.write(f'M{last_row}:N{last_row}', 'Medicine Days', cell_format)
-        #old
-        worksheet.write(f'N{last_row}:O{last_row}', 'Male', cell_format)
-        worksheet.write(f'O{last_row}:P{last_row}', 'Female', cell_format)
-        worksheet.write(f'P{last_row}:Q{last_row}', 'total', cell_format)
-        worksheet.write(f'Q{last_row}:R{last_row}', 'Medicine Days', cell_format)
-        worksheet.write(f'R{last_row}:S{last_row}', 'Male', cell_format)
-        worksheet.write(f'S{last_row}:T{last_row}', 'Female', cell_format)
-        worksheet.write(f'T{last_row}:U{last_row}', 'total', cell_format)
-        worksheet.write(f'U{last_row}:V{last_row}', 'Medicine Days', cell_format)
-        worksheet.write(f'V{last_row}:W{last_row}', 'Male', cell_format)
-        worksheet.write(f'W{last_row}:X{last_row}', 'Female', cell_format)
-        worksheet.write(f'X{last_row}:Y{last_row}', 'total', cell_format)
-        worksheet.write(f'Y{last_row}:Z{last_row}', 'Medicine Days', cell_format)
-        #grand total
-        worksheet.write(f'Z{last_row}:AA{last_row}', 'Male', cell_format)
-        worksheet.write(f'AA{last_row}:AB{last_row}', 'Female', cell_format)
-        worksheet.write(f'AB{last_row}:AC{last_row}', 'total', cell_format)
-        worksheet.write(f'AC{last_row}:AD{last_row}', 'Medicine Days', cell_format)
-        
-        # worksheet.write(f'A{last_row+1}:B{last_row+1}', "Movana", cell_format)
-        row = []
-        #new
-        row.append("Movana")
-        row.append(column_totals[1]) #male
-        row.append(column_totals[2]) #female
-        row.append(column_totals[1]+column_totals[2]) #total
-        row.append((column_totals[1]+column_totals[2])*4) #medicine days
-
-        row.append(column_totals[3]) #male
-        row.append(column_totals[4]) #female
-        row.append(column_totals[3]+column_totals[4]) #total
-        row.append((column_totals[3]+column_totals[4])*4) #medicine days
-
-        row.append(column_totals[5]) #male
-        row.append(column_totals[6]) #female
-        row.append(column_totals[5]+column_totals[6]) #total
-        row.append((column_totals[5]+column_totals[6])*4) #medicine days
-
-        # old        
-        row.append(column_totals[9]) #male
-        row.append(column_totals[10]) #female
-        row.append(column_totals[9]+column_totals[10]) #total
-        row.append((column_totals[9]+column_totals[10])*4) #medicine days
-
-        row.append(column_totals[11]) #male
-        row.append(column_totals[12]) #female
-        row.append(column_totals[11]+column_totals[12]) #total
-        row.append((column_totals[11]+column_totals[12])*4) #medicine days
-
-        row.append(column_totals[13]) #male
-        row.append(column_totals[14]) #female
-        row.append(column_totals[13]+column_totals[14]) #total
-        row.append((column_totals[13]+column_totals[14])*4) #medicine days
-
-        #grand total
-        row.append(column_totals[23]) #male
-        row.append(column_totals[24]) #female
-        row.append(column_totals[23]+column_totals[24]) #total
-        row.append((column_totals[23]+column_totals[24])*4) #medicine days
-
-        additional_data = [row]
-        
-        for row_num, row_data in enumerate(additional_data, start=last_row):
-            worksheet.write_row(row_num, 0, row_data)
-        
-        # Save the workbook to a BytesIO object
-        workbook.close()
-        output.seek(0)
         year = parsed_opd_date.year
         current_timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        excel_file_name = f"{month_name}_{year}_{current_timestamp}.xlsx"
+        excel_file_name = f"{month_name}_{year}_{current_timestamp}.{export_format}"
+
+        # Unchanged months are answered with 304 or from the workbook cache, without rebuilding
+        fingerprint = fetch_export_fingerprint(session, user_id, month_start_date, month_end_date)
+        etag = export_etag(user_id, month_start_date, *fingerprint, export_format, EXPORT_VERSION)
+        if request.if_none_match.contains(etag):
+            return add_export_headers(flask.Response(status=304), etag)
+        with phase('cache'):
+            cached_workbook = export_cache.get(etag)
+        if cached_workbook is not None:
+            return send_export(BytesIO(cached_workbook), excel_file_name, export_format, etag)
+
+        day_rows, month_rollup = fetch_export_rows(session, user_id, month_start_date, month_end_date)
+
+        export_data = [list(row) for row in EXPORT_HEADER_ROWS]
+
+        with phase('pivot'):
+            export_data.extend(dated_sheet_rows(day_rows, sheet_columns_of(day_rows)))
+
+            # Month totals come from opd_monthly_rollups instead of re-summing every row
+            if month_rollup:
+                column_totals = sheet_columns_of([month_rollup])[0].tolist()
+            else:
+                column_totals = [0] * 24
+
+            column_totals.insert(0, "Total")
+            #print(column_totals)
+
+            export_data.append(column_totals)
+
+        # CSV and Parquet are built straight from the pivoted rows, without xlsxwriter
+        day_export_rows = export_data[len(EXPORT_HEADER_ROWS):-1]
+        if export_format == "csv":
+            with phase('csv'):
+                output = BytesIO(csv_sheet_bytes(day_export_rows, column_totals))
+        elif export_format == "parquet":
+            with phase('parquet'):
+                output = BytesIO(parquet_bytes(day_export_rows, column_totals))
+        else:
+            with phase('xlsx'):
+                import xlsxwriter
+                output = BytesIO()
+                workbook = xlsxwriter.Workbook(output, {'in_memory': True})
+                worksheet = workbook.add_worksheet()
+                cell_format = workbook.add_format({'align': 'center'})
+
+                write_sheet_header(worksheet, cell_format)
+                write_rows(worksheet, len(EXPORT_HEADER_ROWS), export_data[len(EXPORT_HEADER_ROWS):], cell_format)
+                write_sheet_summary(worksheet, len(export_data)+2, column_totals, cell_format)
+
+                # Save the workbook to a BytesIO object
+                workbook.close()
+        with phase('cache'):
+            export_cache.put(etag, output.getvalue(), export_format)
+        output.seek(0)
 
         # print(excel_file_name)
         # Return the BytesIO object as the response
-        resp = send_file(output, mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', as_attachment=True, download_name=excel_file_name)
-        resp.headers.add('Access-Control-Allow-Origin', '*')
-        resp.headers.add('Access-Control-Allow-Methods', '*')
-        resp.headers.add('Access-Control-Allow-Headers', 'Origin, X-Requested-With, Content-Type, Accept')
-        resp.headers.add('Access-Control-Max-Age', '3600')
-        resp.headers.add('X-Content-Type-Options', 'nosniff')
-
-        return resp
+        return send_export(output, excel_file_name, export_format, etag)
 
     finally:
         session.close()
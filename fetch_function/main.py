@@ -1,64 +1,136 @@
 from flask import Flask, request, jsonify
 import flask
 import logging
-import psycopg2
 from psycopg2 import sql
 import os
 from psycopg2.extras import RealDictCursor
 
-from api_response import APIResponse
-import firebase_admin
-from firebase_admin import credentials, auth
-import json
-
-db_params = {
-    'host': os.environ.get('DB_HOST'),
-    'port': os.environ.get('DB_PORT'),
-    'user': os.environ.get('DB_USER'),
-    'password': os.environ.get('DB_PASSWORD'),
-    'database': os.environ.get('DB_NAME'),
-}
-
-# Check if the service account key JSON is available as an environment variable
-if 'FIREBASE_SERVICE_ACCOUNT' in os.environ:
-    # Load the service account key from the environment variable
-    service_account_info = json.loads(os.environ['FIREBASE_SERVICE_ACCOUNT'])
-    cred = credentials.Certificate(service_account_info)
-else:
-    # If the environment variable is not set, initialize Firebase Admin SDK without credentials
-    cred = None
-
-firebase_admin.initialize_app(cred)
+from medical_core.api_response import APIResponse
+from medical_core.auth import auth_user_by_token
+from medical_core.db import get_pool
+from medical_core.prepared import Statement
+from medical_core.record_counts import groups_json_sql
+from medical_core.timing import phase, timed_request
+import base64
+from datetime import date
+
+
+# Totals are summed from the record's inline counts; the 12 count columns
+# themselves are left out of the page, which lists days rather than groups
+LIST_RECORDS_QUERY = sql.SQL("""SELECT 
+            r.id, r.opd_type, r.updated_at, r.opd_date, r.firebase_user_id, 
+            r.up_to_15_new_male + r.up_to_15_new_female + r.up_to_60_new_male + r.up_to_60_new_female 
+                + r.after_60_new_male + r.after_60_new_female AS new_total, 
+            r.up_to_15_old_male + r.up_to_15_old_female + r.up_to_60_old_male + r.up_to_60_old_female 
+                + r.after_60_old_male + r.after_60_old_female AS old_total 
+        FROM 
+            mo_records r 
+        where r.firebase_user_id = %(user_id)s
+        ORDER BY r.opd_date desc 
+        LIMIT %(limit)s OFFSET %(offset)s""")
+
+# Keyset page: seeks past the (opd_date, id) cursor instead of using OFFSET
+LIST_RECORDS_AFTER_CURSOR_QUERY = sql.SQL("""SELECT 
+            r.id, r.opd_type, r.updated_at, r.opd_date, r.firebase_user_id, 
+            r.up_to_15_new_male + r.up_to_15_new_female + r.up_to_60_new_male + r.up_to_60_new_female 
+                + r.after_60_new_male + r.after_60_new_female AS new_total, 
+            r.up_to_15_old_male + r.up_to_15_old_female + r.up_to_60_old_male + r.up_to_60_old_female 
+                + r.after_60_old_male + r.after_60_old_female AS old_total 
+        FROM 
+            mo_records r 
+        where r.firebase_user_id = %(user_id)s
+            AND (r.opd_date, r.id) < (%(cursor_date)s::date, %(cursor_id)s)
+        ORDER BY r.opd_date desc, r.id desc 
+        LIMIT %(limit)s""")
+
+# Prepared once per pooled connection, then run by name (see medical_core/prepared.py)
+LIST_RECORDS_STATEMENT = Statement('fetch_records_page', LIST_RECORDS_QUERY)
+LIST_RECORDS_AFTER_CURSOR_STATEMENT = Statement('fetch_records_after_cursor', LIST_RECORDS_AFTER_CURSOR_QUERY)
+
+# Changes of one user after the (change_txid, id) position in the watermark, records and
+# tombstones merged in that order. snapshot_floor is the oldest transaction still running
+# when the query's snapshot was taken; anything that commits later has a txid at or above it.
+SYNC_RECORDS_QUERY = sql.SQL(f"""SELECT f.snapshot_floor, c.*
+        FROM (SELECT txid_snapshot_xmin(txid_current_snapshot()) AS snapshot_floor) f
+        LEFT JOIN LATERAL (
+            SELECT * FROM (
+                (SELECT r.change_txid, r.id, false AS deleted, r.opd_type, r.updated_at, r.opd_date,
+                        r.firebase_user_id, {groups_json_sql()} AS groups
+                FROM mo_records r
+                where r.firebase_user_id = %(user_id)s
+                    AND (r.change_txid, r.id) > (%(after_txid)s, %(after_id)s)
+                ORDER BY r.change_txid, r.id
+                LIMIT %(limit)s)
+                UNION ALL
+                (SELECT t.change_txid, t.record_id, true, NULL::integer, NULL::timestamp, NULL::date,
+                        t.firebase_user_id, NULL::json
+                FROM mo_record_tombstones t
+                where t.firebase_user_id = %(user_id)s
+                    AND (t.change_txid, t.record_id) > (%(after_txid)s, %(after_id)s)
+                ORDER BY t.change_txid, t.record_id
+                LIMIT %(limit)s)
+            ) changes
+            ORDER BY change_txid, id
+            LIMIT %(limit)s
+        ) c ON true
+        ORDER BY c.change_txid, c.id""")
+
+# Most changes returned by one sync_records call; clients call again while has_more is set
+SYNC_PAGE_ROWS = int(os.environ.get('SYNC_PAGE_ROWS', 1000))
+
+# Pages of at least this many rows are streamed from a server-side cursor instead of
+# being fetched and serialized in one go; clients can also ask with page.stream
+FETCH_STREAM_MIN_ROWS = int(os.environ.get('FETCH_STREAM_MIN_ROWS', 1000))
+# Rows read from the server-side cursor, and encoded, per round trip
+FETCH_STREAM_CHUNK_ROWS = int(os.environ.get('FETCH_STREAM_CHUNK_ROWS', 500))
 
 def execute_query(connection, query, params=None):
-    with connection.cursor(cursor_factory=RealDictCursor) as cursor:
-        if params:
+    with phase('query'), connection.cursor(cursor_factory=RealDictCursor) as cursor:
+        if isinstance(query, Statement):
+            query.execute(cursor, params)
+        elif params:
             cursor.execute(query, params)
         else:
             cursor.execute(query)
         result = cursor.fetchall()
         return result
 
-def auth_user_by_token(request: flask.Request):
-    user_token = request.headers.get("user-token")
-    try:
-        # Verify the Firebase ID token
-        decoded_token = auth.verify_id_token(user_token)
-        # Extract user ID from decoded token
-        uid = decoded_token['uid']
-        # Retrieve user information
-        user = auth.get_user(uid)
-        # print(user.uid)
-        # print(user.display_name)
-        # print(user.email)
-        # print(user.disabled)
-        return user.uid
-    except ValueError as e:
-        # Handle invalid tokens or other errors
-        print('Authentication failed:', e)
-        return None
+def stream_query(query, params, chunk_rows=FETCH_STREAM_CHUNK_ROWS):
+    # Yields lists of up to chunk_rows rows from a named (server-side) cursor, so only one
+    # chunk is ever in memory. Runs while the response is being sent, and holds its pooled
+    # connection until the last chunk is out or the client goes away.
+    with get_pool().connection() as connection:
+        with connection.cursor(name='fetch_records_stream', cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(chunk_rows)
+                if len(rows) == 0:
+                    break
+                yield rows
 
+def encode_cursor(opd_date, record_id):
+    # Opaque to clients: base64 of "<opd_date>:<id>" of the last row on the page
+    raw = f"{opd_date.isoformat()}:{record_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
 
+def decode_cursor(cursor):
+    raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+    opd_date, record_id = raw.split(":")
+    return date.fromisoformat(opd_date), int(record_id)
+
+def encode_watermark(after_txid, after_id, round_floor=None):
+    # Opaque to clients: base64 of "<change_txid>:<id>:<round floor>" of the last change sent;
+    # the round floor is only set while a sync is still paging (has_more)
+    raw = f"{after_txid}:{after_id}:{'' if round_floor is None else round_floor}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_watermark(watermark):
+    raw = base64.urlsafe_b64decode(watermark.encode()).decode()
+    after_txid, after_id, round_floor = raw.split(":")
+    return int(after_txid), int(after_id), int(round_floor) if round_floor else None
+
+
+@timed_request
 def fetch_records_list(request: flask.Request)-> flask.typing.ResponseReturnValue:
     if request.method == 'OPTIONS':
         # Allows GET requests from any origin with the Content-Type
@@ -77,31 +149,28 @@ def fetch_records_list(request: flask.Request)-> flask.typing.ResponseReturnValu
         return APIResponse.error_with_code_message(message="Unauthorized")
 
     data = request.get_json()
-    page_id = request.json.get('page', {}).get('page_id', 0)
-    page_limit = request.json.get('page', {}).get('page_limit', 20)
     try:
-        # Connect to the PostgreSQL database
-        connection = psycopg2.connect(**db_params)
-        
-        select_query = sql.SQL("""SELECT 
-            r.*, 
-            COALESCE(SUM(COALESCE(g.new_male, 0)) + SUM(COALESCE(g.new_female, 0)), 0) AS new_total, 
-            COALESCE(SUM(COALESCE(g.old_male, 0)) + SUM(COALESCE(g.old_female, 0)), 0) AS old_total 
-        FROM 
-            mo_records r 
-        JOIN 
-            record_groups g ON r.id = g.record_id 
-        where r.firebase_user_id = %(user_id)s
-        GROUP BY 
-            r.id 
-        ORDER BY r.opd_date desc 
-        LIMIT %(limit)s OFFSET %(offset)s""")
+        page_id = int(request.json.get('page', {}).get('page_id', 0))
+        page_limit = int(request.json.get('page', {}).get('page_limit', 20))
+    except (TypeError, ValueError) as e:
+        print(f"Invalid page: {str(e)}")
+        return APIResponse.error_with_code_message(message="invalid page")
+    if 'cursor' in request.json.get('page', {}):
+        return fetch_records_page_by_cursor(user_id, request.json['page']['cursor'], page_limit)
+    if request.json.get('page', {}).get('stream', page_limit >= FETCH_STREAM_MIN_ROWS):
+        # Only the setup up to here is timed by @timed_request; the rows are read and sent
+        # after the handler returns, so Server-Timing and the timing log leave them out
+        query_params = {'limit': page_limit, 'offset': page_id*page_limit, "user_id" : user_id}
+        return APIResponse.ok_with_stream('results', stream_query(LIST_RECORDS_QUERY, query_params))
+    try:
+        select_query = LIST_RECORDS_STATEMENT
 
         # Parameters for the query
         query_params = {'limit': page_limit, 'offset': page_id*page_limit, "user_id" : user_id}
 
-        # Execute the query and fetch results
-        result = execute_query(connection, select_query, query_params)
+        # Execute the query on a pooled connection and fetch results
+        with get_pool().connection() as connection:
+            result = execute_query(connection, select_query, query_params)
 
         return APIResponse.ok_with_data({'results': result})
 
@@ -111,3 +180,99 @@ def fetch_records_list(request: flask.Request)-> flask.typing.ResponseReturnValu
         
     return APIResponse.error_with_code_message("something went wrong")
 
+
+def fetch_records_page_by_cursor(user_id, cursor, page_limit):
+    # Keyset pagination: seek straight past the last (opd_date, id) the client saw,
+    # so deep pages cost the same as the first one.
+    # A null cursor asks for the first page, which seeks from past the newest possible row.
+    try:
+        if cursor:
+            cursor_date, cursor_id = decode_cursor(cursor)
+        else:
+            cursor_date, cursor_id = 'infinity', 2147483647
+    except (ValueError, UnicodeDecodeError) as e:
+        print(f"Invalid cursor: {str(e)}")
+        return APIResponse.error_with_code_message(message="invalid cursor")
+
+    try:
+        select_query = LIST_RECORDS_AFTER_CURSOR_STATEMENT
+
+        query_params = {'limit': page_limit, 'user_id': user_id, 'cursor_date': cursor_date, 'cursor_id': cursor_id}
+
+        with get_pool().connection() as connection:
+            result = execute_query(connection, select_query, query_params)
+
+        next_cursor = None
+        if len(result) == page_limit:
+            last = result[-1]
+            next_cursor = encode_cursor(last['opd_date'], last['id'])
+
+        return APIResponse.ok_with_data({'results': result, 'next_cursor': next_cursor})
+
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        return APIResponse.error_with_code_message(message="something went wrong ::: " + str(e))
+
+
+@timed_request
+def sync_records(request: flask.Request) -> flask.typing.ResponseReturnValue:
+    # Delta sync ({"watermark": ...}): the records of this user changed since the watermark,
+    # with groups as in detail_record, the ids of records deleted since then, and the
+    # watermark to send next time. A null watermark asks for everything.
+    # Changes are ordered by the id of the transaction that wrote them, not by the client's
+    # updated_at. A sync that pages (has_more) keeps the snapshot floor of its first call, and
+    # the next round restarts from there, so transactions that were still running when the
+    # round began are picked up by it. Changes may therefore be sent twice, never missed.
+    if request.method == 'OPTIONS':
+        headers = {
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Methods":"*",
+            "Access-Control-Allow-Headers":"*",
+            "Access-Control-Allow-Credentials":"true",
+            "Access-Control-Max-Age":"3600"
+        }
+
+        return ('', 200, headers)
+
+    user_id = auth_user_by_token(request=request)
+    if user_id is None:
+        return APIResponse.error_with_code_message(message="Unauthorized")
+
+    watermark = (request.get_json(silent=True) or {}).get('watermark')
+    try:
+        if watermark:
+            after_txid, after_id, round_floor = decode_watermark(watermark)
+        else:
+            after_txid, after_id, round_floor = 0, 0, None
+    except (ValueError, UnicodeDecodeError) as e:
+        print(f"Invalid watermark: {str(e)}")
+        return APIResponse.error_with_code_message(message="invalid watermark")
+
+    try:
+        query_params = {'user_id': user_id, 'after_txid': after_txid, 'after_id': after_id, 'limit': SYNC_PAGE_ROWS}
+        with get_pool().connection() as connection:
+            rows = execute_query(connection, SYNC_RECORDS_QUERY, query_params)
+
+        if round_floor is None:
+            round_floor = rows[0]['snapshot_floor']
+        changes = [row for row in rows if row['id'] is not None]
+        results = []
+        deleted = []
+        for row in changes:
+            if row['deleted']:
+                deleted.append(row['id'])
+            else:
+                results.append({key: value for key, value in row.items() if key not in ('snapshot_floor', 'change_txid', 'deleted')})
+
+        has_more = len(changes) == SYNC_PAGE_ROWS
+        if has_more:
+            next_watermark = encode_watermark(changes[-1]['change_txid'], changes[-1]['id'], round_floor)
+        else:
+            # Everything below the round's floor has been sent; start the next round there
+            next_watermark = encode_watermark(round_floor, 0)
+
+        return APIResponse.ok_with_data({'results': results, 'deleted': deleted, 'watermark': next_watermark, 'has_more': has_more})
+
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        return APIResponse.error_with_code_message(message="something went wrong ::: " + str(e))
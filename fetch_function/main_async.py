@@ -0,0 +1,72 @@
+"""Async (asyncpg) version of fetch_records_list, served as an ASGI app.
+
+Same request and response as main.fetch_records_list, running on one event
+loop with an asyncpg pool instead of a thread per request:
+
+    uvicorn main_async:app --port 8080
+"""
+from datetime import date
+
+from main import LIST_RECORDS_QUERY, LIST_RECORDS_AFTER_CURSOR_QUERY, encode_cursor, decode_cursor
+from medical_core.asgi import api_error, api_ok, asgi_app
+from medical_core.async_db import fetch_for_user, positional
+from medical_core.auth import start_auth_user_by_token
+
+LIST_RECORDS_SQL, LIST_RECORDS_PARAMS = positional(LIST_RECORDS_QUERY.string)
+LIST_RECORDS_AFTER_CURSOR_SQL, LIST_RECORDS_AFTER_CURSOR_PARAMS = positional(LIST_RECORDS_AFTER_CURSOR_QUERY.string)
+
+
+async def fetch_records_list(data, headers):
+    # Firebase verification runs while the query is being prepared
+    auth_task = start_auth_user_by_token(headers.get("user-token"))
+    page = data.get('page', {})
+    page_id = page.get('page_id', 0)
+    page_limit = page.get('page_limit', 20)
+    if 'cursor' in page:
+        return await fetch_records_page_by_cursor(auth_task, page['cursor'], page_limit)
+    try:
+        query_params = {'limit': page_limit, 'offset': page_id*page_limit}
+        user_id, rows = await fetch_for_user(auth_task, LIST_RECORDS_SQL, LIST_RECORDS_PARAMS, query_params)
+        if user_id is None:
+            return api_error(message="Unauthorized")
+
+        return api_ok({'results': [dict(row) for row in rows]})
+
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        return api_error("something went wrong ::: " + str(e))
+
+
+async def fetch_records_page_by_cursor(auth_task, cursor, page_limit):
+    # asyncpg has no 'infinity' literal for dates; date.max is sent as infinity
+    try:
+        if cursor:
+            cursor_date, cursor_id = decode_cursor(cursor)
+        else:
+            cursor_date, cursor_id = date.max, 2147483647
+    except (ValueError, UnicodeDecodeError) as e:
+        if await auth_task is None:
+            return api_error(message="Unauthorized")
+        print(f"Invalid cursor: {str(e)}")
+        return api_error(message="invalid cursor")
+
+    try:
+        query_params = {'limit': page_limit, 'cursor_date': cursor_date, 'cursor_id': cursor_id}
+        user_id, rows = await fetch_for_user(auth_task, LIST_RECORDS_AFTER_CURSOR_SQL, LIST_RECORDS_AFTER_CURSOR_PARAMS, query_params)
+        if user_id is None:
+            return api_error(message="Unauthorized")
+
+        result = [dict(row) for row in rows]
+        next_cursor = None
+        if len(result) == page_limit:
+            last = result[-1]
+            next_cursor = encode_cursor(last['opd_date'], last['id'])
+
+        return api_ok({'results': result, 'next_cursor': next_cursor})
+
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        return api_error(message="something went wrong ::: " + str(e))
+
+
+app = asgi_app(fetch_records_list)
@@ -1,44 +1,17 @@
 from flask import Flask, request, jsonify
 import flask
-from sqlalchemy import Column, DateTime, Integer, String, create_engine, Date
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy import update, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
 import os
-from datetime import datetime, timedelta
-from api_response import APIResponse
-import firebase_admin
-from firebase_admin import credentials, auth
-import json
-
-db_params = {
-    'host': os.environ.get('DB_HOST'),
-    'port': os.environ.get('DB_PORT'),
-    'user': os.environ.get('DB_USER'),
-    'password': os.environ.get('DB_PASSWORD'),
-    'database': os.environ.get('DB_NAME'),
-}
-
-# Check if the service account key JSON is available as an environment variable
-if 'FIREBASE_SERVICE_ACCOUNT' in os.environ:
-    # Load the service account key from the environment variable
-    service_account_info = json.loads(os.environ['FIREBASE_SERVICE_ACCOUNT'])
-    cred = credentials.Certificate(service_account_info)
-else:
-    # If the environment variable is not set, initialize Firebase Admin SDK without credentials
-    cred = None
-
-firebase_admin.initialize_app(cred)
-
-
-# Construct the database URL
-db_url = f"postgresql://{db_params['user']}:{db_params['password']}@{db_params['host']}:{db_params['port']}/{db_params['database']}"
-
-# Create the database engine
-engine = create_engine(db_url, echo=True)
-
-# Create a session factory
-Session = sessionmaker(bind=engine)
-
-Base = declarative_base()
+from datetime import datetime
+from medical_core.api_response import APIResponse
+from medical_core.auth import auth_user_by_token
+from medical_core.db import Session
+from medical_core.models import Record
+from medical_core.record_counts import COUNT_COLUMNS, group_counts
+from medical_core.timing import phase, timed_request
+from rollups import refresh_rollups
 
 def non_null_non_empty(data, key):
     value = data.get(key)
@@ -50,43 +23,43 @@ def non_null_non_empty(data, key):
     else:
         return True
     
-class Record(Base):
-    __tablename__ = 'mo_records'
-    id = Column(Integer, primary_key=True)
-    opd_type = Column(Integer, name="opd_type")
-    updated_at = Column(DateTime, default=datetime.utcnow, name="updated_at")
-    opd_date = Column(Date, name="opd_date")
-    firebase_user_id = Column(String, name="firebase_user_id")
-
-class RecordGroup(Base):
-    __tablename__ = 'record_groups'
-    id = Column(Integer, primary_key=True)
-    name = Column(String, name="name")
-    new_male = Column(Integer, name="new_male")
-    new_female = Column(Integer, name="new_female")
-    old_male = Column(Integer, name="old_male")
-    old_female = Column(Integer, name="old_female")
-    record_id = Column(Integer, name="record_id")
-
-def auth_user_by_token(request: flask.Request):
-    user_token = request.headers.get("user-token")
-    try:
-        # Verify the Firebase ID token
-        decoded_token = auth.verify_id_token(user_token)
-        # Extract user ID from decoded token
-        uid = decoded_token['uid']
-        # Retrieve user information
-        user = auth.get_user(uid)
-        # print(user.uid)
-        # print(user.display_name)
-        # print(user.email)
-        # print(user.disabled)
-        return user.uid
-    except ValueError as e:
-        # Handle invalid tokens or other errors
-        print('Authentication failed:', e)
-        return None
-
+# Largest number of days accepted by insert_medical_records_batch in one request
+INSERT_BATCH_MAX_RECORDS = int(os.environ.get('INSERT_BATCH_MAX_RECORDS', 366))
+
+_count_columns = ", ".join(COUNT_COLUMNS)
+_count_params = ", ".join(f":{column}" for column in COUNT_COLUMNS)
+_set_counts = ", ".join(f"{column} = :{column}" for column in COUNT_COLUMNS)
+
+# New day: a concurrent or repeated submit for the same (firebase_user_id, opd_date)
+# hits the unique constraint and returns no row instead of creating a duplicate.
+# The group counts are columns of the record, so one row is written per day.
+INSERT_RECORD_SQL = f"""
+INSERT INTO mo_records (opd_type, opd_date, updated_at, firebase_user_id, {_count_columns})
+VALUES (:opd_type, :opd_date, :updated_at, :user_id, {_count_params})
+ON CONFLICT (firebase_user_id, opd_date) DO NOTHING
+RETURNING id, CAST(NULL AS date) AS previous_opd_date
+"""
+
+# Existing record of this user: update it and its counts in place,
+# returning the day it was on before so that day's rollup can be refreshed.
+UPDATE_RECORD_SQL = f"""
+WITH previous AS (
+    SELECT id, opd_date FROM mo_records
+    WHERE id = :id AND firebase_user_id = :user_id
+    FOR UPDATE
+)
+UPDATE mo_records r
+SET opd_type = :opd_type, opd_date = :opd_date, updated_at = :updated_at, {_set_counts}
+FROM previous
+WHERE r.id = previous.id
+RETURNING r.id, previous.opd_date AS previous_opd_date
+"""
+
+def group_params(groups):
+    # The 12 inline counts; groups after the third are ignored, missing ones count 0
+    return group_counts(groups[:3])
+
+@timed_request
 def insert_medical_record(request: flask.Request) -> flask.typing.ResponseReturnValue:
     # Use request.get_json() to get parsed JSON data
     if request.method == 'OPTIONS':
@@ -116,42 +89,164 @@ def insert_medical_record(request: flask.Request) -> flask.typing.ResponseReturn
         if not non_null_non_empty(json_data, "groups"): 
             return APIResponse.error_with_code_message(message="groups are not present cannot save")
         
+        params = {
+            "id": json_data["id"],
+            "opd_type": json_data["opd_type"],
+            "opd_date": parsed_opd_date,
+            "updated_at": parsed_updated_at,
+            "user_id": user_id,
+        }
+        params.update(group_params(json_data["groups"]))
+
+        # One statement writes the record and its group counts
         if json_data["id"] is None:
-            date_exists = session.query(RecordGroup).filter(
-                Record.opd_date >= parsed_opd_date,
-                Record.opd_date < parsed_opd_date + timedelta(days=1),  # Next day
-                Record.firebase_user_id == user_id
-            ).count() > 0
-            print(date_exists)
-            if (date_exists):
+            with phase('query'):
+                saved = session.execute(text(INSERT_RECORD_SQL), params).first()
+            if saved is None:
                 return APIResponse.error_with_data_code_message(object='', message="Error Duplicate Data")
+        else:
+            try:
+                with phase('query'):
+                    saved = session.execute(text(UPDATE_RECORD_SQL), params).first()
+            except IntegrityError:
+                # Moved onto a day that already has a record
+                session.rollback()
+                return APIResponse.error_with_data_code_message(object='', message="Error Duplicate Data")
+            if saved is None:
+                return APIResponse.error_with_code_message(message="record not found")
 
-        record_saved = Record(
-            id=json_data.get("id"),
-            opd_type=json_data["opd_type"],
-            opd_date=parsed_opd_date,
-            updated_at=parsed_updated_at,
-            firebase_user_id=user_id
-        )
-
-        record_saved = session.merge(record_saved)
-        session.query(RecordGroup).filter(RecordGroup.record_id == record_saved.id).delete()
-        new_group_data = []
-        for index, group in enumerate(json_data.get("groups")):
-            name = ""
-            if index == 0:
-                name = "0-15 years"
-            elif index == 1:
-                name = "15-60 years"
-            else:
-                name = "60+ years"
-            g = RecordGroup(name=name, new_male=group.get("new_male", 0), new_female=group.get("new_female", 0), old_male=group.get("old_male", 0), old_female=group.get("old_female", 0), record_id=record_saved.id)
-            new_group_data.append(g)
-        session.add_all(new_group_data)
-        session.commit()
+        with phase('rollups'):
+            refresh_rollups(session, user_id, [parsed_opd_date, saved.previous_opd_date])
+        with phase('commit'):
+            session.commit()
 
         return APIResponse.ok_with_data("data saved successfully")
     finally:
         session.close()
 
 
+@timed_request
+def insert_medical_records_batch(request: flask.Request) -> flask.typing.ResponseReturnValue:
+    # Saves many OPD days ({"records": [<insert_medical_record body>, ...]}) in one transaction.
+    # Every item is validated first; invalid ones are reported and skipped, the rest are
+    # written with multi-row statements and each item gets its own result.
+    if request.method == 'OPTIONS':
+        headers = {
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Methods":"*",
+            "Access-Control-Allow-Headers":"*",
+            "Access-Control-Allow-Credentials":"true",
+            "Access-Control-Max-Age":"3600"
+        }
+
+        return ('', 200, headers)
+
+    user_id = auth_user_by_token(request=request)
+    if user_id is None:
+        return APIResponse.error_with_code_message(message="Unauthorized")
+
+    json_data = request.get_json()
+    if not non_null_non_empty(json_data, "records"):
+        return APIResponse.error_with_code_message(message="records are not present cannot save")
+    if not isinstance(json_data["records"], list):
+        return APIResponse.error_with_code_message(message="records must be a list")
+    if len(json_data["records"]) > INSERT_BATCH_MAX_RECORDS:
+        return APIResponse.error_with_code_message(message=f"at most {INSERT_BATCH_MAX_RECORDS} records can be saved at once")
+
+    results = []
+    valid = []
+    seen_dates = set()
+    for index, item in enumerate(json_data["records"]):
+        if not isinstance(item, dict):
+            results.append({"index": index, "id": None, "error": 1, "message": "invalid record: not an object"})
+            continue
+        result = {"index": index, "id": item.get("id"), "error": 0, "message": "saved"}
+        results.append(result)
+        try:
+            parsed_opd_date = datetime.strptime(item["opd_date"], "%a, %d %b %Y %H:%M:%S %Z").date()
+            parsed_updated_at = datetime.strptime(item["updated_at"], "%a, %d %b %Y %H:%M:%S %Z").date()
+            opd_type = item["opd_type"]
+        except (KeyError, TypeError, ValueError) as e:
+            result.update(error=1, message=f"invalid record: {e}")
+            continue
+        if not non_null_non_empty(item, "groups"):
+            result.update(error=1, message="groups are not present cannot save")
+            continue
+        if not isinstance(item["groups"], list) or not all(isinstance(group, dict) for group in item["groups"]):
+            result.update(error=1, message="invalid record: groups must be a list of objects")
+            continue
+        if parsed_opd_date in seen_dates:
+            result.update(error=1, message="Error Duplicate Data")
+            continue
+        seen_dates.add(parsed_opd_date)
+        valid.append((result, item, parsed_opd_date, parsed_updated_at, opd_type))
+
+    session = Session()
+    try:
+        # One query for all duplicate and ownership checks
+        with phase('query'):
+            existing = session.query(Record.id, Record.opd_date).filter(
+                Record.firebase_user_id == user_id,
+                (Record.opd_date.in_([v[2] for v in valid])) | (Record.id.in_([v[1]["id"] for v in valid if v[1].get("id") is not None]))
+            ).all()
+        owned_dates = {record_id: opd_date for record_id, opd_date in existing}
+        taken_dates = {opd_date: record_id for record_id, opd_date in existing}
+
+        new_rows = []
+        updated_rows = []
+        for result, item, parsed_opd_date, parsed_updated_at, opd_type in valid:
+            row = {"opd_type": opd_type, "opd_date": parsed_opd_date, "updated_at": parsed_updated_at, "firebase_user_id": user_id}
+            row.update(group_params(item["groups"]))
+            record_id = item.get("id")
+            if record_id is None:
+                if parsed_opd_date in taken_dates:
+                    result.update(error=1, message="Error Duplicate Data")
+                    continue
+                new_rows.append((result, item, row))
+            else:
+                if record_id not in owned_dates:
+                    result.update(error=1, message="record not found")
+                    continue
+                if taken_dates.get(parsed_opd_date, record_id) != record_id:
+                    result.update(error=1, message="Error Duplicate Data")
+                    continue
+                row["id"] = record_id
+                updated_rows.append((result, item, row))
+
+        if len(updated_rows) > 0:
+            with phase('query'):
+                session.execute(update(Record), [row for _, _, row in updated_rows])
+        if len(new_rows) > 0:
+            # insertmanyvalues turns this into multi-row INSERT ... RETURNING; days another
+            # request saved in the meantime hit the unique constraint and are not returned
+            with phase('query'):
+                inserted = session.execute(
+                    insert(Record).on_conflict_do_nothing(index_elements=["firebase_user_id", "opd_date"]).returning(Record.id, Record.opd_date),
+                    [row for _, _, row in new_rows]
+                ).all()
+            inserted_ids = {opd_date: record_id for record_id, opd_date in inserted}
+            for result, _, row in new_rows:
+                if row["opd_date"] not in inserted_ids:
+                    result.update(error=1, message="Error Duplicate Data")
+                    continue
+                row["id"] = inserted_ids[row["opd_date"]]
+                result["id"] = row["id"]
+            new_rows = [new_row for new_row in new_rows if "id" in new_row[2]]
+
+        saved = updated_rows + new_rows
+        if len(saved) > 0:
+            # Days records were moved away from need their rollups refreshed as well
+            touched_days = [row["opd_date"] for _, _, row in saved] + [owned_dates[row["id"]] for _, _, row in updated_rows]
+            with phase('rollups'):
+                refresh_rollups(session, user_id, touched_days)
+        with phase('commit'):
+            session.commit()
+    except Exception as e:
+        session.rollback()
+        print(f"Error: {str(e)}")
+        return APIResponse.error_with_code_message(message="something went wrong ::: " + str(e))
+    finally:
+        session.close()
+
+    saved_count = len([result for result in results if result["error"] == 0])
+    return APIResponse.ok_with_data({"results": results}, message=f"{saved_count} of {len(results)} records saved")
@@ -0,0 +1,152 @@
+"""Per-user daily and monthly OPD count rollups.
+
+opd_daily_rollups holds one row per (firebase_user_id, opd_date) and
+opd_monthly_rollups one row per (firebase_user_id, opd_month) with the 12
+counts of the three age groups (age group x new/old x male/female) already
+summed. insert_medical_record refreshes the affected day and month in the
+same transaction as the record write, so readers never aggregate records
+themselves. The columns are named like the inline counts of mo_records
+(see medical_core/record_counts.py), so a day is a plain copy of its record.
+
+The tables are created by migrations/0002_rollup_tables.py. Run this file as
+a script to rebuild or verify them from mo_records:
+
+    python rollups.py rebuild [--user UID]
+    python rollups.py verify [--user UID]
+"""
+import argparse
+import os
+import sys
+
+from sqlalchemy import create_engine, text
+
+from medical_core.record_counts import COUNT_COLUMNS
+
+ROLLUP_COLUMNS = COUNT_COLUMNS
+
+_column_list = ", ".join(ROLLUP_COLUMNS)
+_record_list = ", ".join(f"r.{column}" for column in ROLLUP_COLUMNS)
+_sum_list = ", ".join(f"SUM({column})" for column in ROLLUP_COLUMNS)
+
+# Copy the counts of the records of one user on the given days (one per day) into daily rows
+_REFRESH_DAYS_SQL = f"""
+DELETE FROM opd_daily_rollups
+WHERE firebase_user_id = :user_id AND opd_date = ANY(:days);
+INSERT INTO opd_daily_rollups (firebase_user_id, opd_date, {_column_list})
+SELECT r.firebase_user_id, r.opd_date, {_record_list}
+FROM mo_records r
+WHERE r.firebase_user_id = :user_id AND r.opd_date = ANY(:days);
+"""
+
+# Months are re-summed from the (at most 31) daily rows rather than raw records
+_REFRESH_MONTHS_SQL = f"""
+DELETE FROM opd_monthly_rollups
+WHERE firebase_user_id = :user_id AND opd_month = ANY(:months);
+INSERT INTO opd_monthly_rollups (firebase_user_id, opd_month, {_column_list})
+SELECT firebase_user_id, date_trunc('month', opd_date)::date, {_sum_list}
+FROM opd_daily_rollups
+WHERE firebase_user_id = :user_id AND date_trunc('month', opd_date)::date = ANY(:months)
+GROUP BY firebase_user_id, date_trunc('month', opd_date)::date;
+"""
+
+_REBUILD_SQL = f"""
+DELETE FROM opd_daily_rollups WHERE :user_id IS NULL OR firebase_user_id = :user_id;
+DELETE FROM opd_monthly_rollups WHERE :user_id IS NULL OR firebase_user_id = :user_id;
+INSERT INTO opd_daily_rollups (firebase_user_id, opd_date, {_column_list})
+SELECT r.firebase_user_id, r.opd_date, {_record_list}
+FROM mo_records r
+WHERE :user_id IS NULL OR r.firebase_user_id = :user_id;
+INSERT INTO opd_monthly_rollups (firebase_user_id, opd_month, {_column_list})
+SELECT firebase_user_id, date_trunc('month', opd_date)::date, {_sum_list}
+FROM opd_daily_rollups
+WHERE :user_id IS NULL OR firebase_user_id = :user_id
+GROUP BY firebase_user_id, date_trunc('month', opd_date)::date;
+"""
+
+# Daily rows that differ from their records, and monthly rows that differ
+# from the sum of those records
+_VERIFY_SQL = f"""
+WITH expected_daily AS (
+    SELECT r.firebase_user_id, r.opd_date, {_record_list}
+    FROM mo_records r
+    WHERE :user_id IS NULL OR r.firebase_user_id = :user_id
+),
+expected_monthly AS (
+    SELECT firebase_user_id, date_trunc('month', opd_date)::date AS opd_month, {_sum_list}
+    FROM expected_daily
+    GROUP BY firebase_user_id, date_trunc('month', opd_date)::date
+),
+actual_daily AS (
+    SELECT firebase_user_id, opd_date, {_column_list}
+    FROM opd_daily_rollups
+    WHERE :user_id IS NULL OR firebase_user_id = :user_id
+),
+actual_monthly AS (
+    SELECT firebase_user_id, opd_month, {_column_list}
+    FROM opd_monthly_rollups
+    WHERE :user_id IS NULL OR firebase_user_id = :user_id
+)
+SELECT 'daily' AS rollup, firebase_user_id, opd_date AS period FROM (
+    (SELECT * FROM expected_daily EXCEPT SELECT * FROM actual_daily)
+    UNION
+    (SELECT * FROM actual_daily EXCEPT SELECT * FROM expected_daily)
+) daily_drift
+UNION ALL
+SELECT 'monthly' AS rollup, firebase_user_id, opd_month AS period FROM (
+    (SELECT * FROM expected_monthly EXCEPT SELECT * FROM actual_monthly)
+    UNION
+    (SELECT * FROM actual_monthly EXCEPT SELECT * FROM expected_monthly)
+) monthly_drift
+ORDER BY 1, 2, 3
+"""
+
+
+def refresh_rollups(session, user_id, days):
+    """Recompute the rollup rows of user_id for the given days and their months.
+
+    Must run inside the transaction that changed the records, after a flush.
+    """
+    days = sorted({day for day in days if day is not None})
+    if len(days) == 0:
+        return
+    months = sorted({day.replace(day=1) for day in days})
+    # Serialise refreshes per user until commit, so two transactions touching the same
+    # month never both re-insert its row or sum each other's uncommitted days
+    session.execute(text("SELECT pg_advisory_xact_lock(hashtext(:user_id))"), {'user_id': user_id})
+    session.execute(text(_REFRESH_DAYS_SQL), {'user_id': user_id, 'days': days})
+    session.execute(text(_REFRESH_MONTHS_SQL), {'user_id': user_id, 'months': months})
+
+
+def rebuild_rollups(connection, user_id=None):
+    connection.execute(text(_REBUILD_SQL), {'user_id': user_id})
+
+
+def verify_rollups(connection, user_id=None):
+    """Return (rollup, firebase_user_id, period) for every row that has drifted."""
+    return connection.execute(text(_VERIFY_SQL), {'user_id': user_id}).fetchall()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['rebuild', 'verify'])
+    parser.add_argument('--user', default=None, help='only this firebase_user_id')
+    args = parser.parse_args(argv)
+
+    db_url = f"postgresql://{os.environ.get('DB_USER')}:{os.environ.get('DB_PASSWORD')}@{os.environ.get('DB_HOST')}:{os.environ.get('DB_PORT')}/{os.environ.get('DB_NAME')}"
+    engine = create_engine(db_url)
+
+    with engine.begin() as connection:
+        if args.command == 'rebuild':
+            rebuild_rollups(connection, args.user)
+            print("rollups rebuilt")
+        else:
+            drift = verify_rollups(connection, args.user)
+            for rollup, firebase_user_id, period in drift:
+                print(f"DRIFT {rollup} {firebase_user_id} {period}")
+            print(f"{len(drift)} drifted rollup rows")
+            return 1 if len(drift) > 0 else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,7 @@
+"""Code shared by the four Cloud Functions.
+
+Each function directory links to this package (``<function>/medical_core``),
+so it is uploaded with every deploy. Importing it is cheap: firebase_admin,
+the SQLAlchemy engine and the psycopg2 pool are only created the first time
+a request needs them.
+"""
@@ -0,0 +1,141 @@
+import flask
+
+from medical_core.serialization import compress, compress_stream, encode_json
+from medical_core.timing import phase
+
+headers = {
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Methods":"*",
+		    "Access-Control-Allow-Headers":"*",
+		    "Access-Control-Allow-Credentials":"true",
+		    "Access-Control-Max-Age":"3600"
+        }
+
+# Added to every serialized API response
+response_headers = [
+    ('Access-Control-Allow-Origin', '*'),
+    ('Access-Control-Allow-Methods', '*'),
+    ('Access-Control-Allow-Headers', "Origin, X-Requested-With, Content-Type, Accept"),
+    ("Access-Control-Max-Age", "3600"),
+    ('X-Content-Type-Options', 'nosniff'),
+]
+
+class APIResponse:
+    def __init__(self):
+        self.response = {'error': 0, 'message': 'Success'}
+        self.content = None
+
+    def payload(self):
+        # The response body as a plain dict, before JSON encoding
+        api_content = {}
+        if self.content is not None:
+            api_content['content'] = self.content
+        api_response = {
+            'response': self.response
+        }
+        api_content.update(api_response)
+        return api_content
+
+    def serialize(self):
+        api_content = self.payload()
+        with phase('serialize'):
+            body = encode_json(api_content)
+        encoding = None
+        if flask.has_request_context():
+            with phase('compress'):
+                body, encoding = compress(body, flask.request.headers.get('Accept-Encoding'))
+        resp = flask.Response(body, mimetype='application/json')
+        if encoding is not None:
+            resp.headers['Content-Encoding'] = encoding
+        resp.headers.add('Vary', 'Accept-Encoding')
+        for name, value in response_headers:
+            resp.headers.add(name, value)
+        return resp
+
+    def stream(self, key, chunks):
+        # Sends {"content": {key: [...]}, "response": ...} one chunk of rows at a time,
+        # so a page never has to be held in memory as a whole. The joined body is the
+        # same as serialize() would produce for content={key: all rows}.
+        def pieces():
+            yield b'{"content":{' + encode_json(key).rstrip(b'\n') + b':['
+            first = True
+            try:
+                for rows in chunks:
+                    if len(rows) == 0:
+                        continue
+                    # Encode the chunk as one list and drop its brackets
+                    encoded = encode_json(rows).rstrip(b'\n')[1:-1]
+                    yield encoded if first else b',' + encoded
+                    first = False
+            except Exception as e:
+                # The status line has already gone out, so the failure is reported in
+                # the response object, which comes after the rows
+                print(f"Error: {str(e)}")
+                self.response['message'] = "something went wrong ::: " + str(e)
+                self.response['error'] = 1
+            finally:
+                close = getattr(chunks, 'close', None)
+                if close is not None:
+                    close()
+            yield b']},"response":' + encode_json(self.response).rstrip(b'\n') + b'}\n'
+
+        body, encoding = pieces(), None
+        if flask.has_request_context():
+            body, encoding = compress_stream(body, flask.request.headers.get('Accept-Encoding'))
+        resp = flask.Response(body, mimetype='application/json')
+        if encoding is not None:
+            resp.headers['Content-Encoding'] = encoding
+        resp.headers.add('Vary', 'Accept-Encoding')
+        for name, value in response_headers:
+            resp.headers.add(name, value)
+        return resp
+
+
+    @classmethod
+    def ok(cls):
+        # when sending only ok response with empty body
+        return cls().serialize()
+    
+    @classmethod
+    def ok_with_data(cls, object, message="Success"):
+        obj = cls()
+        obj.content = object
+        obj.response['message'] = message
+        return obj.serialize()
+
+    @classmethod
+    def ok_with_stream(cls, key, chunks, message="Success"):
+        # chunks yields lists of rows; see stream()
+        obj = cls()
+        obj.response['message'] = message
+        return obj.stream(key, chunks)
+
+    @classmethod
+    def error_with_message(cls, message="Something went wrong"):
+        obj = cls()
+        obj.response['message'] = message
+        obj.response['error'] = 1
+        return obj.serialize()
+
+    @classmethod
+    def error_with_code_message(cls, code=1, message="Something went wrong"):
+        obj = cls()
+        obj.response['message'] = message
+        obj.response['error'] = code
+        return obj.serialize()
+
+    @classmethod
+    def error_with_data_message(cls, object=None, message="Something went wrong"):
+        obj = cls()
+        obj.content = object
+        obj.response['message'] = message
+        obj.response['error'] = 1
+        return obj.serialize()
+
+    @classmethod
+    def error_with_data_code_message(cls, object=None, code=1, message="Something went wrong"):
+        obj = cls()
+        obj.content = object
+        obj.response['message'] = message
+        obj.response['error'] = code
+        return obj.serialize()
@@ -0,0 +1,93 @@
+"""Serve async handlers as ASGI apps (uvicorn, Cloud Run) with the Cloud Function contract.
+
+An async handler is ``async def handler(data, headers) -> (status, body)``.
+data is the parsed JSON body, or {} when there is none. headers is a dict
+with lower-cased names. body is an APIResponse payload dict, which is sent
+as JSON, or a str for plain-text errors. OPTIONS preflights get the same
+CORS headers as the sync handlers. JSON bodies get the headers, bytes and
+compression that APIResponse.serialize produces.
+"""
+import json
+
+from medical_core.api_response import APIResponse, headers as preflight_headers, response_headers
+from medical_core.async_db import close_async_pool
+from medical_core.serialization import compress, encode_json
+
+
+def api_ok(content, message="Success"):
+    obj = APIResponse()
+    obj.content = content
+    obj.response['message'] = message
+    return 200, obj.payload()
+
+
+def api_error(message="Something went wrong", code=1):
+    obj = APIResponse()
+    obj.response['message'] = message
+    obj.response['error'] = code
+    return 200, obj.payload()
+
+
+def _encode_headers(pairs):
+    return [(name.lower().encode('latin-1'), str(value).encode('latin-1')) for name, value in pairs]
+
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body', False):
+            return b''.join(chunks)
+
+
+async def _send(send, status, header_pairs, body):
+    await send({'type': 'http.response.start', 'status': status, 'headers': _encode_headers(header_pairs)})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await close_async_pool()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+def asgi_app(handler):
+    """Wrap an async handler in an ASGI application."""
+
+    async def app(scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await _lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        if scope['method'] == 'OPTIONS':
+            await _send(send, 200, list(preflight_headers.items()) + [('Content-Length', '0')], b'')
+            return
+
+        raw_body = await _read_body(receive)
+        request_headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+        try:
+            data = json.loads(raw_body) if raw_body else {}
+        except ValueError:
+            await _send(send, 400, [('Content-Type', 'text/plain; charset=utf-8')], b'invalid JSON body')
+            return
+
+        status, body = await handler(data or {}, request_headers)
+        if isinstance(body, str):
+            payload = body.encode()
+            header_pairs = [('Content-Type', 'text/html; charset=utf-8')]
+        else:
+            payload, encoding = compress(encode_json(body), request_headers.get('accept-encoding'))
+            header_pairs = [('Content-Type', 'application/json'), ('Vary', 'Accept-Encoding')] + response_headers
+            if encoding is not None:
+                header_pairs.append(('Content-Encoding', encoding))
+        header_pairs.append(('Content-Length', str(len(payload))))
+        await _send(send, status, header_pairs, payload)
+
+    return app
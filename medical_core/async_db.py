@@ -0,0 +1,99 @@
+"""asyncpg pool for the async read endpoints.
+
+The pool is created by the first request on the running event loop, so
+importing this module costs nothing. Queries are the psycopg2 ones from each
+function's main.py, with %(name)s placeholders rewritten to $n by
+positional().
+"""
+import asyncio
+import json
+import os
+import re
+
+from medical_core.db import db_params
+from medical_core.query_log import record
+
+ASYNC_DB_POOL_MIN_SIZE = int(os.environ.get('ASYNC_DB_POOL_MIN_SIZE', 1))
+ASYNC_DB_POOL_MAX_SIZE = int(os.environ.get('ASYNC_DB_POOL_MAX_SIZE', 10))
+
+_PLACEHOLDER = re.compile(r'%\((\w+)\)s')
+
+_pool = None
+_pool_lock = asyncio.Lock()
+
+
+def positional(query):
+    """Rewrite a %(name)s query for asyncpg, returning (query, [name of $1, $2, ...])."""
+    names = []
+
+    def placeholder(match):
+        if match.group(1) not in names:
+            names.append(match.group(1))
+        return f"${names.index(match.group(1)) + 1}"
+
+    return _PLACEHOLDER.sub(placeholder, query), names
+
+
+def _log_query(logged_query):
+    record(logged_query.query, logged_query.args, logged_query.elapsed, failed=logged_query.exception is not None)
+
+
+async def _init_connection(connection):
+    # Decode json/json_agg columns to Python objects, as psycopg2 does
+    await connection.set_type_codec('json', encoder=json.dumps, decoder=json.loads, schema='pg_catalog')
+    if hasattr(connection, 'add_query_logger'):
+        connection.add_query_logger(_log_query)
+
+
+async def get_async_pool():
+    """Return the asyncpg pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        async with _pool_lock:
+            if _pool is None:
+                import asyncpg
+
+                _pool = await asyncpg.create_pool(
+                    host=db_params['host'], port=int(db_params['port'] or 5432), user=db_params['user'],
+                    password=db_params['password'], database=db_params['database'],
+                    min_size=ASYNC_DB_POOL_MIN_SIZE, max_size=ASYNC_DB_POOL_MAX_SIZE,
+                    init=_init_connection,
+                )
+    return _pool
+
+
+async def close_async_pool():
+    global _pool
+    if _pool is not None:
+        pool, _pool = _pool, None
+        await pool.close()
+
+
+async def fetch_for_user(auth_task, query, names, params, one=False):
+    """Run query for the user auth_task resolves to, returning (user_id, rows or row).
+
+    auth_task comes from start_auth_user_by_token. While Firebase is still
+    verifying the token, the connection is checked out and the statement is
+    parsed and planned in the meantime. Nothing is executed until the uid is
+    known, so an unauthorized request never reads data and gets (None, None).
+    """
+    if auth_task.done() and auth_task.result() is None:
+        return None, None
+    pool = await get_async_pool()
+    try:
+        async with pool.acquire() as connection:
+            statement = None
+            if not auth_task.done():
+                # Firebase is still verifying the token: parse and plan the query meanwhile
+                statement = await connection.prepare(query)
+            user_id = await auth_task
+            if user_id is None:
+                return None, None
+            args = [user_id if name == 'user_id' else params[name] for name in names]
+            if statement is not None:
+                return user_id, await (statement.fetchrow(*args) if one else statement.fetch(*args))
+            # Cached token: asyncpg's per-connection statement cache covers the prepare
+            return user_id, await (connection.fetchrow(query, *args) if one else connection.fetch(query, *args))
+    finally:
+        if not auth_task.done():
+            auth_task.cancel()
@@ -0,0 +1,160 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import flask
+
+from medical_core.timing import phase
+
+# verify_id_token checks the JWT signature locally against Google's public
+# certs (fetched once and cached according to their Cache-Control headers),
+# so the only network round trip left per request is auth.get_user.
+AUTH_CACHE_MAX_SIZE = int(os.environ.get('AUTH_CACHE_MAX_SIZE', 1024))
+AUTH_CACHE_TTL_SECONDS = int(os.environ.get('AUTH_CACHE_TTL_SECONDS', 300))
+# When set, trust the verified token's uid and skip the auth.get_user lookup
+AUTH_SKIP_GET_USER = os.environ.get('AUTH_SKIP_GET_USER', '').lower() in ('1', 'true', 'yes')
+
+
+class TokenCache:
+    """LRU cache of verified token -> uid, each entry expiring no later than the token's exp."""
+
+    def __init__(self, max_size=AUTH_CACHE_MAX_SIZE, ttl=AUTH_CACHE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, token):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                self.misses += 1
+                return None
+            uid, expires_at = entry
+            if expires_at <= now:
+                del self._entries[token]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return uid
+
+    def put(self, token, uid, token_exp):
+        expires_at = min(time.time() + self.ttl, token_exp)
+        with self._lock:
+            self._entries[token] = (uid, expires_at)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+            }
+
+
+token_cache = TokenCache()
+
+_firebase_auth = None
+_firebase_lock = threading.Lock()
+
+
+def firebase_auth():
+    """Return firebase_admin.auth, importing and initialising the SDK on first use."""
+    global _firebase_auth
+    if _firebase_auth is None:
+        with _firebase_lock:
+            if _firebase_auth is None:
+                import firebase_admin
+                from firebase_admin import credentials, auth
+
+                # Check if the service account key JSON is available as an environment variable
+                if 'FIREBASE_SERVICE_ACCOUNT' in os.environ:
+                    # Load the service account key from the environment variable
+                    service_account_info = json.loads(os.environ['FIREBASE_SERVICE_ACCOUNT'])
+                    cred = credentials.Certificate(service_account_info)
+                else:
+                    # If the environment variable is not set, initialize Firebase Admin SDK without credentials
+                    cred = None
+
+                firebase_admin.initialize_app(cred)
+                _firebase_auth = auth
+    return _firebase_auth
+
+
+def verify_user_token(user_token):
+    """Return the uid for a Firebase ID token, raising ValueError if it is invalid."""
+    if not user_token:
+        raise ValueError('missing user-token header')
+
+    uid = token_cache.get(user_token)
+    if uid is not None:
+        return uid
+    return _verify_with_firebase(user_token)
+
+
+def _verify_with_firebase(user_token):
+    auth = firebase_auth()
+    decoded_token = auth.verify_id_token(user_token)
+    uid = decoded_token['uid']
+    if not AUTH_SKIP_GET_USER:
+        uid = auth.get_user(uid).uid
+    token_cache.put(user_token, uid, decoded_token['exp'])
+    print(json.dumps({'severity': 'INFO', 'message': 'auth cache miss', 'auth_cache': token_cache.stats()}))
+    return uid
+
+
+def auth_cache_stats():
+    return token_cache.stats()
+
+
+def auth_user_by_token(request: flask.Request):
+    user_token = request.headers.get("user-token")
+    try:
+        # Verify the Firebase ID token (cached per token until it expires)
+        with phase('auth'):
+            return verify_user_token(user_token)
+    except Exception as e:
+        # Handle invalid tokens or other errors
+        print('Authentication failed:', e)
+        return None
+
+
+async def _auth_with_firebase_async(user_token):
+    try:
+        return await asyncio.to_thread(_verify_with_firebase, user_token)
+    except Exception as e:
+        print('Authentication failed:', e)
+        return None
+
+
+def start_auth_user_by_token(user_token):
+    """Start authenticating a user-token on the running event loop.
+
+    Returns an awaitable of the uid, or of None for an invalid token. A cached
+    token is resolved already; otherwise Firebase runs in a worker thread while
+    the caller gets on with other work.
+    """
+    loop = asyncio.get_running_loop()
+    uid = None
+    if not user_token:
+        print('Authentication failed:', 'missing user-token header')
+    else:
+        uid = token_cache.get(user_token)
+        if uid is None:
+            return loop.create_task(_auth_with_firebase_async(user_token))
+    resolved = loop.create_future()
+    resolved.set_result(uid)
+    return resolved
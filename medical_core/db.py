@@ -0,0 +1,56 @@
+import os
+import threading
+
+db_params = {
+    'host': os.environ.get('DB_HOST'),
+    'port': os.environ.get('DB_PORT'),
+    'user': os.environ.get('DB_USER'),
+    'password': os.environ.get('DB_PASSWORD'),
+    'database': os.environ.get('DB_NAME'),
+}
+
+# Construct the database URL
+db_url = f"postgresql://{db_params['user']}:{db_params['password']}@{db_params['host']}:{db_params['port']}/{db_params['database']}"
+
+_engine = None
+_session_factory = None
+_pool = None
+_lock = threading.Lock()
+
+
+def get_engine():
+    """Return the SQLAlchemy engine, creating it on first use."""
+    global _engine, _session_factory
+    if _engine is None:
+        with _lock:
+            if _engine is None:
+                from sqlalchemy import create_engine
+                from sqlalchemy.orm import sessionmaker
+
+                from medical_core.query_log import instrument_engine
+
+                # Create the database engine and a session factory; statements are
+                # timed and logged by query_log rather than echoed
+                engine = instrument_engine(create_engine(db_url))
+                _session_factory = sessionmaker(bind=engine)
+                _engine = engine
+    return _engine
+
+
+def Session():
+    """Open a new ORM session; a drop-in for the sessionmaker() the functions used to build."""
+    get_engine()
+    return _session_factory()
+
+
+def get_pool():
+    """Return the psycopg2 connection pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _lock:
+            if _pool is None:
+                from medical_core.db_pool import ConnectionPool
+
+                # Connections are opened on demand and reused for the life of the instance
+                _pool = ConnectionPool(db_params)
+    return _pool
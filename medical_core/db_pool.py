@@ -0,0 +1,206 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.pool import PoolError
+
+from medical_core.query_log import record
+from medical_core.timing import phase
+
+DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', 1))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 5))
+# Idle connections older than this are closed (down to DB_POOL_MIN_SIZE)
+DB_POOL_MAX_IDLE_SECONDS = float(os.environ.get('DB_POOL_MAX_IDLE_SECONDS', 300))
+# Connections idle for longer than this are pinged before being handed out
+DB_POOL_HEALTH_CHECK_SECONDS = float(os.environ.get('DB_POOL_HEALTH_CHECK_SECONDS', 30))
+# How long a request waits for a free connection before giving up
+DB_POOL_TIMEOUT_SECONDS = float(os.environ.get('DB_POOL_TIMEOUT_SECONDS', 10))
+# At most this often, a checkin logs the pool's checkout and wait counters as one JSON line (0 turns it off)
+DB_POOL_STATS_INTERVAL_SECONDS = float(os.environ.get('DB_POOL_STATS_INTERVAL_SECONDS', 60))
+
+
+class _TimedCursorMixin:
+    def execute(self, query, vars=None):
+        statement = query
+        if isinstance(statement, bytes):
+            statement = statement.decode()
+        elif not isinstance(statement, str):
+            # sql.SQL keeps its text in .string; Composed has to be rendered
+            statement = getattr(query, 'string', None) or query.as_string(self.connection)
+        started = time.perf_counter()
+        try:
+            result = super().execute(query, vars)
+        except Exception:
+            record(statement, vars, time.perf_counter() - started, failed=True)
+            raise
+        record(statement, vars, time.perf_counter() - started)
+        return result
+
+
+_timed_cursor_classes = {}
+
+
+class TimedConnection(extensions.connection):
+    """psycopg2 connection whose cursors report every execute() to query_log."""
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get('cursor_factory') or self.cursor_factory or extensions.cursor
+        timed = _timed_cursor_classes.get(factory)
+        if timed is None:
+            timed = _timed_cursor_classes[factory] = type('Timed' + factory.__name__, (_TimedCursorMixin, factory), {})
+        kwargs['cursor_factory'] = timed
+        return super().cursor(*args, **kwargs)
+
+
+class ConnectionPool:
+    """Thread-safe psycopg2 connection pool that lives for the whole instance."""
+
+    def __init__(self, db_params, min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE,
+                 max_idle=DB_POOL_MAX_IDLE_SECONDS, health_check_after=DB_POOL_HEALTH_CHECK_SECONDS,
+                 timeout=DB_POOL_TIMEOUT_SECONDS, stats_interval=DB_POOL_STATS_INTERVAL_SECONDS):
+        self.db_params = db_params
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.health_check_after = health_check_after
+        self.timeout = timeout
+        self.stats_interval = stats_interval
+        self._stats_logged_at = time.monotonic()
+        # (connection, last_used) pairs, most recently returned last
+        self._idle = []
+        self._size = 0
+        self._cond = threading.Condition()
+        self.checkouts = 0
+        self.created = 0
+        self.discarded = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def _discard(self, conn):
+        self._size -= 1
+        self.discarded += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _recycle_idle(self, now):
+        # Oldest connections sit at the front of the list
+        while len(self._idle) > 0 and self._size > self.min_size:
+            conn, last_used = self._idle[0]
+            if now - last_used < self.max_idle:
+                break
+            self._idle.pop(0)
+            self._discard(conn)
+
+    def _healthy(self, conn, last_used, now):
+        if conn.closed:
+            return False
+        if now - last_used < self.health_check_after:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _reserve(self, started):
+        # An idle (connection, last_used) pair, or (None, None) with a slot reserved for a new one
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._recycle_idle(now)
+                if len(self._idle) > 0:
+                    return self._idle.pop()
+                if self._size < self.max_size:
+                    self._size += 1
+                    return None, None
+                remaining = self.timeout - (now - started)
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolError("timed out waiting for a database connection")
+                self._cond.wait(remaining)
+
+    def _checkout(self):
+        started = time.monotonic()
+        while True:
+            conn, last_used = self._reserve(started)
+            # Pinged outside the lock, so other checkouts and checkins never wait on the round trip
+            if conn is None or self._healthy(conn, last_used, time.monotonic()):
+                break
+            with self._cond:
+                self._discard(conn)
+                self._cond.notify()
+
+        waited = time.monotonic() - started
+        with self._cond:
+            self.checkouts += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+        if conn is None:
+            try:
+                conn = psycopg2.connect(connection_factory=TimedConnection, **self.db_params)
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self.created += 1
+        return conn
+
+    def _checkin(self, conn):
+        if not conn.closed and conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+        with self._cond:
+            if conn.closed or conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                self._discard(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+            log_stats = self.stats_interval > 0 and time.monotonic() - self._stats_logged_at >= self.stats_interval
+            if log_stats:
+                self._stats_logged_at = time.monotonic()
+        if log_stats:
+            self.log_stats()
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection, always returning it to the pool afterwards."""
+        with phase('db_connect'):
+            conn = self._checkout()
+        try:
+            yield conn
+        finally:
+            self._checkin(conn)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'checkouts': self.checkouts,
+                'created': self.created,
+                'discarded': self.discarded,
+                'timeouts': self.timeouts,
+                'wait_seconds_total': self.wait_seconds_total,
+                'wait_seconds_max': self.wait_seconds_max,
+                'wait_seconds_avg': self.wait_seconds_total / self.checkouts if self.checkouts else 0.0,
+            }
+
+    def log_stats(self):
+        print(json.dumps({'severity': 'INFO', 'message': 'db pool stats', 'pool': self.stats()}))
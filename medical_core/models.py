@@ -0,0 +1,42 @@
+from datetime import datetime
+
+from sqlalchemy import BigInteger, Column, DateTime, Integer, String, Date
+from sqlalchemy.orm import declarative_base
+
+Base = declarative_base()
+
+
+class Record(Base):
+    __tablename__ = 'mo_records'
+    id = Column(Integer, primary_key=True)
+    opd_type = Column(Integer, name="opd_type")
+    updated_at = Column(DateTime, default=datetime.utcnow, name="updated_at")
+    opd_date = Column(Date, name="opd_date")
+    firebase_user_id = Column(String, name="firebase_user_id")
+    # The counts of the three age groups, inline (see medical_core/record_counts.py)
+    up_to_15_new_male = Column(Integer, nullable=False, default=0, name="up_to_15_new_male")
+    up_to_15_new_female = Column(Integer, nullable=False, default=0, name="up_to_15_new_female")
+    up_to_15_old_male = Column(Integer, nullable=False, default=0, name="up_to_15_old_male")
+    up_to_15_old_female = Column(Integer, nullable=False, default=0, name="up_to_15_old_female")
+    up_to_60_new_male = Column(Integer, nullable=False, default=0, name="up_to_60_new_male")
+    up_to_60_new_female = Column(Integer, nullable=False, default=0, name="up_to_60_new_female")
+    up_to_60_old_male = Column(Integer, nullable=False, default=0, name="up_to_60_old_male")
+    up_to_60_old_female = Column(Integer, nullable=False, default=0, name="up_to_60_old_female")
+    after_60_new_male = Column(Integer, nullable=False, default=0, name="after_60_new_male")
+    after_60_new_female = Column(Integer, nullable=False, default=0, name="after_60_new_female")
+    after_60_old_male = Column(Integer, nullable=False, default=0, name="after_60_old_male")
+    after_60_old_female = Column(Integer, nullable=False, default=0, name="after_60_old_female")
+    # Id of the transaction that last wrote the record, set by a trigger (migrations/0006)
+    change_txid = Column(BigInteger, name="change_txid")
+
+
+class RecordGroup(Base):
+    # One row per age group, kept in sync with the Record counts by triggers since migration 0004
+    __tablename__ = 'record_groups'
+    id = Column(Integer, primary_key=True)
+    name = Column(String, name="name")
+    new_male = Column(Integer, name="new_male")
+    new_female = Column(Integer, name="new_female")
+    old_male = Column(Integer, name="old_male")
+    old_female = Column(Integer, name="old_female")
+    record_id = Column(Integer, name="record_id")
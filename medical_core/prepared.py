@@ -0,0 +1,121 @@
+"""Server-side prepared statements for queries run on the psycopg2 pool.
+
+A Statement wraps one handler query with %(name)s placeholders. The first
+time it runs on a pooled connection, it is PREPAREd there under its own
+name. From then on that connection only sends EXECUTE with the values, and
+Postgres skips parsing and analysis and can reuse a cached plan. Each
+connection keeps the set of statements it has prepared, so a connection the
+pool has just opened, or opened again after recycling one, prepares them
+afresh. The server can also lose a statement while the connection still
+lists it, for example when the session was reset, or when a migration
+changed a table the cached plan reads. The statement is then prepared again
+and run once more, as long as it was the first statement of its
+transaction.
+
+Set DB_PREPARED_STATEMENTS=0 to send the plain queries instead.
+prepared_statement_stats() reports executions, hits and re-prepares per
+statement.
+"""
+import os
+import threading
+
+import psycopg2
+from psycopg2 import extensions
+
+from medical_core.async_db import positional
+
+DB_PREPARED_STATEMENTS = os.environ.get('DB_PREPARED_STATEMENTS', '1').lower() not in ('0', 'false', 'no')
+
+# invalid_sql_statement_name: the session no longer has the statement;
+# feature_not_supported: "cached plan must not change result type" after a schema change
+_MISSING_STATEMENT = '26000'
+_STALE_STATEMENT = '0A000'
+
+_statements = {}
+_lock = threading.Lock()
+
+
+def _prepared_on(connection):
+    # Names of the statements prepared in this connection's session
+    names = getattr(connection, 'prepared_statements', None)
+    if names is None:
+        names = connection.prepared_statements = set()
+    return names
+
+
+class Statement:
+    """One query, prepared once per pooled connection and executed by name."""
+
+    def __init__(self, name, query):
+        self.name = name
+        self.query = query
+        text, self.param_names = positional(getattr(query, 'string', query))
+        self.prepare_sql = f"PREPARE {name} AS {text}"
+        self.execute_sql = f"EXECUTE {name}"
+        if len(self.param_names) > 0:
+            self.execute_sql += " (" + ", ".join(["%s"] * len(self.param_names)) + ")"
+        self.executions = 0
+        self.hits = 0
+        self.reprepares = 0
+        with _lock:
+            # A module loaded twice defines the same statement again; two queries cannot share a name
+            if name in _statements and _statements[name].prepare_sql != self.prepare_sql:
+                raise ValueError(f"a different statement named {name} already exists")
+            _statements[name] = self
+
+    def _count(self, hit, reprepared=False):
+        with _lock:
+            self.executions += 1
+            self.hits += 1 if hit else 0
+            self.reprepares += 1 if reprepared else 0
+
+    def execute(self, cursor, params=None):
+        """Run the statement with params on cursor, preparing it on the cursor's connection first if needed."""
+        if not DB_PREPARED_STATEMENTS:
+            cursor.execute(self.query, params)
+            return
+        connection = cursor.connection
+        prepared = _prepared_on(connection)
+        values = [params[name] for name in self.param_names]
+        first_in_transaction = connection.get_transaction_status() == extensions.TRANSACTION_STATUS_IDLE
+        hit = self.name in prepared
+        if not hit:
+            cursor.execute(self.prepare_sql)
+            prepared.add(self.name)
+        try:
+            cursor.execute(self.execute_sql, values)
+        except psycopg2.Error as e:
+            if not hit or not first_in_transaction or e.pgcode not in (_MISSING_STATEMENT, _STALE_STATEMENT):
+                raise
+            # Nothing else ran in the failed transaction, so it can be rolled back and retried
+            connection.rollback()
+            prepared.discard(self.name)
+            if e.pgcode == _STALE_STATEMENT:
+                cursor.execute(f"DEALLOCATE {self.name}")
+            cursor.execute(self.prepare_sql)
+            prepared.add(self.name)
+            cursor.execute(self.execute_sql, values)
+            self._count(hit=False, reprepared=True)
+            return
+        self._count(hit)
+
+
+def prepared_statement_stats():
+    """Return {name: executions, hits, prepares, reprepares and hit_rate} for every statement."""
+    with _lock:
+        return {
+            name: {
+                'executions': statement.executions,
+                'hits': statement.hits,
+                'prepares': statement.executions - statement.hits,
+                'reprepares': statement.reprepares,
+                'hit_rate': round(statement.hits / statement.executions, 4) if statement.executions else 0.0,
+            }
+            for name, statement in _statements.items()
+        }
+
+
+def reset_prepared_statement_stats():
+    with _lock:
+        for statement in _statements.values():
+            statement.executions = statement.hits = statement.reprepares = 0
@@ -0,0 +1,161 @@
+"""Query observability for the SQLAlchemy engine and the psycopg2 pool.
+
+Every statement is timed into a per-statement latency histogram. A statement
+is logged when it is slower than QUERY_LOG_SLOW_MS. Faster statements are
+logged for a random QUERY_LOG_SAMPLE_PERCENT of executions. Log lines are
+structured JSON on stdout, and parameters are redacted to their names and
+types, so patient counts and user ids never reach the logs.
+
+The histograms can be read with query_stats(). dump_query_stats() prints
+them as one log line, and so does SIGUSR1 when the process allows it.
+"""
+import functools
+import json
+import os
+import random
+import signal
+import threading
+import time
+
+QUERY_LOG_SLOW_MS = float(os.environ.get('QUERY_LOG_SLOW_MS', 200))
+QUERY_LOG_SAMPLE_PERCENT = float(os.environ.get('QUERY_LOG_SAMPLE_PERCENT', 0))
+# Upper bounds of the histogram buckets in milliseconds; the last bucket is unbounded
+HISTOGRAM_BOUNDS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+MAX_LOGGED_STATEMENT = 2000
+
+_histograms = {}
+_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=512)
+def normalize(statement):
+    # Collapse whitespace so the same query formatted differently shares one histogram
+    return " ".join(statement.split())
+
+
+def redact(parameters, executemany=False):
+    """Replace parameter values with their type names."""
+    if parameters is None:
+        return None
+    if executemany:
+        return f"<{len(parameters)} rows>"
+    if isinstance(parameters, dict):
+        return {name: _type_name(value) for name, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [_type_name(value) for value in parameters]
+    return _type_name(parameters)
+
+
+def _type_name(value):
+    if isinstance(value, (list, tuple)):
+        return f"{type(value).__name__}[{len(value)}]"
+    return type(value).__name__
+
+
+class _Histogram:
+    __slots__ = ('count', 'errors', 'total', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+
+    def add(self, duration_ms, failed):
+        self.count += 1
+        self.errors += 1 if failed else 0
+        self.total += duration_ms
+        self.max = max(self.max, duration_ms)
+        for index, bound in enumerate(HISTOGRAM_BOUNDS_MS):
+            if duration_ms <= bound:
+                self.buckets[index] += 1
+                return
+        self.buckets[-1] += 1
+
+
+def record(statement, parameters, seconds, executemany=False, failed=False):
+    """Add one execution to its statement's histogram and log it if slow or sampled."""
+    statement = normalize(statement)
+    duration_ms = seconds * 1000
+    with _lock:
+        histogram = _histograms.get(statement)
+        if histogram is None:
+            histogram = _histograms[statement] = _Histogram()
+        histogram.add(duration_ms, failed)
+
+    slow = duration_ms >= QUERY_LOG_SLOW_MS
+    if not slow and (QUERY_LOG_SAMPLE_PERCENT <= 0 or random.random() * 100 >= QUERY_LOG_SAMPLE_PERCENT):
+        return
+    print(json.dumps({
+        'severity': 'WARNING' if slow or failed else 'INFO',
+        'message': 'slow query' if slow else 'sampled query',
+        'statement': statement[:MAX_LOGGED_STATEMENT],
+        'duration_ms': round(duration_ms, 2),
+        'params': redact(parameters, executemany),
+        'failed': failed,
+    }))
+
+
+def query_stats():
+    """Return {statement: count, errors, mean/max ms and bucket counts} for every statement seen."""
+    labels = [f"<={bound}ms" for bound in HISTOGRAM_BOUNDS_MS] + [f">{HISTOGRAM_BOUNDS_MS[-1]}ms"]
+    with _lock:
+        return {
+            statement: {
+                'count': histogram.count,
+                'errors': histogram.errors,
+                'mean_ms': round(histogram.total / histogram.count, 3),
+                'max_ms': round(histogram.max, 3),
+                'buckets': {label: n for label, n in zip(labels, histogram.buckets) if n > 0},
+            }
+            for statement, histogram in _histograms.items()
+        }
+
+
+def dump_query_stats():
+    print(json.dumps({'severity': 'INFO', 'message': 'query stats', 'statements': query_stats()}))
+
+
+def reset_query_stats():
+    with _lock:
+        _histograms.clear()
+
+
+def instrument_engine(engine):
+    """Time every statement the SQLAlchemy engine sends to the database."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['query_started'].pop()
+        record(statement, parameters, time.perf_counter() - started, executemany)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(exception_context):
+        conn = exception_context.connection
+        if conn is None or len(conn.info.get('query_started', [])) == 0 or exception_context.statement is None:
+            return
+        started = conn.info['query_started'].pop()
+        executemany = getattr(exception_context.execution_context, 'executemany', False)
+        record(exception_context.statement, exception_context.parameters, time.perf_counter() - started,
+               executemany, failed=True)
+
+    return engine
+
+
+def _dump_on_signal(signum, frame):
+    dump_query_stats()
+
+
+# Signal handlers can only be installed from the main thread
+if hasattr(signal, 'SIGUSR1') and threading.current_thread() is threading.main_thread():
+    try:
+        if signal.getsignal(signal.SIGUSR1) in (signal.SIG_DFL, None):
+            signal.signal(signal.SIGUSR1, _dump_on_signal)
+    except ValueError:
+        pass
@@ -0,0 +1,41 @@
+"""The 12 patient counts of a record, stored inline on mo_records.
+
+A record always has the same three age groups, and each group has new/old
+male/female counts. The counts are kept in 12 INTEGER columns of
+mo_records, named <age group prefix>_<new|old>_<male|female>. These are the
+same names the rollup tables use, so reads need no join and no matching on
+group names. Migration 0004 keeps record_groups, with its old
+one-row-per-group shape, in sync with these columns through triggers, for
+anything that still reads or writes it.
+"""
+
+# record_groups.name -> column prefix on mo_records and the rollup tables
+AGE_GROUPS = {
+    '0-15 years': 'up_to_15',
+    '15-60 years': 'up_to_60',
+    '60+ years': 'after_60',
+}
+COUNT_FIELDS = ['new_male', 'new_female', 'old_male', 'old_female']
+COUNT_COLUMNS = [f"{prefix}_{field}" for prefix in AGE_GROUPS.values() for field in COUNT_FIELDS]
+NEW_COUNT_COLUMNS = [column for column in COUNT_COLUMNS if '_new_' in column]
+OLD_COUNT_COLUMNS = [column for column in COUNT_COLUMNS if '_old_' in column]
+# Each Movana medicine-days figure is the patient count times this
+MEDICINE_DAYS_PER_PATIENT = 4
+
+
+def group_counts(groups):
+    """Column -> count for a request's "groups" list, in age group order; missing groups count 0."""
+    counts = dict.fromkeys(COUNT_COLUMNS, 0)
+    for prefix, group in zip(AGE_GROUPS.values(), groups):
+        for field in COUNT_FIELDS:
+            counts[f"{prefix}_{field}"] = group.get(field) or 0
+    return counts
+
+
+def groups_json_sql(alias="r"):
+    """SQL for a JSON array of the record's three groups, like json_agg over record_groups rows minus their id."""
+    objects = []
+    for name, prefix in AGE_GROUPS.items():
+        fields = ", ".join(f"'{field}', {alias}.{prefix}_{field}" for field in COUNT_FIELDS)
+        objects.append(f"json_build_object('name', '{name}', {fields}, 'record_id', {alias}.id)")
+    return "json_build_array(" + ", ".join(objects) + ")"
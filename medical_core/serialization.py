@@ -0,0 +1,158 @@
+"""JSON encoding and Accept-Encoding negotiation for API responses.
+
+encode_json() produces the body flask.jsonify would, meaning sorted keys,
+compact separators, RFC 822 dates and a trailing newline. It uses orjson
+when installed (API_JSON_SERIALIZER=orjson|stdlib overrides the choice).
+orjson writes non-ASCII characters as UTF-8 rather than \\u escapes;
+otherwise the bytes are the same. Other encoders can be added with
+register_serializer().
+
+compress() gzips or brotli-compresses a body the client accepts, once it
+is at least API_COMPRESS_MIN_BYTES long. compress_stream() does the same
+for a body produced piece by piece, for streamed responses.
+"""
+import dataclasses
+import decimal
+import gzip
+import json
+import os
+import uuid
+import zlib
+from datetime import date
+
+from werkzeug.http import http_date
+
+API_JSON_SERIALIZER = os.environ.get('API_JSON_SERIALIZER', '')
+# Smaller bodies fit in a packet or two anyway and are not worth the CPU
+API_COMPRESS_MIN_BYTES = int(os.environ.get('API_COMPRESS_MIN_BYTES', 1024))
+API_GZIP_LEVEL = int(os.environ.get('API_GZIP_LEVEL', 5))
+API_BROTLI_QUALITY = int(os.environ.get('API_BROTLI_QUALITY', 4))
+
+
+def json_default(o):
+    # Same conversions as Flask's default JSON provider
+    if isinstance(o, date):
+        return http_date(o)
+    if isinstance(o, (decimal.Decimal, uuid.UUID)):
+        return str(o)
+    if dataclasses.is_dataclass(o) and not isinstance(o, type):
+        return dataclasses.asdict(o)
+    if hasattr(o, "__html__"):
+        return str(o.__html__())
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def _stdlib_dumps(obj):
+    return (json.dumps(obj, default=json_default, ensure_ascii=True, sort_keys=True, separators=(",", ":")) + "\n").encode()
+
+
+def _orjson_dumps():
+    import orjson
+
+    # Dates are passed to json_default so they keep Flask's RFC 822 format
+    options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_SORT_KEYS | orjson.OPT_APPEND_NEWLINE | orjson.OPT_NON_STR_KEYS
+
+    def dumps(obj):
+        return orjson.dumps(obj, default=json_default, option=options)
+
+    return dumps
+
+
+_serializers = {'stdlib': lambda: _stdlib_dumps, 'orjson': _orjson_dumps}
+_encode = None
+
+
+def register_serializer(name, factory):
+    """Make factory() -> dumps(obj) -> bytes selectable as API_JSON_SERIALIZER=name."""
+    _serializers[name] = factory
+
+
+def set_serializer(name):
+    global _encode
+    _encode = _serializers[name]()
+
+
+def encode_json(obj):
+    """Encode obj to bytes, as flask.jsonify would send it."""
+    if _encode is None:
+        if API_JSON_SERIALIZER:
+            set_serializer(API_JSON_SERIALIZER)
+        else:
+            try:
+                set_serializer('orjson')
+            except ImportError:
+                set_serializer('stdlib')
+    return _encode(obj)
+
+
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def negotiate_encoding(accept_encoding):
+    """Pick 'br', 'gzip' or None from an Accept-Encoding header value."""
+    if not accept_encoding:
+        return None
+    qualities = {}
+    for part in accept_encoding.split(','):
+        coding, _, params = part.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        qualities[coding.strip().lower()] = quality
+    wildcard = qualities.get('*', 0.0)
+    candidates = []
+    if _brotli() is not None:
+        candidates.append(('br', qualities.get('br', wildcard)))
+    candidates.append(('gzip', qualities.get('gzip', wildcard)))
+    # Highest quality wins; on a tie the order above (brotli first) decides
+    coding, quality = max(candidates, key=lambda candidate: candidate[1])
+    return coding if quality > 0 else None
+
+
+def compress(body, accept_encoding):
+    """Return (body, content_encoding or None) for a client sending accept_encoding."""
+    if len(body) < API_COMPRESS_MIN_BYTES:
+        return body, None
+    coding = negotiate_encoding(accept_encoding)
+    if coding == 'br':
+        return _brotli().compress(body, quality=API_BROTLI_QUALITY), 'br'
+    if coding == 'gzip':
+        return gzip.compress(body, compresslevel=API_GZIP_LEVEL, mtime=0), 'gzip'
+    return body, None
+
+
+def compress_stream(pieces, accept_encoding):
+    """Return (iterator of bytes, content_encoding or None) compressing pieces as they are produced."""
+    coding = negotiate_encoding(accept_encoding)
+    if coding is None:
+        return pieces, None
+
+    def compressed():
+        if coding == 'br':
+            compressor = _brotli().Compressor(quality=API_BROTLI_QUALITY)
+            process, finish = compressor.process, compressor.finish
+        else:
+            # wbits 31 writes a gzip header and trailer around the deflate stream
+            compressor = zlib.compressobj(API_GZIP_LEVEL, zlib.DEFLATED, 31)
+            process, finish = compressor.compress, compressor.flush
+        try:
+            for piece in pieces:
+                out = process(piece)
+                if out:
+                    yield out
+            yield finish()
+        finally:
+            close = getattr(pieces, 'close', None)
+            if close is not None:
+                close()
+
+    return compressed(), coding
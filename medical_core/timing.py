@@ -0,0 +1,93 @@
+"""Per-request phase timings, reported in a Server-Timing header and one log line.
+
+Set SERVER_TIMING=1 to enable. Handlers are wrapped with @timed_request, and
+the slow parts of a request run inside ``with phase("query"):`` blocks.
+Phases with the same name add up, and an outer phase includes the time of
+any phase nested inside it. When disabled, timed_request returns the
+handler unchanged and phase() returns a shared no-op context manager.
+"""
+import functools
+import json
+import os
+import time
+from contextlib import nullcontext
+from contextvars import ContextVar
+
+import flask
+
+SERVER_TIMING_ENABLED = os.environ.get('SERVER_TIMING', '').lower() in ('1', 'true', 'yes')
+
+_NOOP = nullcontext()
+_current = ContextVar('request_timer', default=None)
+
+
+class RequestTimer:
+    __slots__ = ('started', 'phases')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+
+    def add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def header(self, total):
+        entries = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in self.phases.items()]
+        entries.append(f"total;dur={total * 1000:.2f}")
+        return ", ".join(entries)
+
+
+class _Phase:
+    __slots__ = ('timer', 'name', 'started')
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.timer.add(self.name, time.perf_counter() - self.started)
+        return False
+
+
+def phase(name):
+    """Context manager timing one phase of the current request."""
+    if not SERVER_TIMING_ENABLED:
+        return _NOOP
+    timer = _current.get()
+    if timer is None:
+        return _NOOP
+    return _Phase(timer, name)
+
+
+def timed_request(handler):
+    """Time a Cloud Function handler and attach its phases to the response."""
+    if not SERVER_TIMING_ENABLED:
+        return handler
+
+    @functools.wraps(handler)
+    def wrapper(request: flask.Request):
+        timer = RequestTimer()
+        token = _current.set(timer)
+        try:
+            resp = flask.make_response(handler(request))
+        finally:
+            _current.reset(token)
+        total = time.perf_counter() - timer.started
+        resp.headers['Server-Timing'] = timer.header(total)
+        resp.headers['Timing-Allow-Origin'] = '*'
+        print(json.dumps({
+            'severity': 'INFO',
+            'message': 'request timing',
+            'handler': handler.__name__,
+            'method': request.method,
+            'status': resp.status_code,
+            'total_ms': round(total * 1000, 2),
+            'phases_ms': {name: round(seconds * 1000, 2) for name, seconds in timer.phases.items()},
+        }))
+        return resp
+
+    return wrapper
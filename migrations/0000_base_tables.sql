@@ -0,0 +1,19 @@
+-- The tables the Record / RecordGroup models map onto. Existing databases already have
+-- them; this lets a throwaway local Postgres be brought up from nothing.
+CREATE TABLE IF NOT EXISTS mo_records (
+    id SERIAL PRIMARY KEY,
+    opd_type INTEGER,
+    updated_at TIMESTAMP,
+    opd_date DATE,
+    firebase_user_id VARCHAR
+);
+
+CREATE TABLE IF NOT EXISTS record_groups (
+    id SERIAL PRIMARY KEY,
+    name VARCHAR,
+    new_male INTEGER,
+    new_female INTEGER,
+    old_male INTEGER,
+    old_female INTEGER,
+    record_id INTEGER REFERENCES mo_records (id)
+);
@@ -0,0 +1,33 @@
+-- One mo_records row per user and day, and one record_groups row per record and age group,
+-- so the insert path can upsert with ON CONFLICT instead of check-then-write.
+
+-- Older duplicates (the previous duplicate check never matched) lose to the most recently
+-- updated record of the same user and day. Rebuild the rollups afterwards.
+DELETE FROM record_groups g
+USING mo_records r
+WHERE g.record_id = r.id
+  AND EXISTS (
+    SELECT 1 FROM mo_records newer
+    WHERE newer.firebase_user_id = r.firebase_user_id
+      AND newer.opd_date = r.opd_date
+      AND (COALESCE(newer.updated_at, '-infinity'), newer.id) > (COALESCE(r.updated_at, '-infinity'), r.id)
+  );
+
+DELETE FROM mo_records r
+WHERE EXISTS (
+    SELECT 1 FROM mo_records newer
+    WHERE newer.firebase_user_id = r.firebase_user_id
+      AND newer.opd_date = r.opd_date
+      AND (COALESCE(newer.updated_at, '-infinity'), newer.id) > (COALESCE(r.updated_at, '-infinity'), r.id)
+);
+
+DELETE FROM record_groups g
+WHERE EXISTS (
+    SELECT 1 FROM record_groups other
+    WHERE other.record_id = g.record_id
+      AND other.name = g.name
+      AND other.id > g.id
+);
+
+ALTER TABLE mo_records ADD CONSTRAINT mo_records_user_day_key UNIQUE (firebase_user_id, opd_date);
+ALTER TABLE record_groups ADD CONSTRAINT record_groups_record_name_key UNIQUE (record_id, name);
@@ -0,0 +1,83 @@
+"""Create opd_daily_rollups / opd_monthly_rollups and fill them from the existing records.
+
+The DDL and the fill are frozen copies of what rollups.py ran when this
+migration was written, so replaying it on a fresh database always builds the
+schema that was applied in production, however rollups.py changes later.
+At this version the counts live in record_groups, one row per age group.
+"""
+from sqlalchemy import text
+
+CREATE_TABLES_SQL = """
+CREATE TABLE IF NOT EXISTS opd_daily_rollups (
+    firebase_user_id VARCHAR NOT NULL,
+    opd_date DATE NOT NULL,
+    up_to_15_new_male INTEGER NOT NULL DEFAULT 0,
+    up_to_15_new_female INTEGER NOT NULL DEFAULT 0,
+    up_to_15_old_male INTEGER NOT NULL DEFAULT 0,
+    up_to_15_old_female INTEGER NOT NULL DEFAULT 0,
+    up_to_60_new_male INTEGER NOT NULL DEFAULT 0,
+    up_to_60_new_female INTEGER NOT NULL DEFAULT 0,
+    up_to_60_old_male INTEGER NOT NULL DEFAULT 0,
+    up_to_60_old_female INTEGER NOT NULL DEFAULT 0,
+    after_60_new_male INTEGER NOT NULL DEFAULT 0,
+    after_60_new_female INTEGER NOT NULL DEFAULT 0,
+    after_60_old_male INTEGER NOT NULL DEFAULT 0,
+    after_60_old_female INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (firebase_user_id, opd_date)
+);
+CREATE TABLE IF NOT EXISTS opd_monthly_rollups (
+    firebase_user_id VARCHAR NOT NULL,
+    opd_month DATE NOT NULL,
+    up_to_15_new_male INTEGER NOT NULL DEFAULT 0,
+    up_to_15_new_female INTEGER NOT NULL DEFAULT 0,
+    up_to_15_old_male INTEGER NOT NULL DEFAULT 0,
+    up_to_15_old_female INTEGER NOT NULL DEFAULT 0,
+    up_to_60_new_male INTEGER NOT NULL DEFAULT 0,
+    up_to_60_new_female INTEGER NOT NULL DEFAULT 0,
+    up_to_60_old_male INTEGER NOT NULL DEFAULT 0,
+    up_to_60_old_female INTEGER NOT NULL DEFAULT 0,
+    after_60_new_male INTEGER NOT NULL DEFAULT 0,
+    after_60_new_female INTEGER NOT NULL DEFAULT 0,
+    after_60_old_male INTEGER NOT NULL DEFAULT 0,
+    after_60_old_female INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (firebase_user_id, opd_month)
+);
+"""
+
+FILL_SQL = """
+INSERT INTO opd_daily_rollups (firebase_user_id, opd_date,
+        up_to_15_new_male, up_to_15_new_female, up_to_15_old_male, up_to_15_old_female,
+        up_to_60_new_male, up_to_60_new_female, up_to_60_old_male, up_to_60_old_female,
+        after_60_new_male, after_60_new_female, after_60_old_male, after_60_old_female)
+SELECT r.firebase_user_id, r.opd_date,
+        COALESCE(SUM(g.new_male) FILTER (WHERE g.name = '0-15 years'), 0),
+        COALESCE(SUM(g.new_female) FILTER (WHERE g.name = '0-15 years'), 0),
+        COALESCE(SUM(g.old_male) FILTER (WHERE g.name = '0-15 years'), 0),
+        COALESCE(SUM(g.old_female) FILTER (WHERE g.name = '0-15 years'), 0),
+        COALESCE(SUM(g.new_male) FILTER (WHERE g.name = '15-60 years'), 0),
+        COALESCE(SUM(g.new_female) FILTER (WHERE g.name = '15-60 years'), 0),
+        COALESCE(SUM(g.old_male) FILTER (WHERE g.name = '15-60 years'), 0),
+        COALESCE(SUM(g.old_female) FILTER (WHERE g.name = '15-60 years'), 0),
+        COALESCE(SUM(g.new_male) FILTER (WHERE g.name = '60+ years'), 0),
+        COALESCE(SUM(g.new_female) FILTER (WHERE g.name = '60+ years'), 0),
+        COALESCE(SUM(g.old_male) FILTER (WHERE g.name = '60+ years'), 0),
+        COALESCE(SUM(g.old_female) FILTER (WHERE g.name = '60+ years'), 0)
+FROM mo_records r
+JOIN record_groups g ON g.record_id = r.id
+GROUP BY r.firebase_user_id, r.opd_date;
+INSERT INTO opd_monthly_rollups (firebase_user_id, opd_month,
+        up_to_15_new_male, up_to_15_new_female, up_to_15_old_male, up_to_15_old_female,
+        up_to_60_new_male, up_to_60_new_female, up_to_60_old_male, up_to_60_old_female,
+        after_60_new_male, after_60_new_female, after_60_old_male, after_60_old_female)
+SELECT firebase_user_id, date_trunc('month', opd_date)::date,
+        SUM(up_to_15_new_male), SUM(up_to_15_new_female), SUM(up_to_15_old_male), SUM(up_to_15_old_female),
+        SUM(up_to_60_new_male), SUM(up_to_60_new_female), SUM(up_to_60_old_male), SUM(up_to_60_old_female),
+        SUM(after_60_new_male), SUM(after_60_new_female), SUM(after_60_old_male), SUM(after_60_old_female)
+FROM opd_daily_rollups
+GROUP BY firebase_user_id, date_trunc('month', opd_date)::date;
+"""
+
+
+def upgrade(connection):
+    connection.execute(text(CREATE_TABLES_SQL))
+    connection.execute(text(FILL_SQL))
@@ -0,0 +1,12 @@
+-- Indexes behind every handler query.
+
+-- fetch_records_list (page and cursor mode) reads a user's records newest first and seeks
+-- on (opd_date, id); the export fingerprint reads max(updated_at) and count(*) for a month
+-- of one user straight from the index.
+CREATE INDEX IF NOT EXISTS mo_records_user_day_id_idx
+    ON mo_records (firebase_user_id, opd_date, id) INCLUDE (updated_at);
+
+-- Every read joins record_groups on record_id; covering the counts lets the list, detail
+-- and export pivots run as index-only scans.
+CREATE INDEX IF NOT EXISTS record_groups_record_covering_idx
+    ON record_groups (record_id) INCLUDE (name, new_male, new_female, old_male, old_female);
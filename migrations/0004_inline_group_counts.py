@@ -0,0 +1,110 @@
+"""Add the 12 inline count columns to mo_records and keep them in sync with record_groups.
+
+The counts move out of record_groups onto mo_records (see
+medical_core/record_counts.py). The new columns have a constant default, so
+adding them only changes the catalog. record_groups stays a real table, and
+two row triggers keep it and the columns equal whichever handlers write:
+
+- a write to record_groups (the handlers from before the move) recomputes
+  the inline counts of its record;
+- a write of the inline counts (the current handlers) upserts the record's
+  three record_groups rows. An INSERT with all counts 0 writes no groups,
+  because the older handlers insert the record first and its groups after.
+
+Neither trigger acts on a write made by the other one. Records written
+before this migration are copied over by backfill_inline_counts.py, in small
+committed batches, and 0005 refuses to apply until that has finished. The
+rollout is therefore:
+
+    python migrations/migrate.py --to 4
+    python migrations/backfill_inline_counts.py
+    python migrations/migrate.py
+    # then deploy the handlers that read the inline counts
+
+Old and new handlers can write side by side at any point of it. record_groups
+and both triggers can be dropped by a later migration once no deployed
+handler reads or writes the table.
+"""
+from sqlalchemy import text
+
+# Frozen copy of medical_core/record_counts.py at this version
+AGE_GROUPS = {
+    '0-15 years': 'up_to_15',
+    '15-60 years': 'up_to_60',
+    '60+ years': 'after_60',
+}
+COUNT_FIELDS = ['new_male', 'new_female', 'old_male', 'old_female']
+COUNT_COLUMNS = [f"{prefix}_{field}" for prefix in AGE_GROUPS.values() for field in COUNT_FIELDS]
+
+ADD_COLUMNS_SQL = "ALTER TABLE mo_records\n    " + ",\n    ".join(
+    f"ADD COLUMN IF NOT EXISTS {column} INTEGER NOT NULL DEFAULT 0" for column in COUNT_COLUMNS
+)
+
+# The record's counts pivoted from its groups, in COUNT_COLUMNS order
+PIVOT_GROUPS_SQL = "SELECT " + ",\n        ".join(
+    f"COALESCE(SUM(g.{field}) FILTER (WHERE g.name = '{name}'), 0)"
+    for name in AGE_GROUPS for field in COUNT_FIELDS
+) + "\n    FROM record_groups g WHERE g.record_id = r.id"
+
+_SYNC_RECORDS_SQL = f"UPDATE mo_records r SET ({', '.join(COUNT_COLUMNS)}) = ({PIVOT_GROUPS_SQL})\n        WHERE r.id IN "
+
+_new_group_rows = ",\n        ".join(
+    f"('{name}', " + ", ".join(f"NEW.{prefix}_{field}" for field in COUNT_FIELDS) + ", NEW.id)"
+    for name, prefix in AGE_GROUPS.items()
+)
+_new_counts = ", ".join(f"NEW.{column}" for column in COUNT_COLUMNS)
+_zero_counts = ", ".join("0" for _ in COUNT_COLUMNS)
+_group_fields = ", ".join(COUNT_FIELDS)
+_excluded_fields = ", ".join(f"EXCLUDED.{field}" for field in COUNT_FIELDS)
+
+SYNC_TRIGGERS_SQL = f"""
+CREATE OR REPLACE FUNCTION record_groups_sync_inline() RETURNS trigger AS $$
+BEGIN
+    -- A groups write made by mo_records_sync_groups already matches the record
+    IF pg_trigger_depth() > 1 THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'INSERT' THEN
+        {_SYNC_RECORDS_SQL}(NEW.record_id);
+    ELSIF TG_OP = 'DELETE' THEN
+        {_SYNC_RECORDS_SQL}(OLD.record_id);
+    ELSE
+        {_SYNC_RECORDS_SQL}(OLD.record_id, NEW.record_id);
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS record_groups_sync_inline ON record_groups;
+CREATE TRIGGER record_groups_sync_inline
+    AFTER INSERT OR UPDATE OR DELETE ON record_groups
+    FOR EACH ROW EXECUTE FUNCTION record_groups_sync_inline();
+
+CREATE OR REPLACE FUNCTION mo_records_sync_groups() RETURNS trigger AS $$
+BEGIN
+    -- A counts write made by record_groups_sync_inline already matches the groups
+    IF pg_trigger_depth() > 1 THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'INSERT' AND ROW({_new_counts}) = ROW({_zero_counts}) THEN
+        RETURN NULL;
+    END IF;
+    INSERT INTO record_groups (name, {_group_fields}, record_id)
+    VALUES
+        {_new_group_rows}
+    ON CONFLICT (record_id, name) DO UPDATE SET ({_group_fields}) = ({_excluded_fields})
+    WHERE ROW(record_groups.{", record_groups.".join(COUNT_FIELDS)}) IS DISTINCT FROM ROW({_excluded_fields});
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS mo_records_sync_groups ON mo_records;
+CREATE TRIGGER mo_records_sync_groups
+    AFTER INSERT OR UPDATE OF {", ".join(COUNT_COLUMNS)} ON mo_records
+    FOR EACH ROW EXECUTE FUNCTION mo_records_sync_groups();
+"""
+
+
+def upgrade(connection):
+    connection.execute(text(ADD_COLUMNS_SQL))
+    connection.exec_driver_sql(SYNC_TRIGGERS_SQL)
@@ -0,0 +1,53 @@
+"""Refuse to go past 0004 until every record's inline counts match its record_groups rows.
+
+The second half of 0004. Since 0004 its triggers copy every write of either
+side to the other. Records untouched since then still have the 0 defaults
+inline, until backfill_inline_counts.py copies their groups over. This
+migration copies nothing. Copying in either direction would overwrite one
+side with the other, and only the rollout order tells which is current. It
+checks that the backfill has finished and fails, listing a few records,
+while any record still differs. record_groups stays a real table, so
+handlers from before the move keep reading and writing it, including their
+INSERT ... ON CONFLICT (record_id, name) upserts. Deploy order:
+
+    python migrations/migrate.py --to 4        # old handlers keep running
+    python migrations/backfill_inline_counts.py
+    python migrations/migrate.py               # applies this check and the rest
+    # then deploy the handlers that read the inline counts
+"""
+from sqlalchemy import text
+
+# Frozen copy of medical_core/record_counts.py at this version
+AGE_GROUPS = {
+    '0-15 years': 'up_to_15',
+    '15-60 years': 'up_to_60',
+    '60+ years': 'after_60',
+}
+COUNT_FIELDS = ['new_male', 'new_female', 'old_male', 'old_female']
+COUNT_COLUMNS = [f"{prefix}_{field}" for prefix in AGE_GROUPS.values() for field in COUNT_FIELDS]
+
+_pivot_list = ",\n        ".join(
+    f"COALESCE(SUM(g.{field}) FILTER (WHERE g.name = '{name}'), 0)"
+    for name in AGE_GROUPS for field in COUNT_FIELDS
+)
+
+# Records whose inline counts differ from their groups
+DRIFT_SQL = f"""
+SELECT r.id FROM mo_records r
+LEFT JOIN LATERAL (
+    SELECT {_pivot_list}
+    FROM record_groups g WHERE g.record_id = r.id
+) AS expected ON true
+WHERE ROW(r.{", r.".join(COUNT_COLUMNS)}) IS DISTINCT FROM ROW(expected.*)
+ORDER BY r.id
+"""
+
+
+def upgrade(connection):
+    drift = [row[0] for row in connection.execute(text(DRIFT_SQL))]
+    if len(drift) > 0:
+        raise RuntimeError(
+            f"{len(drift)} records have inline counts that differ from record_groups "
+            f"(ids {', '.join(str(record_id) for record_id in drift[:20])}); "
+            "run migrations/backfill_inline_counts.py and migrate again"
+        )
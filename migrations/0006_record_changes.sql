@@ -0,0 +1,45 @@
+-- Change tracking for sync_records: every write stamps the record with the id of the
+-- writing transaction, and deletes leave a tombstone stamped the same way.
+
+-- The records' own updated_at is a client-supplied date, so it cannot order changes.
+-- Existing rows keep 0 and are all sent on a client's first sync.
+ALTER TABLE mo_records ADD COLUMN IF NOT EXISTS change_txid BIGINT NOT NULL DEFAULT 0;
+
+CREATE TABLE IF NOT EXISTS mo_record_tombstones (
+    record_id INTEGER PRIMARY KEY,
+    firebase_user_id VARCHAR NOT NULL,
+    change_txid BIGINT NOT NULL
+);
+
+CREATE OR REPLACE FUNCTION mo_records_stamp_change() RETURNS trigger AS $$
+BEGIN
+    NEW.change_txid := txid_current();
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS mo_records_stamp_change ON mo_records;
+CREATE TRIGGER mo_records_stamp_change
+    BEFORE INSERT OR UPDATE ON mo_records
+    FOR EACH ROW EXECUTE FUNCTION mo_records_stamp_change();
+
+CREATE OR REPLACE FUNCTION mo_records_tombstone() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO mo_record_tombstones (record_id, firebase_user_id, change_txid)
+    VALUES (OLD.id, OLD.firebase_user_id, txid_current())
+    ON CONFLICT (record_id) DO UPDATE SET change_txid = EXCLUDED.change_txid;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS mo_records_tombstone ON mo_records;
+CREATE TRIGGER mo_records_tombstone
+    AFTER DELETE ON mo_records
+    FOR EACH ROW EXECUTE FUNCTION mo_records_tombstone();
+
+-- sync_records seeks a user's changes in (change_txid, id) order; a sync with nothing new
+-- is one probe of each index.
+CREATE INDEX IF NOT EXISTS mo_records_user_change_idx
+    ON mo_records (firebase_user_id, change_txid, id);
+CREATE INDEX IF NOT EXISTS mo_record_tombstones_user_change_idx
+    ON mo_record_tombstones (firebase_user_id, change_txid, record_id);
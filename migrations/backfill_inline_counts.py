@@ -0,0 +1,96 @@
+"""Copy record_groups counts onto the inline mo_records columns, in small batches.
+
+Run this after migration 0004 and before 0005 (see 0004_inline_group_counts.py).
+Records are processed in id order, --batch-size at a time, and each batch
+commits on its own. Row locks are therefore held only briefly, and the script
+can be stopped and re-run at any point. A batch first locks its records and
+only then reads their groups. A handler that writes the record or its
+groups concurrently either finishes first, and the batch sees its groups,
+or waits for the batch and then syncs both sides through the 0004 triggers.
+
+    python migrations/backfill_inline_counts.py [--batch-size 2000] [--pause 0.05]
+    python migrations/backfill_inline_counts.py verify
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sqlalchemy import create_engine, text  # noqa: E402
+
+from medical_core.record_counts import AGE_GROUPS, COUNT_COLUMNS, COUNT_FIELDS  # noqa: E402
+from migrate import db_url  # noqa: E402
+
+_column_list = ", ".join(COUNT_COLUMNS)
+_pivot_list = ",\n        ".join(
+    f"COALESCE(SUM(g.{field}) FILTER (WHERE g.name = '{name}'), 0)"
+    for name in AGE_GROUPS for field in COUNT_FIELDS
+)
+
+LOCK_BATCH_SQL = """
+SELECT id FROM mo_records WHERE id > :after ORDER BY id LIMIT :batch_size FOR UPDATE
+"""
+
+# Separate statement from the lock, so it reads the groups as of after the lock was taken
+COPY_BATCH_SQL = f"""
+UPDATE mo_records r
+SET ({_column_list}) = (
+    SELECT {_pivot_list}
+    FROM record_groups g WHERE g.record_id = r.id
+)
+WHERE r.id = ANY(:ids)
+"""
+
+# Records whose inline counts differ from their groups
+DRIFT_SQL = f"""
+SELECT r.id FROM mo_records r
+LEFT JOIN LATERAL (
+    SELECT {_pivot_list}
+    FROM record_groups g WHERE g.record_id = r.id
+) AS expected ON true
+WHERE ROW(r.{", r.".join(COUNT_COLUMNS)}) IS DISTINCT FROM ROW(expected.*)
+ORDER BY r.id
+"""
+
+
+def backfill(engine, batch_size, pause):
+    after = 0
+    copied = 0
+    while True:
+        with engine.begin() as connection:
+            ids = [row[0] for row in connection.execute(text(LOCK_BATCH_SQL), {'after': after, 'batch_size': batch_size})]
+            if len(ids) == 0:
+                break
+            connection.execute(text(COPY_BATCH_SQL), {'ids': ids})
+        after = ids[-1]
+        copied += len(ids)
+        print(f"{copied} records copied (up to id {after})")
+        # Leaves room for the handlers' own writes between batches
+        time.sleep(pause)
+    return copied
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', nargs='?', default='backfill', choices=['backfill', 'verify'])
+    parser.add_argument('--batch-size', type=int, default=2000)
+    parser.add_argument('--pause', type=float, default=0.05, help='seconds to sleep between batches')
+    args = parser.parse_args(argv)
+
+    engine = create_engine(db_url())
+    if args.command == 'verify':
+        with engine.connect() as connection:
+            drift = [row[0] for row in connection.execute(text(DRIFT_SQL))]
+        for record_id in drift[:20]:
+            print(f"DRIFT record {record_id}")
+        print(f"{len(drift)} records with inline counts that differ from record_groups")
+        return 1 if len(drift) > 0 else 0
+    backfill(engine, args.batch_size, args.pause)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
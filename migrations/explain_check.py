@@ -0,0 +1,131 @@
+"""Fail if any handler query plans a sequential scan on a large dataset.
+
+Meant for a throwaway local Postgres with all migrations applied. With
+--seed it first fills the database with --users x --days synthetic records
+(random counts for all three age groups), rebuilds the rollups and runs
+ANALYZE. It then runs EXPLAIN on every read and write query the five
+functions issue, and exits 1 if any plan contains a Seq Scan on one of our
+tables.
+
+    python migrations/migrate.py
+    python migrations/explain_check.py --seed [--users 500] [--days 730]
+"""
+import argparse
+import importlib.util
+import json
+import os
+import sys
+from datetime import date
+
+from sqlalchemy import create_engine, text
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from medical_core.record_counts import COUNT_COLUMNS  # noqa: E402
+
+FUNCTION_DIRS = ['insert_medical_record', 'fetch_function', 'detail_record', 'export_function', 'stats_function']
+TABLES = {'mo_records', 'record_groups', 'opd_daily_rollups', 'opd_monthly_rollups', 'mo_record_tombstones'}
+CHECK_USER_PREFIX = 'explain-check-'
+SEED_START = date(2020, 1, 1)
+
+_random_counts = ", ".join(["(random() * 40)::int"] * len(COUNT_COLUMNS))
+
+SEED_SQL = f"""
+INSERT INTO mo_records (opd_type, opd_date, updated_at, firebase_user_id, {", ".join(COUNT_COLUMNS)})
+SELECT 1, d::date, d, :prefix || u, {_random_counts}
+FROM generate_series(1, :users) AS u,
+     generate_series(CAST(:start AS date), CAST(:start AS date) + :days - 1, interval '1 day') AS d
+ON CONFLICT DO NOTHING;
+"""
+
+
+def load_function(directory):
+    # Each function is a separate deploy unit with its own main.py
+    path = os.path.join(ROOT, directory, 'main.py')
+    sys.path.insert(0, os.path.join(ROOT, directory))
+    spec = importlib.util.spec_from_file_location(f"{directory}_main", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def handler_queries():
+    """Return [(label, sql, params, is_driver_sql)] for every handler query."""
+    insert_main, fetch_main, detail_main, export_main, stats_main = [load_function(d) for d in FUNCTION_DIRS]
+    user_id = f"{CHECK_USER_PREFIX}1"
+    month_start, month_end = date(2020, 6, 1), date(2020, 6, 30)
+    groups = insert_main.group_params([{"new_male": 1, "new_female": 1, "old_male": 1, "old_female": 1}] * 3)
+    record = {"id": 1, "opd_type": 1, "opd_date": date(2020, 6, 15), "updated_at": date(2020, 6, 15), "user_id": user_id, **groups}
+    month = {"user_id": user_id, "start_date": month_start, "end_date": month_end}
+    return [
+        ("insert: new record", insert_main.INSERT_RECORD_SQL, record, False),
+        ("insert: update record", insert_main.UPDATE_RECORD_SQL, record, False),
+        ("fetch: page", fetch_main.LIST_RECORDS_QUERY.string, {"user_id": user_id, "limit": 20, "offset": 400}, True),
+        ("fetch: cursor", fetch_main.LIST_RECORDS_AFTER_CURSOR_QUERY.string,
+         {"user_id": user_id, "limit": 20, "cursor_date": date(2020, 6, 15), "cursor_id": 2147483647}, True),
+        ("fetch: sync", fetch_main.SYNC_RECORDS_QUERY.string,
+         {"user_id": user_id, "after_txid": 0, "after_id": 0, "limit": fetch_main.SYNC_PAGE_ROWS}, True),
+        ("detail", detail_main.DETAIL_RECORD_QUERY.string, {"id": 1, "user_id": user_id}, True),
+        ("detail: batch", detail_main.DETAIL_RECORDS_BATCH_QUERY.string, {"ids": list(range(1, 21)), "user_id": user_id}, True),
+        ("export: month", export_main.EXPORT_MONTH_SQL, month, False),
+        ("export: fingerprint", export_main.EXPORT_FINGERPRINT_SQL, month, False),
+        ("export: range", export_main.EXPORT_RANGE_SQL, {"user_id": user_id, "start_date": SEED_START, "end_date": date(2021, 12, 31)}, False),
+        ("stats: months", stats_main.STATS_QUERY.string,
+         {"user_id": user_id, "granularity": "month", "start_date": date(2020, 1, 15), "end_date": date(2021, 12, 31),
+          "full_start": date(2020, 2, 1), "full_end": date(2022, 1, 1), "days_only": False}, True),
+    ]
+
+
+def seq_scans(plan):
+    """Yield the relation of every Seq Scan node on one of our tables."""
+    if plan.get('Node Type') == 'Seq Scan' and plan.get('Relation Name') in TABLES:
+        yield plan['Relation Name']
+    for child in plan.get('Plans', []):
+        yield from seq_scans(child)
+
+
+def seed(engine, users, days):
+    sys.path.insert(0, os.path.join(ROOT, 'insert_medical_record'))
+    from rollups import rebuild_rollups
+
+    with engine.begin() as connection:
+        connection.execute(text(SEED_SQL), {"prefix": CHECK_USER_PREFIX, "users": users, "days": days, "start": SEED_START})
+        rebuild_rollups(connection)
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.exec_driver_sql("VACUUM ANALYZE")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seed', action='store_true', help='load synthetic data before checking')
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--days', type=int, default=730)
+    args = parser.parse_args(argv)
+
+    db_url = f"postgresql://{os.environ.get('DB_USER')}:{os.environ.get('DB_PASSWORD')}@{os.environ.get('DB_HOST')}:{os.environ.get('DB_PORT')}/{os.environ.get('DB_NAME')}"
+    engine = create_engine(db_url)
+    if args.seed:
+        seed(engine, args.users, args.days)
+
+    failures = 0
+    with engine.connect() as connection:
+        for label, query, params, is_driver_sql in handler_queries():
+            if is_driver_sql:
+                plan = connection.exec_driver_sql("EXPLAIN (FORMAT JSON) " + query, params).scalar()
+            else:
+                plan = connection.execute(text("EXPLAIN (FORMAT JSON) " + query), params).scalar()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            scanned = sorted(set(seq_scans(plan[0]['Plan'])))
+            if scanned:
+                failures += 1
+                print(f"FAIL  {label}: sequential scan on {', '.join(scanned)}")
+            else:
+                print(f"ok    {label}")
+        connection.rollback()
+    return 1 if failures > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""Apply the numbered schema migrations in this directory.
+
+Migrations are NNNN_description.sql files (run as-is) or NNNN_description.py
+files defining upgrade(connection). Each one runs in its own transaction and
+is recorded in schema_migrations, so re-running only applies new versions.
+The database comes from the same DB_* environment variables the functions use.
+
+    python migrations/migrate.py            # apply pending migrations
+    python migrations/migrate.py --to 4     # apply pending migrations up to version 4
+    python migrations/migrate.py status     # list applied and pending versions
+"""
+import argparse
+import importlib.util
+import os
+import re
+import sys
+
+from sqlalchemy import create_engine, text
+
+MIGRATIONS_DIR = os.path.dirname(os.path.abspath(__file__))
+MIGRATION_FILE = re.compile(r'^(\d{4})_(\w+)\.(sql|py)$')
+
+
+def db_url():
+    return f"postgresql://{os.environ.get('DB_USER')}:{os.environ.get('DB_PASSWORD')}@{os.environ.get('DB_HOST')}:{os.environ.get('DB_PORT')}/{os.environ.get('DB_NAME')}"
+
+
+def available_migrations():
+    """Return [(version, name, path)] sorted by version."""
+    migrations = []
+    for file_name in os.listdir(MIGRATIONS_DIR):
+        match = MIGRATION_FILE.match(file_name)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(MIGRATIONS_DIR, file_name)))
+    migrations.sort()
+    versions = [version for version, _, _ in migrations]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError("two migrations share a version number")
+    return migrations
+
+
+def applied_versions(connection):
+    connection.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name VARCHAR NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT now()
+        )"""))
+    return {row[0] for row in connection.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def apply_migration(connection, path):
+    if path.endswith('.sql'):
+        with open(path) as f:
+            connection.exec_driver_sql(f.read())
+        return
+    spec = importlib.util.spec_from_file_location(os.path.basename(path)[:-3], path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.upgrade(connection)
+
+
+def migrate(engine, to_version=None):
+    with engine.begin() as connection:
+        applied = applied_versions(connection)
+    for version, name, path in available_migrations():
+        if version in applied:
+            continue
+        if to_version is not None and version > to_version:
+            break
+        with engine.begin() as connection:
+            # Serialise concurrent runs; the loser re-checks and skips what the winner applied
+            connection.execute(text("SELECT pg_advisory_xact_lock(hashtext('schema_migrations'))"))
+            if connection.execute(text("SELECT 1 FROM schema_migrations WHERE version = :v"), {'v': version}).first():
+                continue
+            print(f"applying {version:04d}_{name}")
+            apply_migration(connection, path)
+            connection.execute(text("INSERT INTO schema_migrations (version, name) VALUES (:v, :n)"), {'v': version, 'n': name})
+
+
+def status(engine):
+    with engine.begin() as connection:
+        applied = applied_versions(connection)
+    for version, name, _ in available_migrations():
+        print(f"{'applied' if version in applied else 'pending'}  {version:04d}_{name}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', nargs='?', default='up', choices=['up', 'status'])
+    parser.add_argument('--to', type=int, default=None, help='stop after this version')
+    args = parser.parse_args(argv)
+
+    engine = create_engine(db_url())
+    if args.command == 'status':
+        status(engine)
+    else:
+        migrate(engine, args.to)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,14 @@
+# Worker and thread model of the consolidated server (server/main.py), from the environment.
+#
+# SERVER_WORKERS processes, each with SERVER_THREADS request threads and its own pools and
+# caches, shared by every function it serves. Threads default to DB_POOL_MAX_SIZE, so every
+# thread can hold a pooled connection at once. For the ASGI app set
+# SERVER_WORKER_CLASS=uvicorn.workers.UvicornWorker and serve main_async:app instead.
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8080)}"
+workers = int(os.environ.get('SERVER_WORKERS', 1))
+threads = int(os.environ.get('SERVER_THREADS', os.environ.get('DB_POOL_MAX_SIZE', 5)))
+worker_class = os.environ.get('SERVER_WORKER_CLASS', 'gthread')
+# Requests are timed out by the platform in front (Cloud Run), not by gunicorn
+timeout = 0
@@ -0,0 +1,63 @@
+"""Every function's handlers in one Flask (WSGI) app, for running them as one service.
+
+The function directories still deploy one by one as before. This module
+loads each function's main.py into a single process and serves each handler
+at /<handler name>, for example POST /fetch_records_list. Everything the
+functions keep per process is then shared by all of them: the psycopg2 pool,
+the SQLAlchemy engine, the Firebase app and token cache, and the export
+cache. Workers and threads are set in gunicorn.conf.py; main_async.py is the
+ASGI version.
+
+    gunicorn -c server/gunicorn.conf.py --chdir server main:app
+"""
+import importlib.util
+import os
+import sys
+
+import flask
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# function directory -> the handlers it exports
+FUNCTIONS = {
+    'insert_medical_record': ['insert_medical_record', 'insert_medical_records_batch'],
+    'fetch_function': ['fetch_records_list', 'sync_records'],
+    'detail_record': ['detail_record', 'detail_records_batch'],
+    'export_function': ['export_medical_records'],
+    'stats_function': ['stats_summary'],
+}
+
+
+def load_function(directory, module_name='main'):
+    # Each function is a separate deploy unit with its own main.py; the modules next to
+    # it (rollups, export_cache, ...) have distinct names, so one sys.path serves them all
+    path = os.path.join(ROOT, directory, f"{module_name}.py")
+    if os.path.join(ROOT, directory) not in sys.path:
+        sys.path.append(os.path.join(ROOT, directory))
+    spec = importlib.util.spec_from_file_location(f"{directory}_{module_name}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+function_modules = {directory: load_function(directory) for directory in FUNCTIONS}
+handlers = {
+    name: getattr(function_modules[directory], name)
+    for directory, names in FUNCTIONS.items() for name in names
+}
+
+app = flask.Flask(__name__)
+
+
+@app.route('/')
+def health():
+    return 'ok'
+
+
+@app.route('/<name>', methods=['GET', 'POST', 'OPTIONS'])
+def dispatch(name):
+    # Called the way functions-framework calls a function: with the request, returning its response
+    handler = handlers.get(name)
+    if handler is None:
+        flask.abort(404)
+    return handler(flask.request._get_current_object())
@@ -0,0 +1,50 @@
+"""The consolidated server as one ASGI app, for uvicorn.
+
+Handlers that have an async version (fetch_records_list and detail_record,
+from their functions' main_async.py) run on the event loop with the shared
+asyncpg pool. Every other handler goes to the WSGI app of main.py, which
+a2wsgi runs on a thread pool. Routes are the same /<handler name> paths.
+
+    uvicorn --app-dir server main_async:app --port 8080
+"""
+import sys
+
+from a2wsgi import WSGIMiddleware
+
+import main
+from medical_core.asgi import asgi_app
+
+# function directory -> the handlers of its main_async.py
+ASYNC_FUNCTIONS = {
+    'fetch_function': ['fetch_records_list'],
+    'detail_record': ['detail_record'],
+}
+
+
+def load_async_function(directory):
+    # main_async.py does "from main import ...", meaning its own function's main.py
+    consolidated_main = sys.modules['main']
+    sys.modules['main'] = main.function_modules[directory]
+    try:
+        return main.load_function(directory, 'main_async')
+    finally:
+        sys.modules['main'] = consolidated_main
+
+
+async_apps = {
+    name: asgi_app(getattr(load_async_function(directory), name))
+    for directory, names in ASYNC_FUNCTIONS.items() for name in names
+}
+wsgi_app = WSGIMiddleware(main.app)
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        # Any of the async apps starts up and closes the shared asyncpg pool
+        await next(iter(async_apps.values()))(scope, receive, send)
+        return
+    async_app = async_apps.get(scope.get('path', '/').strip('/'))
+    if async_app is None:
+        await wsgi_app(scope, receive, send)
+        return
+    await async_app(scope, receive, send)
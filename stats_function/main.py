@@ -0,0 +1,157 @@
+import flask
+from psycopg2 import sql
+from psycopg2.extras import RealDictCursor
+from datetime import datetime, timedelta
+
+from medical_core.api_response import APIResponse
+from medical_core.auth import auth_user_by_token
+from medical_core.db import get_pool
+from medical_core.record_counts import COUNT_COLUMNS, MEDICINE_DAYS_PER_PATIENT, NEW_COUNT_COLUMNS, OLD_COUNT_COLUMNS
+from medical_core.timing import phase, timed_request
+
+# Periods stats_summary can group by, as date_trunc fields (weeks start on Monday)
+STATS_GRANULARITIES = ['day', 'week', 'month', 'year']
+
+_sum_columns = ", ".join(f"SUM({column})::bigint AS {column}" for column in COUNT_COLUMNS)
+_column_list = ", ".join(COUNT_COLUMNS)
+
+# Totals per period between %(start_date)s and %(end_date)s, read from the rollups only:
+# whole months [full_start, full_end) come from opd_monthly_rollups, the days of any partial
+# month at either end from opd_daily_rollups. Day and week periods need the days themselves,
+# so for those every day comes from the daily rollups. A ten year range is at most 120
+# monthly rows plus 60 daily rows, or about 3650 daily rows by day or week.
+STATS_QUERY = sql.SQL(f"""SELECT
+            date_trunc(%(granularity)s, p.period::timestamp)::date AS period_start,
+            {_sum_columns}
+        FROM (
+            SELECT opd_date AS period, {_column_list}
+            FROM opd_daily_rollups
+            where firebase_user_id = %(user_id)s
+                AND opd_date BETWEEN %(start_date)s AND %(end_date)s
+                AND (%(days_only)s OR opd_date < %(full_start)s OR opd_date >= %(full_end)s)
+            UNION ALL
+            SELECT opd_month, {_column_list}
+            FROM opd_monthly_rollups
+            where firebase_user_id = %(user_id)s
+                AND NOT %(days_only)s
+                AND opd_month >= %(full_start)s AND opd_month < %(full_end)s
+        ) p
+        GROUP BY 1
+        ORDER BY 1""")
+
+def non_null_non_empty(data, key):
+    value = data.get(key)
+    if value is None:
+        return False
+
+    if isinstance(value, list):
+        return len(value) > 0
+    else:
+        return True
+
+def execute_query(connection, query, params=None):
+    with phase('query'), connection.cursor(cursor_factory=RealDictCursor) as cursor:
+        if params:
+            cursor.execute(query, params)
+        else:
+            cursor.execute(query)
+        result = cursor.fetchall()
+        return result
+
+def full_months(start_date, end_date):
+    # [full_start, full_end): the first days of the whole calendar months inside the range
+    full_start = start_date if start_date.day == 1 else (start_date.replace(day=1) + timedelta(days=32)).replace(day=1)
+    after_end = end_date + timedelta(days=1)
+    full_end = after_end if after_end.day == 1 else end_date.replace(day=1)
+    return full_start, full_end
+
+def period_end(period_start, granularity):
+    # Last day of the period starting on period_start
+    if granularity == 'day':
+        return period_start
+    if granularity == 'week':
+        return period_start + timedelta(days=6)
+    if granularity == 'month':
+        return (period_start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    return period_start.replace(month=12, day=31)
+
+def period_stats(counts, start_date, end_date):
+    # The 12 counts of a period with its new, old and overall totals and medicine days
+    new_total = sum(counts[column] for column in NEW_COUNT_COLUMNS)
+    old_total = sum(counts[column] for column in OLD_COUNT_COLUMNS)
+    return {
+        "start_date": start_date,
+        "end_date": end_date,
+        "counts": counts,
+        "new_total": new_total,
+        "old_total": old_total,
+        "total": new_total + old_total,
+        "medicine_days": (new_total + old_total) * MEDICINE_DAYS_PER_PATIENT,
+    }
+
+@timed_request
+def stats_summary(request: flask.Request) -> flask.typing.ResponseReturnValue:
+    # New/old x male/female x age group totals and medicine days between start_date and
+    # end_date, one entry per day, week, month or year ("granularity", month by default) plus
+    # the totals of the whole range. Periods that only partly overlap the range are clipped
+    # to it; periods without any record are left out.
+    if request.method == 'OPTIONS':
+        headers = {
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Methods":"*",
+            "Access-Control-Allow-Headers":"*",
+            "Access-Control-Allow-Credentials":"true",
+            "Access-Control-Max-Age":"3600"
+        }
+
+        return ('', 200, headers)
+
+    user_id = auth_user_by_token(request=request)
+    if user_id is None:
+        return APIResponse.error_with_code_message(message="Unauthorized")
+
+    json_data = request.get_json()
+    granularity = json_data.get("granularity") or "month"
+    if granularity not in STATS_GRANULARITIES:
+        return APIResponse.error_with_code_message(message="granularity must be one of " + ", ".join(STATS_GRANULARITIES))
+    if not non_null_non_empty(json_data, "start_date") or not non_null_non_empty(json_data, "end_date"):
+        return APIResponse.error_with_code_message(message="start_date and end_date are required")
+    try:
+        start_date = datetime.strptime(json_data["start_date"], "%a, %d %b %Y %H:%M:%S %Z").date()
+        end_date = datetime.strptime(json_data["end_date"], "%a, %d %b %Y %H:%M:%S %Z").date()
+    except (TypeError, ValueError) as e:
+        print(f"Invalid date: {str(e)}")
+        return APIResponse.error_with_code_message(message="invalid start_date or end_date")
+    if end_date < start_date:
+        return APIResponse.error_with_code_message(message="end_date cannot be before start_date")
+
+    try:
+        full_start, full_end = full_months(start_date, end_date)
+        query_params = {
+            "user_id": user_id, "granularity": granularity, "start_date": start_date, "end_date": end_date,
+            "full_start": full_start, "full_end": full_end, "days_only": granularity in ("day", "week"),
+        }
+        with get_pool().connection() as connection:
+            rows = execute_query(connection, STATS_QUERY, query_params)
+
+        periods = []
+        range_counts = dict.fromkeys(COUNT_COLUMNS, 0)
+        for row in rows:
+            counts = {column: row[column] for column in COUNT_COLUMNS}
+            periods.append(period_stats(
+                counts,
+                max(row["period_start"], start_date),
+                min(period_end(row["period_start"], granularity), end_date),
+            ))
+            for column in COUNT_COLUMNS:
+                range_counts[column] += counts[column]
+
+        return APIResponse.ok_with_data({
+            "granularity": granularity,
+            "periods": periods,
+            "totals": period_stats(range_counts, start_date, end_date),
+        })
+
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        return APIResponse.error_with_code_message(message="something went wrong ::: " + str(e))
@@ -0,0 +1,50 @@
+"""Fixtures for tests that need a real Postgres, and the handler modules they run.
+
+The server comes from the same DB_* environment variables the functions use.
+Every test gets its own throwaway database, created from DB_NAME's server and
+dropped afterwards. Without DB_HOST the tests are skipped.
+"""
+import os
+import sys
+import uuid
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'migrations'))
+
+
+@pytest.fixture
+def engine():
+    if not os.environ.get('DB_HOST'):
+        pytest.skip("DB_HOST is not set")
+    sqlalchemy = pytest.importorskip('sqlalchemy')
+    from migrate import db_url
+
+    admin = sqlalchemy.create_engine(db_url(), isolation_level='AUTOCOMMIT')
+    name = f"medical_test_{uuid.uuid4().hex[:12]}"
+    with admin.connect() as connection:
+        connection.exec_driver_sql(f"CREATE DATABASE {name}")
+    test_engine = sqlalchemy.create_engine(db_url().rsplit('/', 1)[0] + f"/{name}")
+    try:
+        yield test_engine
+    finally:
+        test_engine.dispose()
+        with admin.connect() as connection:
+            connection.exec_driver_sql(f"DROP DATABASE {name}")
+        admin.dispose()
+
+
+@pytest.fixture
+def insert_main():
+    pytest.importorskip('flask')
+    from explain_check import load_function
+    return load_function('insert_medical_record')
+
+
+@pytest.fixture
+def export_main():
+    pytest.importorskip('flask')
+    from explain_check import load_function
+    return load_function('export_function')
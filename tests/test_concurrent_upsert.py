@@ -0,0 +1,63 @@
+"""Concurrent submits of the same day to insert_medical_record save exactly one record."""
+import threading
+from datetime import date
+
+import pytest
+
+flask = pytest.importorskip('flask')
+pytest.importorskip('sqlalchemy')
+
+from sqlalchemy import text  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from migrate import migrate  # noqa: E402
+
+USER = 'concurrent-upsert-user'
+THREADS = 16
+ROUNDS = 5
+
+SAVED_SQL = """
+SELECT count(DISTINCT r.id), count(g.id) FROM mo_records r
+LEFT JOIN record_groups g ON g.record_id = r.id
+WHERE r.firebase_user_id = :user_id AND r.opd_date = :opd_date
+"""
+
+
+def submit(app, insert_main, body, barrier, messages):
+    with app.test_request_context(method='POST', json=body):
+        barrier.wait()
+        resp = insert_main.insert_medical_record(flask.request)
+        messages.append(resp.get_json()['response']['message'])
+
+
+@pytest.mark.parametrize('round_num', range(ROUNDS))
+def test_concurrent_submits_of_one_day(engine, insert_main, monkeypatch, round_num):
+    migrate(engine)
+    monkeypatch.setattr(insert_main, 'Session', sessionmaker(bind=engine))
+    monkeypatch.setattr(insert_main, 'auth_user_by_token', lambda request: USER)
+    app = flask.Flask(__name__)
+
+    opd_date = date(2023, 6, 15 + round_num)
+    opd_date_text = opd_date.strftime("%a, %d %b %Y 00:00:00 GMT")
+    body = {
+        "id": None,
+        "opd_type": 1,
+        "opd_date": opd_date_text,
+        "updated_at": opd_date_text,
+        "groups": [{"new_male": 1, "new_female": 2, "old_male": 3, "old_female": 4}] * 3,
+    }
+    barrier = threading.Barrier(THREADS)
+    messages = []
+    threads = [
+        threading.Thread(target=submit, args=(app, insert_main, body, barrier, messages)) for _ in range(THREADS)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert messages.count("data saved successfully") == 1, set(messages)
+    assert messages.count("Error Duplicate Data") == THREADS - 1, set(messages)
+    with engine.connect() as connection:
+        records, groups = connection.execute(text(SAVED_SQL), {"user_id": USER, "opd_date": opd_date}).one()
+    assert (records, groups) == (1, 3)
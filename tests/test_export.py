@@ -0,0 +1,44 @@
+"""The monthly export's ETag against edits that keep the month's totals."""
+from datetime import date
+
+import pytest
+
+pytest.importorskip('sqlalchemy')
+
+from sqlalchemy import text  # noqa: E402
+
+from migrate import migrate  # noqa: E402
+
+USER = 'export-test-user'
+MONTH = (date(2024, 5, 1), date(2024, 5, 31))
+
+
+def save(engine, insert_main, sql, opd_date, new_male, record_id=None):
+    """Write one record through the insert handler's SQL and refresh its rollups, as the handler does."""
+    from rollups import refresh_rollups
+
+    params = {"id": record_id, "opd_type": 1, "opd_date": opd_date, "updated_at": opd_date, "user_id": USER}
+    params.update(insert_main.group_params([{"new_male": new_male}]))
+    with engine.begin() as connection:
+        saved = connection.execute(text(sql), params).one()
+        refresh_rollups(connection, USER, [opd_date, saved.previous_opd_date])
+    return saved.id
+
+
+def etag(engine, export_main):
+    with engine.connect() as connection:
+        fingerprint = export_main.fetch_export_fingerprint(connection, USER, *MONTH)
+    return export_main.export_etag(USER, MONTH[0], *fingerprint, 'xlsx', export_main.EXPORT_VERSION)
+
+
+def test_moving_patients_between_days_changes_the_etag(engine, insert_main, export_main):
+    migrate(engine)
+    first_id = save(engine, insert_main, insert_main.INSERT_RECORD_SQL, date(2024, 5, 3), 10)
+    second_id = save(engine, insert_main, insert_main.INSERT_RECORD_SQL, date(2024, 5, 4), 2)
+    before = etag(engine, export_main)
+    assert etag(engine, export_main) == before
+
+    # Same records, same updated_at and same month totals; 4 patients moved from the 3rd to the 4th
+    save(engine, insert_main, insert_main.UPDATE_RECORD_SQL, date(2024, 5, 3), 6, first_id)
+    save(engine, insert_main, insert_main.UPDATE_RECORD_SQL, date(2024, 5, 4), 6, second_id)
+    assert etag(engine, export_main) != before
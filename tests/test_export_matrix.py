@@ -0,0 +1,61 @@
+"""export_matrix against a per-cell reference on random sheets; no database needed.
+
+The reference spells out every one of the 24 sheet columns, their totals and
+the Movana row cell by cell, with plain additions. Sheets run from 0 to 62
+days, with counts drawn from small, large and all-zero distributions.
+"""
+import os
+import random
+import sys
+
+import pytest
+
+pytest.importorskip('numpy')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'export_function'))
+
+import export_matrix  # noqa: E402
+from medical_core.record_counts import COUNT_COLUMNS, MEDICINE_DAYS_PER_PATIENT  # noqa: E402
+
+# Case and age group selections of the sheet columns, in column order
+CASES = [['new'], ['old'], ['new', 'old']]
+AGE_GROUP_SETS = [['up_to_15'], ['up_to_60'], ['after_60'], ['up_to_15', 'up_to_60', 'after_60']]
+
+
+def reference_columns(counts):
+    # New case, old case, total case; each as 0-15, 16-60, 60+, all ages; each as male, female
+    columns = []
+    for cases in CASES:
+        for groups in AGE_GROUP_SETS:
+            for sex in ('male', 'female'):
+                columns.append(sum(counts[f"{group}_{case}_{sex}"] for group in groups for case in cases))
+    return columns
+
+
+def reference_sheet(day_rows):
+    rows = [reference_columns(day_row) for day_row in day_rows]
+    totals = [sum(row[column] for row in rows) for column in range(24)]
+    movana = []
+    # (male, female) column pairs: new 0-15/16-60/60+, old 0-15/16-60/60+, grand total
+    for male in (0, 2, 4, 8, 10, 12, 22):
+        male_total, female_total = totals[male], totals[male + 1]
+        movana += [male_total, female_total, male_total + female_total, (male_total + female_total) * MEDICINE_DAYS_PER_PATIENT]
+    return rows, totals, movana
+
+
+def matrix_sheet(day_rows):
+    columns = export_matrix.sheet_columns(export_matrix.counts_matrix(day_rows, COUNT_COLUMNS))
+    totals = columns.sum(axis=0)
+    return columns.tolist(), totals.tolist(), export_matrix.movana_values(totals).tolist()
+
+
+def random_rows(rng, days):
+    high = rng.choice([0, 3, 40, 10 ** 6])
+    return [{column: rng.randint(0, high) for column in COUNT_COLUMNS} for _ in range(days)]
+
+
+@pytest.mark.parametrize('seed', range(500))
+def test_matrix_matches_reference(seed):
+    rng = random.Random(seed)
+    day_rows = random_rows(rng, rng.randint(0, 62))
+    assert matrix_sheet(day_rows) == reference_sheet(day_rows)
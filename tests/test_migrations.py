@@ -0,0 +1,153 @@
+"""The inline-count migrations (0004, 0005) against writers from both sides of the move."""
+from datetime import date
+
+import pytest
+
+pytest.importorskip('sqlalchemy')
+
+from sqlalchemy import text  # noqa: E402
+
+from backfill_inline_counts import backfill  # noqa: E402
+from migrate import migrate  # noqa: E402
+
+# insert_medical_record's write SQL from before the counts moved onto mo_records, frozen
+PRE_INLINE_GROUPS_SQL = """
+    SELECT g.name, g.new_male, g.new_female, g.old_male, g.old_female, saved.id
+    FROM saved, unnest(
+        CAST(:names AS varchar[]), CAST(:new_male AS integer[]), CAST(:new_female AS integer[]),
+        CAST(:old_male AS integer[]), CAST(:old_female AS integer[])
+    ) AS g(name, new_male, new_female, old_male, old_female)
+"""
+
+PRE_INLINE_INSERT_SQL = """
+WITH saved AS (
+    INSERT INTO mo_records (opd_type, opd_date, updated_at, firebase_user_id)
+    VALUES (:opd_type, :opd_date, :updated_at, :user_id)
+    ON CONFLICT (firebase_user_id, opd_date) DO NOTHING
+    RETURNING id
+), saved_groups AS (
+    INSERT INTO record_groups (name, new_male, new_female, old_male, old_female, record_id)
+""" + PRE_INLINE_GROUPS_SQL + """
+)
+SELECT id, CAST(NULL AS date) AS previous_opd_date FROM saved
+"""
+
+PRE_INLINE_UPDATE_SQL = """
+WITH previous AS (
+    SELECT id, opd_date FROM mo_records
+    WHERE id = :id AND firebase_user_id = :user_id
+    FOR UPDATE
+), saved AS (
+    UPDATE mo_records r
+    SET opd_type = :opd_type, opd_date = :opd_date, updated_at = :updated_at
+    FROM previous
+    WHERE r.id = previous.id
+    RETURNING r.id, previous.opd_date AS previous_opd_date
+), saved_groups AS (
+    INSERT INTO record_groups (name, new_male, new_female, old_male, old_female, record_id)
+""" + PRE_INLINE_GROUPS_SQL + """
+    ON CONFLICT (record_id, name) DO UPDATE SET
+        new_male = EXCLUDED.new_male, new_female = EXCLUDED.new_female,
+        old_male = EXCLUDED.old_male, old_female = EXCLUDED.old_female
+), stale_groups AS (
+    DELETE FROM record_groups
+    WHERE record_id IN (SELECT id FROM saved) AND name <> ALL(CAST(:names AS varchar[]))
+)
+SELECT id, previous_opd_date FROM saved
+"""
+
+GROUP_NAMES = ['0-15 years', '15-60 years', '60+ years']
+USER = 'migration-test-user'
+
+COUNTS_SQL = """
+SELECT up_to_15_new_male, up_to_15_new_female, up_to_15_old_male, up_to_15_old_female,
+    up_to_60_new_male, up_to_60_new_female, up_to_60_old_male, up_to_60_old_female,
+    after_60_new_male, after_60_new_female, after_60_old_male, after_60_old_female
+FROM mo_records WHERE id = :id
+"""
+
+GROUPS_SQL = """
+SELECT name, new_male, new_female, old_male, old_female FROM record_groups WHERE record_id = :id ORDER BY name
+"""
+
+
+def record(opd_date, groups, record_id=None):
+    """Params of a write by the pre-inline handler; groups are (new_male, new_female, old_male, old_female)."""
+    return {
+        "id": record_id, "opd_type": 1, "opd_date": opd_date, "updated_at": opd_date, "user_id": USER,
+        "names": GROUP_NAMES[:len(groups)],
+        "new_male": [group[0] for group in groups],
+        "new_female": [group[1] for group in groups],
+        "old_male": [group[2] for group in groups],
+        "old_female": [group[3] for group in groups],
+    }
+
+
+def inline_record(insert_main, opd_date, groups, record_id=None):
+    """Params of a write by the current handler."""
+    params = {"id": record_id, "opd_type": 1, "opd_date": opd_date, "updated_at": opd_date, "user_id": USER}
+    params.update(insert_main.group_params([
+        {"new_male": group[0], "new_female": group[1], "old_male": group[2], "old_female": group[3]} for group in groups
+    ]))
+    return params
+
+
+def counts(engine, record_id):
+    with engine.connect() as connection:
+        inline = tuple(connection.execute(text(COUNTS_SQL), {"id": record_id}).one())
+        groups = {row[0]: tuple(row[1:]) for row in connection.execute(text(GROUPS_SQL), {"id": record_id})}
+    # Both sides as three (new_male, new_female, old_male, old_female) tuples
+    as_groups = tuple(groups.get(name, (0, 0, 0, 0)) for name in GROUP_NAMES)
+    return tuple(inline[i:i + 4] for i in range(0, 12, 4)), as_groups
+
+
+def write(engine, sql, params):
+    with engine.begin() as connection:
+        return connection.execute(text(sql), params).one().id
+
+
+def test_pre_inline_writes_after_all_migrations(engine):
+    migrate(engine)
+    record_id = write(engine, PRE_INLINE_INSERT_SQL, record(date(2024, 3, 5), [(7, 9, 0, 0), (1, 2, 3, 4)]))
+    assert counts(engine, record_id) == (((7, 9, 0, 0), (1, 2, 3, 4), (0, 0, 0, 0)),) * 2
+
+    # The edit path upserts with ON CONFLICT (record_id, name) and deletes groups left out
+    write(engine, PRE_INLINE_UPDATE_SQL, record(date(2024, 3, 5), [(8, 9, 1, 1)], record_id))
+    assert counts(engine, record_id) == (((8, 9, 1, 1), (0, 0, 0, 0), (0, 0, 0, 0)),) * 2
+
+
+def test_inline_writes_reach_record_groups(engine, insert_main):
+    migrate(engine)
+    record_id = write(engine, insert_main.INSERT_RECORD_SQL, inline_record(insert_main, date(2024, 3, 5), [(42, 5, 0, 0)]))
+    assert counts(engine, record_id) == (((42, 5, 0, 0), (0, 0, 0, 0), (0, 0, 0, 0)),) * 2
+
+    write(engine, insert_main.UPDATE_RECORD_SQL, inline_record(insert_main, date(2024, 3, 5), [(1, 1, 1, 1)] * 3, record_id))
+    assert counts(engine, record_id) == (((1, 1, 1, 1),) * 3,) * 2
+
+
+def test_inline_writes_between_0004_and_0005_survive(engine, insert_main):
+    migrate(engine, to_version=3)
+    edited_id = write(engine, PRE_INLINE_INSERT_SQL, record(date(2024, 3, 5), [(5, 5, 0, 0)]))
+    untouched_id = write(engine, PRE_INLINE_INSERT_SQL, record(date(2024, 3, 6), [(3, 0, 0, 2)]))
+
+    migrate(engine, to_version=4)
+    write(engine, insert_main.UPDATE_RECORD_SQL, inline_record(insert_main, date(2024, 3, 5), [(42, 5, 0, 0)], edited_id))
+    new_id = write(engine, insert_main.INSERT_RECORD_SQL, inline_record(insert_main, date(2024, 3, 7), [(7, 9, 0, 0)]))
+
+    backfill(engine, batch_size=2, pause=0)
+    migrate(engine)
+    assert counts(engine, edited_id) == (((42, 5, 0, 0), (0, 0, 0, 0), (0, 0, 0, 0)),) * 2
+    assert counts(engine, untouched_id) == (((3, 0, 0, 2), (0, 0, 0, 0), (0, 0, 0, 0)),) * 2
+    assert counts(engine, new_id) == (((7, 9, 0, 0), (0, 0, 0, 0), (0, 0, 0, 0)),) * 2
+
+
+def test_0005_waits_for_the_backfill(engine):
+    migrate(engine, to_version=3)
+    record_id = write(engine, PRE_INLINE_INSERT_SQL, record(date(2024, 3, 5), [(5, 5, 0, 0)]))
+    migrate(engine, to_version=4)
+
+    with pytest.raises(RuntimeError, match="backfill_inline_counts"):
+        migrate(engine)
+    backfill(engine, batch_size=100, pause=0)
+    migrate(engine)
+    assert counts(engine, record_id) == (((5, 5, 0, 0), (0, 0, 0, 0), (0, 0, 0, 0)),) * 2